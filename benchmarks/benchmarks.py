@@ -0,0 +1,191 @@
+"""
+Benchmarks of the augmentation, training and scoring hot paths, in the style of asv: every class is a benchmark
+suite, its time_* methods are timed after setup(param) for each value in params. Run them with benchmarks/run.py.
+"""
+
+import os
+import shutil
+import tempfile
+
+import numpy as np
+from sklearn.model_selection import train_test_split
+
+from rna import constants
+from rna.analytics import clf_with_correct_settings
+from rna.augment import MultiLabelEncoder, augment_data, augment_splitted_data
+from rna.input_output import get_data_per_cell_type, read_mixture_data
+from rna.lr_system import convert_prob_to_marginal_per_class
+from rna.utils import string2vec
+
+TARGET_CLASSES = sorted(['Vaginal.mucosa and/or Menstrual.secretion'] + list(constants.single_cell_types))
+
+
+def load_single_cell_data():
+    mle = MultiLabelEncoder(len(constants.single_cell_types))
+    X_single, y_nhot_single, n_celltypes, n_features, n_per_celltype, label_encoder, present_markers, \
+        present_celltypes = get_data_per_cell_type(single_cell_types=constants.single_cell_types,
+                                                   remove_structural=True)
+    y_single = mle.transform_single(mle.nhot_to_labels(y_nhot_single))
+    return X_single, y_single, n_celltypes, n_features, label_encoder
+
+
+class ReadData:
+
+    def time_parse_dataset(self):
+        from rna.dataset import Dataset, read_df
+
+        Dataset.from_frame(*read_df('Datasets/Dataset_NFI_rv.xlsx'))
+
+    def time_get_data_per_cell_type(self):
+        get_data_per_cell_type(single_cell_types=constants.single_cell_types, remove_structural=True)
+
+    def time_read_mixture_data(self):
+        _, _, _, _, _, label_encoder, _, _ = get_data_per_cell_type(single_cell_types=constants.single_cell_types,
+                                                                    remove_structural=True)
+        read_mixture_data(len(constants.single_cell_types), label_encoder)
+
+
+class AugmentData:
+    # N_SAMPLES_PER_COMBINATION
+    params = [1, 10, 25]
+
+    def setup(self, n_samples_per_combination):
+        self.X_single, self.y_single, self.n_celltypes, self.n_features, self.label_encoder = load_single_cell_data()
+
+    def time_augment_data(self, n_samples_per_combination):
+        augment_data(self.X_single, self.y_single, self.n_celltypes, self.n_features, n_samples_per_combination,
+                     self.label_encoder, binarize=True)
+
+
+class ConvertProbToMarginal:
+    n_samples = 10000
+
+    def setup(self):
+        n_celltypes = len(constants.single_cell_types)
+        self.target_classes = np.eye(n_celltypes, dtype=int)
+        self.target_classes[0, 1] = 1
+        self.prob_label_powerset = np.random.dirichlet(np.ones(2 ** n_celltypes), self.n_samples)
+        self.prob_sigmoid = np.random.rand(self.n_samples, n_celltypes)
+        self.priors = [1] + [.5] * (n_celltypes - 2) + [0]
+
+    def time_label_powerset(self):
+        convert_prob_to_marginal_per_class(self.prob_label_powerset, self.target_classes, 10)
+
+    def time_label_powerset_with_priors(self):
+        convert_prob_to_marginal_per_class(self.prob_label_powerset, self.target_classes, 10, self.priors,
+                                           self.priors)
+
+    def time_sigmoid(self):
+        convert_prob_to_marginal_per_class(self.prob_sigmoid, self.target_classes, 10)
+
+
+class MultiLabelEncoding:
+    n_samples = 100000
+
+    def setup(self):
+        self.mle = MultiLabelEncoder(len(constants.single_cell_types))
+        self.y_nhot = np.random.randint(2, size=(self.n_samples, len(constants.single_cell_types)))
+        self.labels = self.mle.nhot_to_labels(self.y_nhot)
+
+    def time_nhot_to_labels(self):
+        self.mle.nhot_to_labels(self.y_nhot)
+
+    def time_labels_to_nhot(self):
+        self.mle.labels_to_nhot(self.labels)
+
+
+class Pav:
+    # number of pooled LRs
+    params = [10000, 1000000]
+
+    def setup(self, n_samples):
+        self.labels = np.random.rand(n_samples) < .5
+        self.lrs = 10 ** (np.random.randn(n_samples) + self.labels)
+
+    def time_pav_calibrator(self, n_samples):
+        from rna.metrics import PavCalibrator
+
+        PavCalibrator().fit(self.lrs, self.labels).transform(self.lrs)
+
+    def time_lir_isotonic_calibrator(self, n_samples):
+        from lir.calibration import IsotonicCalibrator
+
+        IsotonicCalibrator().fit(self.lrs, self.labels.astype(int)).transform(self.lrs)
+
+    def time_cllr_min(self, n_samples):
+        from rna.metrics import LrMetrics
+
+        LrMetrics(self.lrs, self.labels).cllr_min()
+
+    def time_lir_cllr_min(self, n_samples):
+        from lir import calculate_cllr
+
+        calculate_cllr(self.lrs[~self.labels], self.lrs[self.labels]).cllr_min
+
+
+class PredictLrs:
+    # classifier, softmax
+    params = [('MLR', False), ('MLR', True), ('MLP', False), ('MLP', True), ('RF', False), ('SVM', False),
+              ('XGB', False), ('XGB', True)]
+
+    def setup(self, classifier):
+        X_single, y_single, n_celltypes, n_features, label_encoder = load_single_cell_data()
+        _, y_nhot_mixtures, _ = read_mixture_data(n_celltypes, label_encoder)
+        self.target_classes = string2vec(TARGET_CLASSES, label_encoder)
+        X_train, X_calib, y_train, y_calib = train_test_split(X_single, y_single, stratify=y_single, test_size=0.5)
+        augmented_data = augment_splitted_data(X_train, y_train, X_calib, y_calib, None, None, y_nhot_mixtures,
+                                               n_celltypes, n_features, label_encoder, [1] * n_celltypes, [True],
+                                               False, [5, 5, 5], disallowed_mixtures=None)
+        name, softmax = classifier
+        self.model = clf_with_correct_settings(name, softmax=softmax, n_classes=-1, with_calibration=True)
+        if softmax:
+            y_train = MultiLabelEncoder(n_celltypes).nhot_to_labels(augmented_data.y_train_nhot_augmented)
+        else:
+            y_train = augmented_data.target_labels('train', self.target_classes)
+        self.model.fit_classifier(augmented_data.X_train_augmented, y_train)
+        self.model.fit_calibration(augmented_data.X_calib_augmented, augmented_data.y_calib_nhot_augmented,
+                                   self.target_classes)
+        self.X = augmented_data.X_calib_augmented
+
+    def time_predict_lrs(self, classifier):
+        self.model.predict_lrs(self.X, self.target_classes)
+
+
+class NfoldAnalysis:
+    repeat = 1
+    settings = {'nfolds': 1, 'tc': ['Vaginal.mucosa and/or Menstrual.secretion'], 'from_penile': False,
+                'models_list': [['MLR', True]], 'softmax_list': [False], 'priors_list': [[1] * 8],
+                'binarize_list': [True], 'remove_structural': True}
+
+    def setup(self):
+        self.savepath = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.savepath, 'picklesaves'))
+        os.makedirs(os.path.join(self.savepath, 'plots'))
+
+    def teardown(self):
+        shutil.rmtree(self.savepath, ignore_errors=True)
+
+    def time_nfold_analysis_one_fold(self):
+        from rna.analysis import nfold_analysis
+
+        nfold_analysis(savepath=self.savepath, test_size=0.2, calibration_size=0.5, calibration_on_loglrs=True,
+                       nsamples=(10, 10, 5), **NfoldAnalysis.settings)
+
+
+class Makeplots:
+    repeat = 1
+
+    def setup(self):
+        NfoldAnalysis.setup(self)
+        NfoldAnalysis.time_nfold_analysis_one_fold(self)
+
+    def teardown(self):
+        NfoldAnalysis.teardown(self)
+
+    def time_makeplots(self):
+        import matplotlib
+        matplotlib.use('Agg')
+        from rna.analysis import makeplots
+
+        makeplots(path=os.path.join(self.savepath, 'picklesaves'), savepath=os.path.join(self.savepath, 'plots'),
+                  plot_cache=False, **NfoldAnalysis.settings)
@@ -0,0 +1,138 @@
+"""
+Runs the benchmarks in benchmarks/benchmarks.py with fixed seeds and writes the timings to json, optionally comparing
+them to an earlier run:
+
+    python -m benchmarks.run -o benchmarks/results/after.json --compare benchmarks/results/before.json
+    python -m benchmarks.run -b AugmentData -b PredictLrs
+"""
+
+import argparse
+import inspect
+import json
+import os
+import platform
+import random
+import subprocess
+import time
+import warnings
+
+import numpy as np
+
+from benchmarks import benchmarks
+
+SEED = 42
+
+
+def reset_seeds():
+    random.seed(SEED)
+    np.random.seed(SEED)
+
+
+def run_benchmark(suite, method_name, param, repeat):
+    """
+    Times one method of a suite for one param, calling setup and teardown around the timings.
+
+    :return: list of the durations in seconds
+    """
+    args = () if param is None else (param,)
+    instance = suite()
+    reset_seeds()
+    if hasattr(instance, 'setup'):
+        instance.setup(*args)
+    durations = []
+    try:
+        for _ in range(repeat):
+            reset_seeds()
+            start = time.perf_counter()
+            getattr(instance, method_name)(*args)
+            durations.append(time.perf_counter() - start)
+    finally:
+        if hasattr(instance, 'teardown'):
+            instance.teardown()
+    return durations
+
+
+def run_benchmarks(patterns=None, repeat=3):
+    """
+    Runs all benchmarks whose name contains one of the patterns.
+
+    :return: dict: benchmark name -> dict with the durations and their minimum and median
+    """
+    results = {}
+    for suite_name, suite in inspect.getmembers(benchmarks, inspect.isclass):
+        if suite.__module__ != benchmarks.__name__:
+            continue
+        for method_name, _ in inspect.getmembers(suite, inspect.isfunction):
+            if not method_name.startswith('time_'):
+                continue
+            for param in getattr(suite, 'params', [None]):
+                name = '{}.{}'.format(suite_name, method_name) + ('' if param is None else '({})'.format(param))
+                if patterns and not any(pattern in name for pattern in patterns):
+                    continue
+                durations = run_benchmark(suite, method_name, param, getattr(suite, 'repeat', repeat))
+                results[name] = {'durations': durations, 'min': min(durations),
+                                 'median': float(np.median(durations))}
+                print('{:<70} {:10.4f}s'.format(name, results[name]['min']))
+    return results
+
+
+def compare(results, baseline, threshold):
+    """
+    Prints the ratio of each timing to the baseline and returns the names of the benchmarks that got slower than
+    threshold times the baseline.
+    """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        ratio = result['min'] / baseline[name]['min']
+        flag = ''
+        if ratio > threshold:
+            flag = 'SLOWER'
+            regressions.append(name)
+        elif ratio < 1 / threshold:
+            flag = 'faster'
+        print('{:<70} {:8.2f}x {}'.format(name, ratio, flag))
+    return regressions
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time the augmentation, training and scoring hot paths.')
+    parser.add_argument('-b', '--bench', action='append', default=None,
+                        help='only run the benchmarks whose name contains this, may be given more than once')
+    parser.add_argument('-o', '--output', default=None,
+                        help='json file to write the results to, defaults to benchmarks/results/<commit>.json')
+    parser.add_argument('--repeat', type=int, default=3, help='number of timings per benchmark')
+    parser.add_argument('--compare', default=None, help='json file of an earlier run to compare to')
+    parser.add_argument('--threshold', type=float, default=1.2,
+                        help='report benchmarks that are this many times slower than in --compare')
+    args = parser.parse_args(argv)
+
+    warnings.filterwarnings('ignore')
+    results = run_benchmarks(args.bench, args.repeat)
+
+    commit = git_commit()
+    output = args.output or os.path.join('benchmarks', 'results', '{}.json'.format(commit or 'results'))
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump({'commit': commit, 'python': platform.python_version(), 'numpy': np.__version__,
+                   'machine': platform.platform(), 'results': results}, f, indent=1)
+    print('wrote {}'.format(output))
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            raise SystemExit('{} benchmarks got slower: {}'.format(len(regressions), ', '.join(regressions)))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,27 +1,106 @@
 import logging
 import os
-from random import sample, choice, choices, shuffle
+from random import sample, choice, shuffle
 from typing import Dict, Tuple, Iterable
 
 import numpy as np
-import pandas as pd
 from keras.utils import Sequence
 from sklearn import preprocessing
 from sklearn.model_selection import train_test_split
 from sklearn.preprocessing import LabelEncoder
 
+from rna.dataset import Dataset, read_dataset
+
 
 logger = logging.getLogger('main')
 
+# order of the sampling modes, see DataGenerator.sampling
+MODES = ('single', 'augment', 'mixture')
+
+
+class SamplePool:
+    """
+    The samples of one sample group (single or mixture) in flat arrays, so the samples of a whole batch can be drawn
+    at once: all replicates stacked in one array, with for each sample type the range of its samples and for each
+    sample the range of its replicates.
+    """
+    def __init__(self, samples_per_type: Dict[str, list], encoder: preprocessing.LabelEncoder, blank_labels: Iterable):
+        """
+        Initialization
+
+        :param samples_per_type: dict with for each sample type a list of samples (replicates x features)
+        :param encoder: label encoder fitted on the classes
+        :param blank_labels: sample types that are blanks (i.e. have no classes)
+        """
+        self.types = list(samples_per_type.keys())
+        samples = [np.atleast_2d(replicates) for sample_type in self.types
+                   for replicates in samples_per_type[sample_type]]
+        # samples of each type
+        self.type_count = np.array([len(samples_per_type[sample_type]) for sample_type in self.types], dtype=int)
+        self.type_start = np.cumsum(self.type_count) - self.type_count
+        # replicates of each sample
+        self.replicate_count = np.array([replicates.shape[0] for replicates in samples], dtype=int)
+        self.replicate_start = np.cumsum(self.replicate_count) - self.replicate_count
+        self.replicates = np.concatenate(samples).astype(float) if samples else np.zeros((0, 0))
+        self.means = np.array([np.mean(replicates, 0) for replicates in samples])
+        # classes of each type (none for blanks), mixture types are separated by '+'
+        classes = [[] if sample_type in blank_labels else list(encoder.transform(sample_type.split('+')))
+                   for sample_type in self.types]
+        self.label_count = np.array([len(type_classes) for type_classes in classes], dtype=int)
+        self.label_start = np.cumsum(self.label_count) - self.label_count
+        self.labels = np.array([class_ for type_classes in classes for class_ in type_classes], dtype=int)
+
+    def __len__(self) -> int:
+        return len(self.types)
+
+    def draw(self, type_idx: np.array, conc: str, rng: np.random.RandomState) -> np.array:
+        """
+        Draws a random sample of each of the given types
+
+        :param type_idx: array with the indexes of the sample types
+        :param conc: 'single' to draw a random replicate of each sample, else the mean of the replicates is taken
+        :param rng: random state to draw with
+        :return: a numpy array with a sample per type index
+        """
+        # select random samples from the selected types
+        sample_idx = self.type_start[type_idx] + (rng.rand(len(type_idx)) * self.type_count[type_idx]).astype(int)
+        if conc != "single":
+            return self.means[sample_idx]
+        # select single replicate of each sample
+        replicate_idx = self.replicate_start[sample_idx] + \
+            (rng.rand(len(sample_idx)) * self.replicate_count[sample_idx]).astype(int)
+        return self.replicates[replicate_idx]
+
+    def label_indices(self, rows: np.array, type_idx: np.array) -> Tuple[np.array, np.array]:
+        """
+        Returns the (row, class) indexes of the ones in y for samples of the given types
+
+        :param rows: array with the rows in y of the samples
+        :param type_idx: array with the indexes of the sample types
+        :return: two numpy arrays with the rows and the classes
+        """
+        counts = self.label_count[type_idx]
+        # position of each label in self.labels: the start of its type plus its position within the type
+        offsets = np.repeat(self.label_start[type_idx] - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+        return np.repeat(rows, counts), self.labels[offsets]
+
 
 class DataGenerator(Sequence):
-    """Generates data for Keras"""
+    """
+    Generates data for Keras
+
+    Every batch is drawn with its own random state, seeded with the seed, the epoch and the index of the batch. The
+    batches are therefore the same however many workers (threads or processes) generate them and in whatever order,
+    and workers do not repeat each other's batches.
+    """
     def __init__(self, x, y, encoder: preprocessing.LabelEncoder, blank_labels: Iterable,
                  n_features: int = 19,
                  sampling: Dict[str, int] = None,
                  batch_size: int = 1, batches_per_epoch: int = 1,
-                 shuffle_before_epoch: bool = True, cut_off: int = None):
+                 shuffle_before_epoch: bool = True, cut_off: int = None, seed: int = None):
         """Initialization"""
+        self.seed = np.random.randint(2 ** 31) if seed is None else seed
+        self.epoch = 0
         self.batch_size = batch_size
         self.batches_per_epoch = batches_per_epoch
         self.x = x
@@ -47,7 +126,7 @@ class DataGenerator(Sequence):
         else:
             self.sampling = sampling_def
         self._split_data()
-        self.on_epoch_end()
+        self._build_pools()
 
     def __len__(self) -> int:
         """
@@ -57,6 +136,23 @@ class DataGenerator(Sequence):
         """
         return self.batches_per_epoch
 
+    def _build_pools(self) -> None:
+        """
+        stores the single and mixture samples in flat arrays to draw batches from
+        """
+        self.single_pool = SamplePool(self.single, self.encoder, self.blank_labels)
+        self.mixture_pool = SamplePool(self.mixture, self.encoder, self.blank_labels)
+        # the pools that are drawn from should have samples
+        for mode, pool in (('single', self.single_pool), ('mixture', self.mixture_pool)):
+            if self.sampling[mode] and not len(pool):
+                raise ValueError(f"there are no {mode} samples to draw from, set the weight of '{mode}' in sampling "
+                                 f"to 0")
+        # index of the single sample type of each class, to draw augmented samples
+        self.class_type_idx = np.array([self.single_pool.types.index(class_) for class_ in self.classes], dtype=int)
+        # probability of each mode
+        weights = np.array([self.sampling[mode] for mode in MODES], dtype=float)
+        self.mode_probabilities = weights / weights.sum()
+
     def __getitem__(self, index) -> Tuple[np.array, np.array]:
         """
         Generate one batch of data
@@ -66,43 +162,62 @@ class DataGenerator(Sequence):
         """
         # Find list of IDs
         list_ids_temp = [*range(self.batch_size)]
+        # random state of this batch
+        rng = np.random.RandomState([self.seed, self.epoch, index])
 
         # Generate data
-        x, y = self.__data_generation(list_ids_temp)
+        x, y = self.__data_generation(list_ids_temp, rng)
 
         return x, y
 
-    def __data_generation(self, list_id_temp: list) -> Tuple[np.array, np.array]:
+    def on_epoch_end(self) -> None:
         """
-        Generates a data stream to use in a keras model
+        functions performed on the end of an epoch
+        """
+        # draw other batches in the next epoch
+        self.epoch += 1
+
+    def __data_generation(self, list_id_temp: list, rng: np.random.RandomState) -> Tuple[np.array, np.array]:
+        """
+        Generates a data stream to use in a keras model. The modes, sample types and replicates of the whole batch are
+        drawn at once.
 
         :param list_id_temp: a list containing the index which are placed (i.e. batch size)
+        :param rng: random state to draw the batch with
         :return: Two numpy arrays with the x and y values
         """
         # Initialization
-        x = np.zeros((self.batch_size, self.n_features))
-        y = np.zeros((self.batch_size, self.n_classes), dtype=int)
-
-        # Generate data
-        for i in list_id_temp:
-            # select a mode for the generation of the data
-            mode = choices(['single', 'augment', 'mixture'],
-                           [self.sampling['single'], self.sampling['augment'], self.sampling['mixture']])[0]
-
-            # process according to selected mode
-            if mode == "single":
-                fin_sample, sample_types = self._generate_single_sample()
-            elif mode == "mixture":
-                fin_sample, sample_types = self._generate_mixture_sample()
-            else:
-                fin_sample, sample_types = self._generate_augmented_sample()
-
-            # store x
-            x[i, :] = fin_sample
-            # store y
-            if sample_types:
-                for sample_type_idx in self.encoder.transform(sample_types):
-                    y[i, sample_type_idx] = 1
+        x = np.zeros((len(list_id_temp), self.n_features))
+        y = np.zeros((len(list_id_temp), self.n_classes), dtype=int)
+        rows = np.arange(len(list_id_temp))
+
+        # select a mode for the generation of each sample
+        modes = rng.choice(len(MODES), size=len(rows), p=self.mode_probabilities)
+        label_rows, label_classes = [], []
+
+        # single and mixture samples from a random type (balanced)
+        for mode, pool in (('single', self.single_pool), ('mixture', self.mixture_pool)):
+            mode_rows = rows[modes == MODES.index(mode)]
+            if len(mode_rows):
+                type_idx = rng.randint(len(pool), size=len(mode_rows))
+                x[mode_rows] = pool.draw(type_idx, self.conc, rng)
+                mode_label_rows, mode_label_classes = pool.label_indices(mode_rows, type_idx)
+                label_rows.append(mode_label_rows)
+                label_classes.append(mode_label_classes)
+
+        # augmented samples: the sum of single samples of two different classes
+        augment_rows = rows[modes == MODES.index('augment')]
+        if len(augment_rows):
+            first = rng.randint(self.n_classes, size=len(augment_rows))
+            second = (first + 1 + rng.randint(self.n_classes - 1, size=len(augment_rows))) % self.n_classes
+            for classes in (first, second):
+                x[augment_rows] += self.single_pool.draw(self.class_type_idx[classes], self.conc, rng)
+                label_rows.append(augment_rows)
+                label_classes.append(classes)
+
+        # store y
+        if label_rows:
+            y[np.concatenate(label_rows), np.concatenate(label_classes)] = 1
 
         # use cut-off or 'normalize'
         if self.cut_off:
@@ -113,49 +228,6 @@ class DataGenerator(Sequence):
 
         return x, y
 
-    def _generate_mixture_sample(self) -> Tuple[np.array, list]:
-        """
-        Retrieves a mixture sample from a random class (balanced)
-
-        :return: A numpy array with the sample and the sample types
-        """
-        # Select sample type (i.e. class) from all available keys
-        sample_type = sample(list(self.mixture.keys()), 1)
-        # select random sample from selected sample type
-        samples = choice(self.mixture[sample_type[0]])
-        # get all classes in sample types
-        sample_types = sample_type[0].split("+")
-        # select single sample from replicates or take mean
-        if self.conc == "single":
-            fin_sample = samples[choice(range(samples.shape[0])), :] if len(samples.shape) == 2 else samples
-        else:
-            fin_sample = np.mean(samples, 0) if len(samples.shape) == 2 else samples
-
-        return fin_sample, sample_types
-
-    def _generate_single_sample(self) -> Tuple[np.array, list]:
-        """
-        Retrieves a single sample from a random class (balanced)
-
-        :return: A numpy array with the sample and the sample type
-        """
-        # Select sample type (i.e. class) from all available keys
-        sample_type = sample(self.single.keys(), 1)
-        # select random sample from selected sample type
-        samples = choice(self.single[sample_type[0]])
-        # check if sample is blank
-        if sample_type[0] in self.blank_labels:
-            sample_types = None
-        else:
-            sample_types = sample_type
-        # select single sample from replicates or take mean
-        if self.conc == "single":
-            fin_sample = samples[choice(range(samples.shape[0])), :] if len(samples.shape) == 2 else samples
-        else:
-            fin_sample = np.mean(samples, 0) if len(samples.shape) == 2 else samples
-
-        return fin_sample, sample_types
-
     def _generate_augmented_sample(self) -> Tuple[np.array, list]:
         """
         Generates an augmented sample, which is the sum of two single samples
@@ -318,7 +390,7 @@ class EvalGenerator(DataGenerator):
 def read_data(file: str, cols: dict, labels: dict, cut_off: int,
               include_blanks: bool = False, apply_filter: bool = True) -> Tuple[list, list]:
     """
-    read in data from csv file into pandas and convert it to samples and classes
+    read in data from csv file into a Dataset (see rna.dataset) and convert it to samples and classes
 
     :param file: string of file location
     :param cols: dict with mapping for variable groups
@@ -332,55 +404,42 @@ def read_data(file: str, cols: dict, labels: dict, cut_off: int,
     """
     # Log process
     logger.info(f'==Processing file {file}==')
-    # read data
-    df = pd.read_csv(file)
-    # fill missing with 0
-    df.fillna(0, inplace=True)
+    # read data (parsed once, missing values are filled with 0), only the validation and prediction markers
+    markers = list(dict.fromkeys(list(cols.get('validation')) + list(cols.get('prediction'))))
+    dataset = read_dataset(file, type_column=cols.get('type'), replicate_column=cols.get('replicate'), markers=markers)
     # if blanks should not be included remove them from the data
+    keep = np.ones(len(dataset), dtype=bool)
     if not include_blanks:
-        df = df[~df[cols.get('type')].isin(labels.get('blanks'))]
+        keep &= ~np.isin(dataset.types, labels.get('blanks'))
     if apply_filter:
-        df = df[~df[cols.get('type')].isin(labels.get('filter'))]
+        keep &= ~np.isin(dataset.types, labels.get('filter'))
     # extract samples and classes
-    x, y = extract_samples(df, cols, cut_off)
+    x, y = extract_samples(dataset.select(keep), cols, cut_off)
     # log number of samples
     logger.info(f'Returned {len(x)} valid samples')
 
     return x, y
 
 
-def extract_samples(df: pd.DataFrame, cols: dict, cut_off: int) -> Tuple[list, list]:
+def extract_samples(dataset: Dataset, cols: dict, cut_off: int) -> Tuple[list, list]:
     """
-    Extract the samples and classes from a dataframe
+    Extract the valid samples and classes from a dataset. A sample is valid if each validation marker is above the
+    cut-off in at least one of its replicates.
 
-    :param df: a pandas dataframe
+    :param dataset: a Dataset
     :param cols: dict with mapping for varible groups
         `{'type':str, 'replicate':str, 'validation':list, 'prediction':list}`
     :param cut_off: value at which a marker should be considered valid.
-    :return: the samples (x) and corresponding classes (y)
+    :return: the samples (x, views on the replicates of the dataset) and corresponding classes (y)
     """
-    # check if next replicate value is smaller ot the same as current (indicating a 'new' sample
-    sample_idx = (df[cols.get('replicate')] <= df[cols.get('replicate')].shift()).cumsum()
-    grouped_dfs = df.groupby(sample_idx)
-    # init x and y
-    x, y = list(), list()
-    # setup logging for cleaning
-    dropped = False
-    # iterate over grouped data frames
-    for _, grouped_df in grouped_dfs:
-        # Placeholder for check if sample is valid
-        if np.all((grouped_df[cols.get('validation')] > cut_off).sum() > 0):
-            x.append(np.array(grouped_df[cols.get('prediction')]))
-            y.append(grouped_df[cols.get('type')].iloc[0])
-        else:
-            dropped = True
-            sample_type = grouped_df[cols.get('type')].iloc[0]
-            logger.warning(f'dropped a {sample_type} sample')
-    # if all samples are satisfactory, put this in the log
-    if not dropped:
+    valid = dataset.markers_detected(cols.get('validation'), cut_off)
+    # log the dropped samples, or that all samples are satisfactory
+    for sample_type in dataset.types[~valid]:
+        logger.warning(f'dropped a {sample_type} sample')
+    if np.all(valid):
         logger.info('All samples are contained')
 
-    return x, y
+    return dataset.samples(valid, markers=cols.get('prediction')), dataset.types[valid].tolist()
 
 
 def split_train_test(x, y) -> Tuple[list, list, list, list]:
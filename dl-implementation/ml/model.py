@@ -11,19 +11,20 @@ from keras.layers import Dense, Dropout
 from tensorflow import Tensor
 from tensorflow.contrib.labeled_tensor.python.ops.core import Scalar
 
-from ml.generator import EvalGenerator
+from .generator import EvalGenerator
 
 
 logger = logging.getLogger('main')
 
 
-def build_model(units: int, n_classes: int, n_features: int) -> Model:
+def build_model(units: int, n_classes: int, n_features: int, activation: str = "sigmoid") -> Model:
     """
     Builds deep learning model
 
     :param units: (relative) number of units
     :param n_classes number of classes
     :param n_features: number of features
+    :param activation: activation of the output layer: "sigmoid" (multi-label) or "softmax" (label powerset)
     :return: a keras model
     """
     # set drop out
@@ -40,7 +41,7 @@ def build_model(units: int, n_classes: int, n_features: int) -> Model:
     cnn = Dense(units, activation="sigmoid")(cnn)
 
     # output layer (corresponding to the number of classes)
-    y = Dense(n_classes, activation="sigmoid")(cnn)
+    y = Dense(n_classes, activation=activation)(cnn)
 
     # define inputs and outputs of the model
     model = Model(inputs=x, outputs=y)
@@ -59,18 +60,19 @@ def compile_model(model: Model, optimizer: str = "adam", loss: str = "binary_cro
     model.compile(optimizer=optimizer, loss=loss, metrics=[_accuracy_em])
 
 
-def create_callbacks(batch_size: int, generator: EvalGenerator, log_dir: str,) -> list:
+def create_callbacks(batch_size: int, generator: EvalGenerator, log_dir: str, eval_every: int = None) -> list:
     """
     create callbacks to use in model.fit
 
     :param batch_size: batch size used for training the model
     :param generator: data generator
     :param log_dir: directory which is used for the logging
+    :param eval_every: if given, the metrics per sample group are also computed every eval_every epochs
     :return: a list of callbacks
     """
     # create callbacks
     callbacks = [TensorBoard(log_dir=log_dir, batch_size=batch_size),
-                 MetricsPerType(generator),
+                 MetricsPerType(generator, every_n_epochs=eval_every),
                  ModelCheckpoint(filepath=os.path.join(log_dir, 'model_weights_{epoch:02d}.hdf5'),
                                  save_best_only=False, save_weights_only=True)]
 
@@ -112,64 +114,101 @@ def _accuracy_em(*args) -> Scalar:
 class MetricsPerType(Callback):
     """
     Callback that computes metrics for each sample group (single/augmented/mixture)
+
+    The evaluation samples are gathered once into a matrix per sample group, which is predicted in large batches.
     """
-    def __init__(self, eval_generator: EvalGenerator, threshold: float = .5):
+    def __init__(self, eval_generator: EvalGenerator, threshold: float = .5, every_n_epochs: int = None,
+                 batch_size: int = 1024):
+        """
+        Initialization
+
+        :param eval_generator: generator with the evaluation samples
+        :param threshold: threshold used to classify a prediction as 1/0
+        :param every_n_epochs: if given, the metrics are also computed at the end of every n epochs
+        :param batch_size: number of samples predicted at once
+        """
         object.__init__(self)
         self.eval_generator = eval_generator
         self.threshold = threshold
+        self.every_n_epochs = every_n_epochs
+        self.batch_size = batch_size
+        self.x = None
         self.y_pred = {}
         self.y_true = {}
 
+    def on_epoch_end(self, epoch: int, logs: dict = None) -> None:
+        """
+        calculate metrics at the end of every n epochs
+
+        :param epoch: index of the epoch
+        :param logs: logs from training
+        """
+        if self.every_n_epochs and (epoch + 1) % self.every_n_epochs == 0:
+            logger.info(f'==Metrics after epoch {epoch + 1}==')
+            self._compute_all_metrics()
+
     def on_train_end(self, logs={}) -> None:
         """
         calculate metrics at the and of training
 
         :param logs: logs from training
         """
-        for sample_group, sample_types, index, in self.eval_generator.indexes:
-            # select correct sample(s)
-            samples = self.eval_generator.__getattribute__(sample_group)[sample_types][index]
+        self._compute_all_metrics()
 
+    def _collect_samples(self) -> None:
+        """
+        Stores the (averaged and converted) samples and the ground truth of each sample group in a matrix
+        """
+        generator = self.eval_generator
+        groups = [sample_group for sample_group, _, _ in generator.indexes]
+        self.x, self.y_true = {}, {}
+        for sample_group in dict.fromkeys(groups):
+            # preallocate the matrices of the group
+            n_samples = groups.count(sample_group)
+            self.x[sample_group] = np.zeros((n_samples, generator.n_features))
+            self.y_true[sample_group] = np.zeros((n_samples, generator.n_classes))
+        positions = dict.fromkeys(self.x, 0)
+
+        for sample_group, sample_types, index, in generator.indexes:
+            i = positions[sample_group]
+            positions[sample_group] += 1
+            # select correct sample(s)
+            samples = generator.__getattribute__(sample_group)[sample_types][index]
             # average samples if multiple
-            fin_sample = np.mean(samples, 0) if len(samples.shape) == 2 else samples
-            # convert according to cut-off
-            if self.eval_generator.cut_off:
-                fin_sample = fin_sample > self.eval_generator.cut_off
-            else:
-                fin_sample /= 1000
-
-            # init y
-            y = np.zeros(self.eval_generator.n_classes)
+            self.x[sample_group][i] = np.mean(samples, 0) if len(samples.shape) == 2 else samples
             # Store class
-            if sample_types:
-                if sample_group == 'single':
-                    sample_types = [sample_types]
-                else:
-                    sample_types = sample_types.split("+")
-                for sample_type_idx in self.eval_generator.encoder.transform(sample_types):
-                    y[sample_type_idx] = 1
-
-            # predict
-            y_pred = self.model.predict(np.expand_dims(fin_sample, 0))
-
-            # store per group
-            if sample_group not in self.y_pred:
-                self.y_pred[sample_group] = [y_pred]
-                self.y_true[sample_group] = [y]
+            if sample_group == 'single':
+                sample_types = [] if sample_types in generator.blank_labels else [sample_types]
             else:
-                self.y_pred[sample_group].append(y_pred)
-                self.y_true[sample_group].append(y)
+                sample_types = sample_types.split("+")
+            if sample_types:
+                self.y_true[sample_group][i, generator.encoder.transform(sample_types)] = 1
 
-        for i, sample_group in enumerate(self.y_true.keys()):
-            # extract matrices and print metrics
-            y_pred_mat, y_true_mat = self._convert_and_compute_metrics(sample_group)
+        # convert according to cut-off
+        for sample_group, x in self.x.items():
+            self.x[sample_group] = (x > generator.cut_off).astype(int) if generator.cut_off else x / 1000
 
+    def _compute_all_metrics(self) -> None:
+        """
+        predict all evaluation samples and print the metrics per sample group and for all sample groups
+        """
+        if self.x is None:
+            self._collect_samples()
+
+        # preallocate the matrices of all sample groups
+        n_samples = sum(len(x) for x in self.x.values())
+        y_true_tot = np.zeros((n_samples, self.eval_generator.n_classes))
+        y_pred_tot = np.zeros((n_samples, self.eval_generator.n_classes), dtype=bool)
+        start = 0
+        for sample_group, x in self.x.items():
+            # predict in batches and check if above threshold
+            self.y_pred[sample_group] = self.model.predict(x, batch_size=self.batch_size) >= self.threshold
+            # print metrics
+            self._compute_metrics(sample_group, self.y_true[sample_group], self.y_pred[sample_group])
             # store for total
-            if i == 0:
-                y_true_tot, y_pred_tot = y_true_mat, y_pred_mat
-            else:
-                y_true_tot = np.append(y_true_tot, y_true_mat, 0)
-                y_pred_tot = np.append(y_pred_tot, y_pred_mat, 0)
+            y_true_tot[start:start + len(x)] = self.y_true[sample_group]
+            y_pred_tot[start:start + len(x)] = self.y_pred[sample_group]
+            start += len(x)
 
         # calculate accuracy
         acc_tot = accuracy_score(y_true_tot, y_pred_tot)
@@ -178,22 +217,17 @@ class MetricsPerType(Callback):
         logger.info(f'accuracy: {acc_tot:.2f}')
         logger.info(classification_report(y_true_tot, y_pred_tot, target_names=self.eval_generator.classes))
 
-    def _convert_and_compute_metrics(self, sample_group: str) -> Tuple[np.array, np.array]:
+    def _compute_metrics(self, sample_group: str, y_true_mat: np.array, y_pred_mat: np.array) -> None:
         """
-        Select sample group and extract all samples, compute metrics and return y_true and y_pred as numpy array
+        compute and print the metrics of a sample group
 
         :param sample_group: name of sample group
-        :return: a numpy array with the predictions (binary), a numpy array with the ground truth
+        :param y_true_mat: a numpy array with the ground truth
+        :param y_pred_mat: a numpy array with the predictions (binary)
         """
-        # convert y_true to numpy array
-        y_true_mat = np.array(self.y_true[sample_group])
-        # convert y_pred to numpy array and check if above threshold
-        y_pred_mat = np.squeeze(np.array(self.y_pred[sample_group]) >= self.threshold)
         # calculate accuracy
         acc = accuracy_score(y_true_mat, y_pred_mat)
         # print metrics
         logger.info(f'==Report for {sample_group}==')
         logger.info(f'accuracy: {acc:.2f}')
         logger.info(classification_report(y_true_mat, y_pred_mat, target_names=self.eval_generator.classes))
-
-        return y_pred_mat, y_true_mat
@@ -3,6 +3,7 @@ rna
 
 Usage:
   run-all.py [--blanks] [--mixture] [--augment] [--cutoff] [--units <n>] [--epochs <n>] [--batch <s>]
+             [--workers <n>] [--seed <n>] [--eval-every <n>]
 
 Options:
   -h --help            Show this screen.
@@ -13,9 +14,13 @@ Options:
   --units <n>          Number of units for each conv/dense layer [default: 100]
   --epochs <n>         Number of epochs used for training [default: 100]
   --batch <s>          Size of each batch during training [default: 16]
+  --workers <n>        Number of processes that generate batches in parallel with training [default: 4]
+  --seed <n>           Seed of the random generation of the training batches
+  --eval-every <n>     Also report the metrics per sample group every n epochs (else only after training)
 """
 import logging
-from os.path import join
+import sys
+from os.path import abspath, dirname, join
 from typing import Tuple
 
 import yaml
@@ -23,6 +28,9 @@ from confidence import load_name
 from docopt import docopt
 from keras import Model
 
+# the data are read with the dataset module of the rna package in the parent directory
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
 from ml.generator import generate_data, DataGenerator, EvalGenerator
 from ml.model import build_model, compile_model, create_callbacks
 from utils.utils import create_logging
@@ -81,7 +89,7 @@ def create_generators(arguments: dict, config: dict) -> Tuple[DataGenerator, Eva
     train_generator = DataGenerator(x_train, y_train, encoder=label_encoder, blank_labels=labels.get('blanks'),
                                     n_features=len(cols.get('prediction')), sampling=sampling,
                                     batch_size=int(arguments["--batch"]), batches_per_epoch=len(x_train),
-                                    cut_off=cut_off)
+                                    cut_off=cut_off, seed=int(arguments["--seed"]) if arguments["--seed"] else None)
 
     # init eval generator
     augmented_samples = len(x_test)//2 if arguments["--augment"] else None
@@ -102,20 +110,21 @@ def main(arguments: dict, config: dict, logdir: str) -> None:
     :param logdir: path that is used to store logging
     """
     # create train and validation genrators
-    # train_gen, validation_gen = create_generators(arguments, config)
+    train_gen, validation_gen = create_generators(arguments, config)
     # create model
-    model = create_model(arguments=arguments, config=config, n_classes=???)
+    model = create_model(arguments=arguments, config=config, n_classes=train_gen.n_classes)
     # log model
-    # logger.info("==Model==")
-    # model.summary(print_fn=lambda x: logger.info(x))
+    logger.info("==Model==")
+    model.summary(print_fn=lambda x: logger.info(x))
     # create callbacks
-    # callbacks = create_callbacks(int(arguments['--batch']), validation_gen, logdir)
-
-    # fit model
-    model.fit(x, y, batch_size)
-    # model.fit_generator(train_gen, epochs=int(arguments["--epochs"]), validation_data=validation_gen,
-    #                     callbacks=callbacks, verbose=1, shuffle=False)
-    model.predict()
+    callbacks = create_callbacks(int(arguments['--batch']), validation_gen, logdir,
+                                 eval_every=int(arguments['--eval-every']) if arguments['--eval-every'] else None)
+
+    # fit model, the batches are generated by worker processes (and queued) while the model trains
+    workers = int(arguments["--workers"])
+    model.fit_generator(train_gen, epochs=int(arguments["--epochs"]), validation_data=validation_gen,
+                        callbacks=callbacks, verbose=1, shuffle=False,
+                        workers=workers, use_multiprocessing=workers > 1, max_queue_size=4 * max(workers, 1))
     # store final model.
     model.save(join(LOGDIR, 'model.hdf5'))
 
@@ -10,22 +10,23 @@ import numpy as np
 
 from collections import OrderedDict
 
-from sklearn.linear_model import LogisticRegression
 from tqdm import tqdm
 from sklearn.model_selection import train_test_split
 from typing import List, Tuple
 
-from rna import constants
-from rna.analytics import combine_samples, calculate_accuracy_all_target_classes, cllr, \
+from rna import constants, instrumentation
+from rna.analytics import combine_samples, calculate_accuracy_all_target_classes, cllr, cllr_min, \
     calculate_lrs_for_different_priors, append_lrs_for_all_folds, clf_with_correct_settings
-from rna.augment import MultiLabelEncoder, augment_splitted_data, binarize_and_combine_samples
+from rna.augment import MultiLabelEncoder, augment_splitted_data, binarize_and_combine_samples, \
+    reweight_augmented_data, observed_combinations
 from rna.constants import single_cell_types, marker_names, DEBUG
 from rna.input_output import get_data_per_cell_type, read_mixture_data, \
     save_data_table
-from rna.utils import vec2string, string2vec, bool2str_binarize, bool2str_softmax, LrsBeforeAfterCalib
-from rna.plotting import plot_scatterplots_all_lrs_different_priors, plot_boxplot_of_metric, \
-    plot_progress_of_metric, plot_coefficient_importances, plot_property_all_lrs_all_folds, plot_multiclass_comparison
+from rna.utils import vec2string, string2vec, bool2str_binarize, bool2str_softmax, LrsBeforeAfterCalib, \
+    project_on_target_classes
 from rna.lr_system import MarginalClassifier
+from rna.model_io import save_model, read_model
+from rna.plot_queue import PlotQueue
 
 
 def get_final_trained_mlr_model(tc, single_cell_types, retrain,
@@ -35,11 +36,18 @@ def get_final_trained_mlr_model(tc, single_cell_types, retrain,
                                 remove_structural=True, save_path=None,
                                 alternative_hypothesis=None,
                                 # blood, nasal, vaginal
-                                samples_to_evaluate=np.array([[1] * 3 + [0] + [1] * 5 + [0] * 6])):
+                                samples_to_evaluate=np.array([[1] * 3 + [0] + [1] * 5 + [0] * 6]),
+                                n_bootstraps=0, augment_combinations='all'):
 
     """
     computes or loads the MLR based on all data
+
+    :param n_bootstraps: if retrained and > 0, also plots bootstrap confidence intervals of the LRs of the mixtures
+    :param augment_combinations: 'all' or 'mixtures', the combinations of cell types to augment, see nfold_analysis
     """
+    assert augment_combinations in ('all', 'mixtures')
+    from rna.plotting import plot_coefficient_importances, plot_multiclass_comparison
+
     mle = MultiLabelEncoder(len(single_cell_types))
 
     X_single, y_nhot_single, n_celltypes, n_features, n_per_celltype, label_encoder, present_markers, present_celltypes = \
@@ -68,19 +76,31 @@ def get_final_trained_mlr_model(tc, single_cell_types, retrain,
                                                             y_nhot_mixtures, n_celltypes, n_features,
                                                             label_encoder, prior, [binarize],
                                                             from_penile, [n_samples_per_combination]*3,
-                                                            disallowed_mixtures=None)
+                                                            disallowed_mixtures=None,
+                                                            combinations=observed_combinations(y_nhot_mixtures,
+                                                                                               n_celltypes)
+                                                            if augment_combinations == 'mixtures' else None)
 
-        indices = [np.argwhere(target_classes[i, :] == 1).flatten().tolist() for i in range(target_classes.shape[0])]
-        y_train = np.array([np.max(np.array(augmented_data.y_train_nhot_augmented[:, indices[i]]), axis=1) for i in range(len(indices))]).T
-        # y_calib = np.array([np.max(np.array(augmented_data.y_calib_nhot_augmented[:, indices[i]]), axis=1) for i in range(len(indices))]).T
+        y_train = augmented_data.target_labels('train', target_classes)
 
         model.fit_classifier(augmented_data.X_train_augmented, y_train)
-        model.fit_calibration(augmented_data.X_calib_augmented, augmented_data.y_calib_nhot_augmented, target_classes)
-        pickle.dump(model, open('{}'.format(os.path.join(save_path,
-                                                         model_name)), 'wb'))
+        model.fit_calibration(augmented_data.X_calib_augmented, augmented_data.y_calib_nhot_augmented, target_classes,
+                              y_target=augmented_data.target_labels('calib', target_classes))
+        save_model(model, os.path.join(save_path, model_name), label_encoder.classes_, target_classes,
+                   present_markers)
+
+        if n_bootstraps > 0:
+            from rna.bootstrap import bootstrap_lrs
+            from rna.plotting import plot_lrs_with_bootstrap_ci
+
+            _, _, _, lrs_bootstrap = bootstrap_lrs(X_single, y_single, X_mixtures, target_classes, y_nhot_mixtures,
+                                                   n_celltypes, n_features, label_encoder, prior, binarize,
+                                                   from_penile, n_samples_per_combination,
+                                                   n_bootstraps=n_bootstraps)
+            plot_lrs_with_bootstrap_ci(model.predict_lrs(X_mixtures, target_classes), lrs_bootstrap, target_classes,
+                                       label_encoder, savefig=os.path.join(save_path, 'bootstrap_ci_mixtures'))
     else:
-        model = pickle.load(open('{}'.format(os.path.join(save_path,
-                                                         model_name)), 'rb'))
+        model = read_model(os.path.join(save_path, model_name))
 
     if alternative_hypothesis:
         # also plot LRs of our hypothesis pairs against LRs when H2 is more specific
@@ -101,11 +121,11 @@ def get_final_trained_mlr_model(tc, single_cell_types, retrain,
                                                             from_penile, [n_samples_per_combination]*3,
                                                             disallowed_mixtures=disallowed_mixtures)
 
-        indices = [np.argwhere(target_classes[i, :] == 1).flatten().tolist() for i in range(target_classes.shape[0])]
-        y_train = np.array([np.max(np.array(augmented_data.y_train_nhot_augmented[:, indices[i]]), axis=1) for i in range(len(indices))]).T
+        y_train = augmented_data.target_labels('train', target_classes)
         specific_model = clf_with_correct_settings('MLR', softmax=False, n_classes=-1, with_calibration=True)
         specific_model.fit_classifier(augmented_data.X_train_augmented, y_train)
-        specific_model.fit_calibration(augmented_data.X_calib_augmented, augmented_data.y_calib_nhot_augmented, target_classes)
+        specific_model.fit_calibration(augmented_data.X_calib_augmented, augmented_data.y_calib_nhot_augmented, target_classes,
+                                       y_target=augmented_data.target_labels('calib', target_classes))
 
         log_lrs = []
         specific_log_lrs = []
@@ -141,14 +161,31 @@ def get_final_trained_mlr_model(tc, single_cell_types, retrain,
 
 def nfold_analysis(nfolds, tc, savepath, from_penile: bool, models_list, softmax_list: List[bool],
                    priors_list: List[List], binarize_list: List[bool], test_size: float, calibration_size: float,
-                   remove_structural: bool, calibration_on_loglrs: bool, nsamples: Tuple[int, int, int]):
+                   remove_structural: bool, calibration_on_loglrs: bool, nsamples: Tuple[int, int, int],
+                   reweight_priors: bool = False, combination_distribution: str = None,
+                   augment_combinations: str = 'all'):
+    """
+    Performs the nfold analysis and saves the lrs and performance metrics per fold in savepath/picklesaves.
+
+    :param reweight_priors: if True, augment the data once with uniform priors and express each prior in priors_list
+        as sample weights, rather than augmenting the data again for every prior. The test data is augmented with
+        uniform priors either way. Not supported for 'MLP', which cannot be fitted with sample weights.
+    :param combination_distribution: None to augment all combinations of cell types, or 'size' or 'bernoulli' to
+        sample the combinations (see augment_sampled_data). nsamples are then total numbers of samples.
+    :param augment_combinations: 'all' to augment train and calibration samples for all combinations of cell types,
+        or 'mixtures' for only the combinations of the mixtures and the single cell types (see observed_combinations)
+    """
+    assert augment_combinations in ('all', 'mixtures')
+    if reweight_priors and any(model_calib[0] == 'MLP' for model_calib in models_list):
+        raise ValueError("'MLP' cannot be fitted with sample weights, so 'reweight_priors' cannot be used with it")
 
     mle = MultiLabelEncoder(len(single_cell_types))
     baseline_prior = str(priors_list[0])
 
     # ======= Load data =======
-    X_single, y_nhot_single, n_celltypes, n_features, n_per_celltype, label_encoder, present_markers, present_celltypes = \
-        get_data_per_cell_type(single_cell_types=single_cell_types, remove_structural=remove_structural)
+    with instrumentation.span('read_data'):
+        X_single, y_nhot_single, n_celltypes, n_features, n_per_celltype, label_encoder, present_markers, present_celltypes = \
+            get_data_per_cell_type(single_cell_types=single_cell_types, remove_structural=remove_structural)
     y_single = mle.transform_single(mle.nhot_to_labels(y_nhot_single))
     target_classes = string2vec(tc, label_encoder)
 
@@ -163,7 +200,8 @@ def nfold_analysis(nfolds, tc, savepath, from_penile: bool, models_list, softmax
         lrs_for_model_in_fold = OrderedDict()
         emtpy_numpy_array = np.zeros((len(binarize_list), len(softmax_list), len(models_list), len(priors_list)))
         accuracies_train_n, accuracies_test_n, accuracies_test_as_mixtures_n, accuracies_mixtures_n, accuracies_single_n,\
-        cllr_test_n, cllr_test_as_mixtures_n, cllr_mixtures_n, coeffs = [dict() for i in range(9)]
+        cllr_test_n, cllr_test_as_mixtures_n, cllr_mixtures_n, cllr_min_test_n, cllr_min_mixtures_n, coeffs = \
+            [dict() for i in range(11)]
 
         for target_class in target_classes:
             target_class_str = vec2string(target_class, label_encoder)
@@ -177,22 +215,44 @@ def nfold_analysis(nfolds, tc, savepath, from_penile: bool, models_list, softmax
             cllr_test_n[target_class_str] = emtpy_numpy_array.copy()
             cllr_test_as_mixtures_n[target_class_str] = emtpy_numpy_array.copy()
             cllr_mixtures_n[target_class_str] = emtpy_numpy_array.copy()
+            cllr_min_test_n[target_class_str] = emtpy_numpy_array.copy()
+            cllr_min_mixtures_n[target_class_str] = emtpy_numpy_array.copy()
             coeffs[target_class_str] = np.zeros((len(binarize_list),1,X_single[0].shape[1]+1, len(priors_list)))
         # ======= Split data =======
         X_train, X_test, y_train, y_test = train_test_split(X_single, y_single, stratify=y_single, test_size=test_size)
         X_train, X_calib, y_train, y_calib = train_test_split(X_train, y_train, stratify=y_train, test_size=calibration_size)
 
         for i, binarize in enumerate(binarize_list):
-            X_mixtures, y_nhot_mixtures, mixture_label_encoder = read_mixture_data(n_celltypes, label_encoder, binarize=binarize, remove_structural=remove_structural)
+            with instrumentation.span('read_data', fold=n, binarize=binarize):
+                X_mixtures, y_nhot_mixtures, mixture_label_encoder = read_mixture_data(n_celltypes, label_encoder, binarize=binarize, remove_structural=remove_structural)
+            y_mixtures_target = project_on_target_classes(y_nhot_mixtures, target_classes)
+            combinations = observed_combinations(y_nhot_mixtures, n_celltypes) \
+                if augment_combinations == 'mixtures' else None
 
 
             # ======= Augment data for all priors =======
-            augmented_data = OrderedDict()
-            for p, priors in enumerate(priors_list):
-                augmented_data[str(priors)] = augment_splitted_data(X_train, y_train, X_calib, y_calib, X_test, y_test,
-                                                                    y_nhot_mixtures, n_celltypes, n_features,
-                                                                    label_encoder, priors, binarize_list,
-                                                                    from_penile, nsamples, disallowed_mixtures=None)
+            with instrumentation.span('augment', fold=n, binarize=binarize) as span:
+                augmented_data = OrderedDict()
+                if reweight_priors:
+                    uniform_augmented_data = augment_splitted_data(X_train, y_train, X_calib, y_calib, X_test, y_test,
+                                                                   y_nhot_mixtures, n_celltypes, n_features,
+                                                                   label_encoder, [1] * n_celltypes, binarize_list,
+                                                                   from_penile, nsamples, disallowed_mixtures=None,
+                                                                   combinations=combinations,
+                                                                   combination_distribution=combination_distribution)
+                    for p, priors in enumerate(priors_list):
+                        augmented_data[str(priors)] = reweight_augmented_data(uniform_augmented_data, priors)
+                else:
+                    for p, priors in enumerate(priors_list):
+                        augmented_data[str(priors)] = augment_splitted_data(X_train, y_train, X_calib, y_calib, X_test,
+                                                                            y_test, y_nhot_mixtures, n_celltypes,
+                                                                            n_features, label_encoder, priors,
+                                                                            binarize_list, from_penile, nsamples,
+                                                                            disallowed_mixtures=None,
+                                                                            combinations=combinations,
+                                                                            combination_distribution=combination_distribution)
+                span.add_arrays(X_train_augmented=augmented_data[baseline_prior].X_train_augmented,
+                                X_calib_augmented=augmented_data[baseline_prior].X_calib_augmented)
 
             # ======= Transform data accordingly =======
             if binarize:
@@ -213,12 +273,14 @@ def nfold_analysis(nfolds, tc, savepath, from_penile: bool, models_list, softmax
                     if not model_calib[1]:
                         key_name+='_uncal'
                     key_name_per_fold = str(n) + '_' + key_name
-                    model, lrs_before_calib, lrs_after_calib, y_test_nhot_augmented, \
-                    lrs_before_calib_test_as_mixtures, lrs_after_calib_test_as_mixtures, y_test_as_mixtures_nhot_augmented, \
-                    lrs_before_calib_mixt, lrs_after_calib_mixt = \
-                        calculate_lrs_for_different_priors(augmented_data, X_mixtures, target_classes, baseline_prior,
-                                                           present_markers, model_calib, mle, label_encoder, key_name_per_fold,
-                                                           softmax, calibration_on_loglrs, savepath)
+                    tags = dict(fold=n, binarize=binarize, softmax=softmax, model=str(model_calib))
+                    with instrumentation.context(**tags):
+                        model, lrs_before_calib, lrs_after_calib, y_test_nhot_augmented, \
+                        lrs_before_calib_test_as_mixtures, lrs_after_calib_test_as_mixtures, y_test_as_mixtures_nhot_augmented, \
+                        lrs_before_calib_mixt, lrs_after_calib_mixt = \
+                            calculate_lrs_for_different_priors(augmented_data, X_mixtures, target_classes, baseline_prior,
+                                                               present_markers, model_calib, mle, label_encoder, key_name_per_fold,
+                                                               softmax, calibration_on_loglrs, savepath)
 
                     lrs_for_model_in_fold[key_name] = LrsBeforeAfterCalib(lrs_before_calib, lrs_after_calib, y_test_nhot_augmented,
                                                                           lrs_before_calib_test_as_mixtures, lrs_after_calib_test_as_mixtures, y_test_as_mixtures_nhot_augmented,
@@ -235,65 +297,88 @@ def nfold_analysis(nfolds, tc, savepath, from_penile: bool, models_list, softmax
 
 
                     # ======= Calculate performance metrics =======
-                    for t, target_class in enumerate(target_classes):
+                    with instrumentation.span('metrics', **tags):
+                        test_data = augmented_data[baseline_prior]
+                        y_test_target = test_data.target_labels('test', target_classes)
+                        y_test_as_mixtures_target = test_data.target_labels('test_as_mixtures', target_classes)
                         for p, priors in enumerate(priors_list):
                             str_prior = str(priors)
-                            target_class_str = vec2string(target_class, label_encoder)
-
-                            accuracies_train_n[target_class_str][i, j, k, p] = calculate_accuracy_all_target_classes(
+                            # the accuracies are calculated for all target classes at once
+                            accuracies_train = calculate_accuracy_all_target_classes(
                                 augmented_data[str_prior].X_train_augmented,
-                                augmented_data[str_prior].y_train_nhot_augmented, target_classes, model[str_prior],
-                                mle)[t]
-                            accuracies_test_n[target_class_str][i, j, k, p] = calculate_accuracy_all_target_classes(
-                                augmented_data[baseline_prior].X_test_augmented,
-                                augmented_data[baseline_prior].y_test_nhot_augmented, target_classes, model[str_prior],
-                                mle)[t]
-                            accuracies_test_as_mixtures_n[target_class_str][i, j, k, p] = calculate_accuracy_all_target_classes(
-                                augmented_data[baseline_prior].X_test_as_mixtures_augmented,
-                                augmented_data[baseline_prior].y_test_as_mixtures_nhot_augmented, target_classes,
-                                model[str_prior], mle)[t]
-                            accuracies_mixtures_n[target_class_str][i, j, k, p] = calculate_accuracy_all_target_classes(
-                                X_mixtures, y_nhot_mixtures, target_classes, model[str_prior], mle)[t]
-                            accuracies_single_n[target_class_str][i, j, k, p] = calculate_accuracy_all_target_classes(
+                                augmented_data[str_prior].y_train_nhot_augmented, target_classes, model[str_prior], mle,
+                                y_true_target=augmented_data[str_prior].target_labels('train', target_classes))
+                            accuracies_test = calculate_accuracy_all_target_classes(
+                                test_data.X_test_augmented, test_data.y_test_nhot_augmented, target_classes,
+                                model[str_prior], mle, y_true_target=y_test_target)
+                            accuracies_test_as_mixtures = calculate_accuracy_all_target_classes(
+                                test_data.X_test_as_mixtures_augmented, test_data.y_test_as_mixtures_nhot_augmented,
+                                target_classes, model[str_prior], mle, y_true_target=y_test_as_mixtures_target)
+                            accuracies_mixtures = calculate_accuracy_all_target_classes(
+                                X_mixtures, y_nhot_mixtures, target_classes, model[str_prior], mle,
+                                y_true_target=y_mixtures_target)
+                            accuracies_single = calculate_accuracy_all_target_classes(
                                 X_test_transformed, mle.inv_transform_single(y_test), target_classes, model[str_prior],
-                                mle)[t]
-
-                            cllr_test_n[target_class_str][i, j, k, p] = cllr(
-                                lrs_after_calib[str_prior][:, t], augmented_data[baseline_prior].y_test_nhot_augmented, target_class)
-                            cllr_test_as_mixtures_n[target_class_str][i, j, k, p] = cllr(
-                                lrs_after_calib_test_as_mixtures[str_prior][:, t], augmented_data[baseline_prior].y_test_as_mixtures_nhot_augmented, target_class)
-                            cllr_mixtures_n[target_class_str][i, j, k, p] = cllr(
-                                lrs_after_calib_mixt[str_prior][:, t], y_nhot_mixtures, target_class)
-                            if model_calib[0] == 'MLR' and not softmax:
-                                # save coefficents
-                                intercept, coefficients = model[str(priors)].get_coefficients(t, target_class)
-                                coeffs[target_class_str][i, 0, 0, p] = intercept
-                                for i_coef, coef in enumerate(coefficients):
-                                    coeffs[target_class_str][i, 0, i_coef+1, p] = coef
+                                mle)
+
+                            for t, target_class in enumerate(target_classes):
+                                target_class_str = vec2string(target_class, label_encoder)
+
+                                accuracies_train_n[target_class_str][i, j, k, p] = accuracies_train[t]
+                                accuracies_test_n[target_class_str][i, j, k, p] = accuracies_test[t]
+                                accuracies_test_as_mixtures_n[target_class_str][i, j, k, p] = accuracies_test_as_mixtures[t]
+                                accuracies_mixtures_n[target_class_str][i, j, k, p] = accuracies_mixtures[t]
+                                accuracies_single_n[target_class_str][i, j, k, p] = accuracies_single[t]
+
+                                cllr_test_n[target_class_str][i, j, k, p] = cllr(
+                                    lrs_after_calib[str_prior][:, t], test_data.y_test_nhot_augmented, target_class,
+                                    labels=y_test_target[:, t])
+                                cllr_test_as_mixtures_n[target_class_str][i, j, k, p] = cllr(
+                                    lrs_after_calib_test_as_mixtures[str_prior][:, t],
+                                    test_data.y_test_as_mixtures_nhot_augmented, target_class,
+                                    labels=y_test_as_mixtures_target[:, t])
+                                cllr_mixtures_n[target_class_str][i, j, k, p] = cllr(
+                                    lrs_after_calib_mixt[str_prior][:, t], y_nhot_mixtures, target_class,
+                                    labels=y_mixtures_target[:, t])
+                                cllr_min_test_n[target_class_str][i, j, k, p] = cllr_min(
+                                    lrs_after_calib[str_prior][:, t], test_data.y_test_nhot_augmented, target_class,
+                                    labels=y_test_target[:, t])
+                                cllr_min_mixtures_n[target_class_str][i, j, k, p] = cllr_min(
+                                    lrs_after_calib_mixt[str_prior][:, t], y_nhot_mixtures, target_class,
+                                    labels=y_mixtures_target[:, t])
+                                if model_calib[0] == 'MLR' and not softmax:
+                                    # save coefficents
+                                    intercept, coefficients = model[str(priors)].get_coefficients(t, target_class)
+                                    coeffs[target_class_str][i, 0, 0, p] = intercept
+                                    for i_coef, coef in enumerate(coefficients):
+                                        coeffs[target_class_str][i, 0, i_coef+1, p] = coef
 
         outer.update(1)
 
 
         # ======= Save lrs and performance metrics =======
-        pickle.dump(lrs_for_model_in_fold, open(os.path.join(savepath, 'picklesaves/lrs_for_model_in_fold_{}'.format(n)), 'wb'))
+        with instrumentation.span('pickle', fold=n):
+            pickle.dump(lrs_for_model_in_fold, open(os.path.join(savepath, 'picklesaves/lrs_for_model_in_fold_{}'.format(n)), 'wb'))
 
-        for t, target_class in enumerate(target_classes):
-            target_class_str = vec2string(target_class, label_encoder)
-            target_class_save = target_class_str.replace(" ", "_")
-            target_class_save = target_class_save.replace(".", "_")
-            target_class_save = target_class_save.replace("/", "_")
+            for t, target_class in enumerate(target_classes):
+                target_class_str = vec2string(target_class, label_encoder)
+                target_class_save = target_class_str.replace(" ", "_")
+                target_class_save = target_class_save.replace(".", "_")
+                target_class_save = target_class_save.replace("/", "_")
 
-            pickle.dump(accuracies_train_n[target_class_str], open(os.path.join(savepath, 'picklesaves/accuracies_train_{}_{}'.format(target_class_save, n)), 'wb'))
-            pickle.dump(accuracies_test_n[target_class_str], open(os.path.join(savepath, 'picklesaves/accuracies_test_{}_{}'.format(target_class_save, n)), 'wb'))
-            pickle.dump(accuracies_test_as_mixtures_n[target_class_str], open(os.path.join(savepath, 'picklesaves/accuracies_test_as_mixt_{}_{}'.format(target_class_save, n)), 'wb'))
-            pickle.dump(accuracies_mixtures_n[target_class_str], open(os.path.join(savepath, 'picklesaves/accuracies_mixt_{}_{}'.format(target_class_save, n)), 'wb'))
-            pickle.dump(accuracies_single_n[target_class_str], open(os.path.join(savepath, 'picklesaves/accuracies_single_{}_{}'.format(target_class_save, n)), 'wb'))
+                pickle.dump(accuracies_train_n[target_class_str], open(os.path.join(savepath, 'picklesaves/accuracies_train_{}_{}'.format(target_class_save, n)), 'wb'))
+                pickle.dump(accuracies_test_n[target_class_str], open(os.path.join(savepath, 'picklesaves/accuracies_test_{}_{}'.format(target_class_save, n)), 'wb'))
+                pickle.dump(accuracies_test_as_mixtures_n[target_class_str], open(os.path.join(savepath, 'picklesaves/accuracies_test_as_mixt_{}_{}'.format(target_class_save, n)), 'wb'))
+                pickle.dump(accuracies_mixtures_n[target_class_str], open(os.path.join(savepath, 'picklesaves/accuracies_mixt_{}_{}'.format(target_class_save, n)), 'wb'))
+                pickle.dump(accuracies_single_n[target_class_str], open(os.path.join(savepath, 'picklesaves/accuracies_single_{}_{}'.format(target_class_save, n)), 'wb'))
 
-            pickle.dump(cllr_test_n[target_class_str], open(os.path.join(savepath, 'picklesaves/cllr_test_{}_{}'.format(target_class_save, n)), 'wb'))
-            pickle.dump(cllr_test_as_mixtures_n[target_class_str], open(os.path.join(savepath, 'picklesaves/cllr_test_as_mixt_{}_{}'.format(target_class_save, n)), 'wb'))
-            pickle.dump(cllr_mixtures_n[target_class_str], open(os.path.join(savepath, 'picklesaves/cllr_mixt_{}_{}'.format(target_class_save, n)), 'wb'))
+                pickle.dump(cllr_test_n[target_class_str], open(os.path.join(savepath, 'picklesaves/cllr_test_{}_{}'.format(target_class_save, n)), 'wb'))
+                pickle.dump(cllr_test_as_mixtures_n[target_class_str], open(os.path.join(savepath, 'picklesaves/cllr_test_as_mixt_{}_{}'.format(target_class_save, n)), 'wb'))
+                pickle.dump(cllr_mixtures_n[target_class_str], open(os.path.join(savepath, 'picklesaves/cllr_mixt_{}_{}'.format(target_class_save, n)), 'wb'))
+                pickle.dump(cllr_min_test_n[target_class_str], open(os.path.join(savepath, 'picklesaves/cllr_min_test_{}_{}'.format(target_class_save, n)), 'wb'))
+                pickle.dump(cllr_min_mixtures_n[target_class_str], open(os.path.join(savepath, 'picklesaves/cllr_min_mixt_{}_{}'.format(target_class_save, n)), 'wb'))
 
-            pickle.dump(coeffs[target_class_str], open(os.path.join(savepath, 'picklesaves/coeffs_{}_{}'.format(target_class_save, n)), 'wb'))
+                pickle.dump(coeffs[target_class_str], open(os.path.join(savepath, 'picklesaves/coeffs_{}_{}'.format(target_class_save, n)), 'wb'))
 
 
 def compare_to_multiclass(X_single, y_single, target_classes, tc,
@@ -303,6 +388,9 @@ def compare_to_multiclass(X_single, y_single, target_classes, tc,
     trains a multiclass model and compares its output to the given
     multilabel model, on list of samples
     """
+    from sklearn.linear_model import LogisticRegression
+    from rna.plotting import plot_multiclass_comparison
+
     X = binarize_and_combine_samples(X_single, binarize)
 
     multi_class_model = LogisticRegression()
@@ -328,7 +416,17 @@ def compare_to_multiclass(X_single, y_single, target_classes, tc,
         plot_multiclass_comparison(log_lrs[0], multi_log_lrs, constants.single_cell_types_short, sample, save_path)
 
 
-def makeplots(tc, path, savepath, remove_structural: bool, nfolds, binarize_list, softmax_list, models_list, priors_list, **kwargs):
+def makeplots(tc, path, savepath, remove_structural: bool, nfolds, binarize_list, softmax_list, models_list, priors_list,
+              n_jobs=None, plot_cache=True, **kwargs):
+    """
+    Makes the figures of the nfold analysis saved in path. The figures are rendered in parallel, see PlotQueue.
+
+    :param n_jobs: number of processes to render the figures with, None for the number of cpus
+    :param plot_cache: bool: whether to only render the figures of which the inputs changed since the last call,
+        as recorded in savepath/figures.json
+    """
+    from rna.plotting import plot_scatterplots_all_lrs_different_priors, plot_boxplot_of_metric, \
+        plot_progress_of_metric, plot_property_all_lrs_all_folds
 
     _, _, _, _, _, label_encoder, _, _ = \
         get_data_per_cell_type(single_cell_types=single_cell_types, remove_structural=remove_structural)
@@ -338,7 +436,7 @@ def makeplots(tc, path, savepath, remove_structural: bool, nfolds, binarize_list
     emtpy_numpy_array = np.zeros(
         (nfolds, len(binarize_list), len(softmax_list), len(models_list), len(priors_list)))
     accuracies_train, accuracies_test, accuracies_test_as_mixtures, accuracies_mixtures, accuracies_single, \
-    cllr_test, cllr_test_as_mixtures, cllr_mixtures, coeffs = [dict() for i in range(9)]
+    cllr_test, cllr_test_as_mixtures, cllr_mixtures, cllr_min_test, cllr_min_mixtures, coeffs = [dict() for i in range(11)]
 
     for target_class in target_classes:
         target_class_str = vec2string(target_class, label_encoder)
@@ -352,6 +450,8 @@ def makeplots(tc, path, savepath, remove_structural: bool, nfolds, binarize_list
         cllr_test[target_class_str] = emtpy_numpy_array.copy()
         cllr_test_as_mixtures[target_class_str] = emtpy_numpy_array.copy()
         cllr_mixtures[target_class_str] = emtpy_numpy_array.copy()
+        cllr_min_test[target_class_str] = emtpy_numpy_array.copy()
+        cllr_min_mixtures[target_class_str] = emtpy_numpy_array.copy()
         coeffs[target_class_str] = np.zeros((nfolds, len(binarize_list),1, len(marker_names)-4+1, len(priors_list)))
 
     for n in range(nfolds):
@@ -379,9 +479,14 @@ def makeplots(tc, path, savepath, remove_structural: bool, nfolds, binarize_list
                 open(os.path.join(path, 'cllr_test_as_mixt_{}_{}'.format(target_class_save, n)), 'rb'))
             cllr_mixtures[target_class_str][n, :, :, :, :] = pickle.load(
                 open(os.path.join(path,'cllr_mixt_{}_{}'.format(target_class_save, n)), 'rb'))
+            cllr_min_test[target_class_str][n, :, :, :, :] = pickle.load(
+                open(os.path.join(path, 'cllr_min_test_{}_{}'.format(target_class_save, n)), 'rb'))
+            cllr_min_mixtures[target_class_str][n, :, :, :, :] = pickle.load(
+                open(os.path.join(path, 'cllr_min_mixt_{}_{}'.format(target_class_save, n)), 'rb'))
             coeffs[target_class_str][n, :, :, :, :] = pickle.load(
                 open(os.path.join(path,'coeffs_{}_{}'.format(target_class_save, n)), 'rb'))
 
+    plot_queue = PlotQueue(n_jobs, manifest_path=os.path.join(savepath, 'figures.json') if plot_cache else None)
     types_data = ['test augm', 'mixt']
 
     for type_data in types_data:
@@ -392,16 +497,20 @@ def makeplots(tc, path, savepath, remove_structural: bool, nfolds, binarize_list
         #                           target_classes, label_encoder, savefig=os.path.join(savepath, 'pav_{}'.format(type_data)))
 
         for kind in ['roc', 'histogram']:
-            plot_property_all_lrs_all_folds(lrs_after_for_all_methods, y_nhot_for_all_methods, target_classes,
-                                        label_encoder, kind=kind,
-                                        savefig=os.path.join(savepath, f'{kind}_{type_data}'))
+            # a figure per method
+            for method in lrs_after_for_all_methods:
+                plot_queue.add(plot_property_all_lrs_all_folds, {method: lrs_after_for_all_methods[method]},
+                               {method: y_nhot_for_all_methods[method]}, target_classes, label_encoder, kind=kind,
+                               savefig=os.path.join(savepath, f'{kind}_{type_data}'),
+                               name=os.path.join(savepath, f'{kind}_{type_data}_{method}'))
 
 
     lrs_before_for_all_methods, lrs_after_for_all_methods, \
     y_nhot_for_all_methods = append_lrs_for_all_folds(
         lrs_for_model_per_fold, type='test augm')
     if len(priors_list) > 1:
-        plot_scatterplots_all_lrs_different_priors(
+        plot_queue.add(
+            plot_scatterplots_all_lrs_different_priors,
             lrs_after_for_all_methods, y_nhot_for_all_methods,
             target_classes, label_encoder,
             savefig=os.path.join(savepath, 'LRs_for_different_priors_{}'.format(type_data)))
@@ -413,23 +522,30 @@ def makeplots(tc, path, savepath, remove_structural: bool, nfolds, binarize_list
             target_class_save = target_class_save.replace("/", "_")
 
 
-            plot_boxplot_of_metric(binarize_list, softmax_list, models_list, priors_list, cllr_test[target_class_str], label_encoder, "$C_{llr}$",
+            plot_queue.add(plot_boxplot_of_metric, binarize_list, softmax_list, models_list, priors_list, cllr_test[target_class_str], label_encoder, "$C_{llr}$",
                                    savefig=os.path.join(savepath, 'boxplot_cllr_test_{}'.format(target_class_save)))
-            plot_boxplot_of_metric(binarize_list, softmax_list, models_list, priors_list, cllr_mixtures[target_class_str], label_encoder, "$C_{llr}$",
+            plot_queue.add(plot_boxplot_of_metric, binarize_list, softmax_list, models_list, priors_list, cllr_mixtures[target_class_str], label_encoder, "$C_{llr}$",
                                    savefig=os.path.join(savepath, 'boxplot_cllr_mixtures_{}'.format(target_class_save)))
             if DEBUG:
-                plot_boxplot_of_metric(binarize_list, softmax_list, models_list, priors_list, accuracies_train[target_class_str], label_encoder, 'accuracy',
+                plot_queue.add(plot_boxplot_of_metric, binarize_list, softmax_list, models_list, priors_list, accuracies_train[target_class_str], label_encoder, 'accuracy',
                                        savefig=os.path.join(savepath, 'boxplot_accuracy_train_{}'.format(target_class_save)))
-                plot_boxplot_of_metric(binarize_list, softmax_list, models_list, priors_list, accuracies_test[target_class_str], label_encoder, "accuracy",
+                plot_queue.add(plot_boxplot_of_metric, binarize_list, softmax_list, models_list, priors_list, accuracies_test[target_class_str], label_encoder, "accuracy",
                                        savefig=os.path.join(savepath, 'boxplot_accuracy_test_{}'.format(target_class_save)))
-                plot_boxplot_of_metric(binarize_list, softmax_list, models_list, priors_list, cllr_test_as_mixtures[target_class_str], label_encoder, "$C_{llr}$",
+                plot_queue.add(plot_boxplot_of_metric, binarize_list, softmax_list, models_list, priors_list, cllr_test_as_mixtures[target_class_str], label_encoder, "$C_{llr}$",
                                        savefig=os.path.join(savepath, 'boxplot_cllr_test_as_mixt_{}'.format(target_class_save)))
-                plot_progress_of_metric(binarize_list, softmax_list, models_list, priors_list, accuracies_train[target_class_str], label_encoder, 'accuracy',
+                plot_queue.add(plot_boxplot_of_metric, binarize_list, softmax_list, models_list, priors_list, cllr_min_test[target_class_str], label_encoder, "$C_{llr}^{min}$",
+                                       savefig=os.path.join(savepath, 'boxplot_cllr_min_test_{}'.format(target_class_save)))
+                plot_queue.add(plot_boxplot_of_metric, binarize_list, softmax_list, models_list, priors_list, cllr_test[target_class_str] - cllr_min_test[target_class_str], label_encoder, "$C_{llr}^{cal}$",
+                                       savefig=os.path.join(savepath, 'boxplot_cllr_cal_test_{}'.format(target_class_save)))
+                plot_queue.add(plot_boxplot_of_metric, binarize_list, softmax_list, models_list, priors_list, cllr_min_mixtures[target_class_str], label_encoder, "$C_{llr}^{min}$",
+                                       savefig=os.path.join(savepath, 'boxplot_cllr_min_mixtures_{}'.format(target_class_save)))
+                plot_queue.add(plot_progress_of_metric, binarize_list, softmax_list, models_list, priors_list, accuracies_train[target_class_str], label_encoder, 'accuracy',
                                         savefig=os.path.join(savepath, 'progress_accuracy_train_{}'.format(target_class_save)))
-                plot_progress_of_metric(binarize_list, softmax_list, models_list, priors_list, accuracies_test[target_class_str], label_encoder, 'accuracy',
+                plot_queue.add(plot_progress_of_metric, binarize_list, softmax_list, models_list, priors_list, accuracies_test[target_class_str], label_encoder, 'accuracy',
                                         savefig=os.path.join(savepath, 'progress_accuracy_test_{}'.format(target_class_save)))
-                plot_progress_of_metric(binarize_list, softmax_list, models_list, priors_list, cllr_test[target_class_str], label_encoder, '$C_{llr}$',
+                plot_queue.add(plot_progress_of_metric, binarize_list, softmax_list, models_list, priors_list, cllr_test[target_class_str], label_encoder, '$C_{llr}$',
                                         savefig=os.path.join(savepath, 'progress_cllr_test_{}'.format(target_class_save)))
-                plot_boxplot_of_metric(binarize_list, [False], [[a, True] for a in ['intercept']+marker_names], priors_list, coeffs[target_class_str], label_encoder, "log LR",
+                plot_queue.add(plot_boxplot_of_metric, binarize_list, [False], [[a, True] for a in ['intercept']+marker_names], priors_list, coeffs[target_class_str], label_encoder, "log LR",
                                    savefig=os.path.join(savepath, 'boxplot_coefficients_{}'.format(target_class_save)), ylim=[-3,3])
 
+    plot_queue.run()
@@ -3,18 +3,17 @@ Performs project specific.
 """
 
 import os
+import traceback
 from collections import OrderedDict
 
-# import keras
 import numpy as np
-from lir import calculate_cllr
-from sklearn.metrics import accuracy_score
 from typing import List
 
-from rna.constants import nhot_matrix_all_combinations, DEBUG
+from rna import instrumentation, metrics
+from rna.constants import DEBUG
 from rna.lr_system import MarginalMLPClassifier, MarginalMLRClassifier, \
-    MarginalXGBClassifier, MarginalRFClassifier, MarginalSVMClassifier
-from rna.plotting import plot_calibration_process, plot_insights_cllr, plot_coefficient_importances
+    MarginalXGBClassifier, MarginalRFClassifier, MarginalSVMClassifier, MarginalDLClassifier
+from rna.utils import project_on_target_classes
 
 
 def combine_samples(data_for_class: List):
@@ -30,11 +29,18 @@ def combine_samples(data_for_class: List):
 
 
 def generate_lrs(X_train, y_train, X_calib, y_calib, X_test, X_test_as_mixtures, X_mixtures, target_classes, model, mle,
-                 softmax, calibration_on_loglrs, do_calibration):
+                 softmax, calibration_on_loglrs, do_calibration, sample_weight_train=None, sample_weight_calib=None,
+                 y_train_target=None, y_calib_target=None):
     """
     When softmax the model must be fitted on labels, whereas with sigmoid the model must be fitted on
     an nhot encoded vector representing the labels. Ensure that labels take the correct form, fit the
     model and predict the lrs before and after calibration for both X_test and X_mixtures.
+
+    :param sample_weight_train: None or weight per train sample, used to express the prior
+    :param sample_weight_calib: None or weight per calibration sample, used to express the prior
+    :param y_train_target: None or the train labels projected on the target classes, to reuse (see
+        AugmentedData.target_labels)
+    :param y_calib_target: None or the calibration labels projected on the target classes, to reuse
     """
 
     if softmax:  # y_train must be list with labels
@@ -43,55 +49,57 @@ def generate_lrs(X_train, y_train, X_calib, y_calib, X_test, X_test_as_mixtures,
             # y_test = mle.nhot_to_labels(y_test)
         except:  # already are labels
             pass
-        try:
-            # for DL model y_train must always be nhot encoded
-            # TODO: Find better solution
-            if isinstance(model._classifier, keras.engine.training.Model):
-                y_train = np.eye(2 ** 8)[y_train]
-        except:
-            pass
+    elif y_train_target is not None:
+        y_train = y_train_target
     else:  # y_train must be nhot encoded labels
         try:
             y_train = mle.labels_to_nhot(y_train)
         except:  # already is nhot encoded
             pass
-        indices = [np.argwhere(target_classes[i, :] == 1).flatten().tolist() for i in range(target_classes.shape[0])]
-        y_train = np.array([np.max(np.array(y_train[:, indices[i]]), axis=1) for i in range(len(indices))]).T
+        y_train = project_on_target_classes(y_train, target_classes)
 
     try:  # y_calib must always be nhot encoded
         y_calib = mle.labels_to_nhot(y_calib)
     except:  # already is nhot encoded
         pass
 
-    model.fit_classifier(X_train, y_train)
+    with instrumentation.span('fit') as span:
+        span.add_arrays(X_train=X_train, y_train=y_train)
+        model.fit_classifier(X_train, y_train, sample_weight=sample_weight_train)
+    instrumentation.count('models fitted')
     if do_calibration:
-        model.fit_calibration(X_calib, y_calib, target_classes, calibration_on_loglrs=calibration_on_loglrs)
+        with instrumentation.span('calibrate') as span:
+            span.add_arrays(X_calib=X_calib, y_calib=y_calib)
+            model.fit_calibration(X_calib, y_calib, target_classes, calibration_on_loglrs=calibration_on_loglrs,
+                                  sample_weight=sample_weight_calib, y_target=y_calib_target)
+
+    with instrumentation.span('predict') as span:
+        span.add_arrays(X_test=X_test, X_test_as_mixtures=X_test_as_mixtures, X_mixtures=X_mixtures)
+        lrs_before_calib = model.predict_lrs(X_test, target_classes, with_calibration=False)
+        if do_calibration:
+            lrs_after_calib = model.predict_lrs(X_test, target_classes, calibration_on_loglrs=calibration_on_loglrs)
+        else:
+            lrs_after_calib = lrs_before_calib
 
-    lrs_before_calib = model.predict_lrs(X_test, target_classes, with_calibration=False)
-    if do_calibration:
-        lrs_after_calib = model.predict_lrs(X_test, target_classes, calibration_on_loglrs=calibration_on_loglrs)
-    else:
-        lrs_after_calib = lrs_before_calib
+        try:
+            lrs_before_calib_test_as_mixtures = model.predict_lrs(X_test_as_mixtures, target_classes,
+                                                                  with_calibration=False)
+            if do_calibration:
+                lrs_after_calib_test_as_mixtures = model.predict_lrs(X_test_as_mixtures, target_classes,
+                                                                     calibration_on_loglrs=calibration_on_loglrs)
+            else:
+                lrs_after_calib_test_as_mixtures = lrs_before_calib_test_as_mixtures
+        except TypeError:
+            # When there are no samples from the synthetic data with the same labels as in the original mixtures data.
+            lrs_before_calib_test_as_mixtures = np.zeros([1, lrs_before_calib.shape[1]])
+            lrs_after_calib_test_as_mixtures = np.zeros([1, lrs_before_calib.shape[1]])
 
-    try:
-        lrs_before_calib_test_as_mixtures = model.predict_lrs(X_test_as_mixtures, target_classes,
-                                                              with_calibration=False)
+        lrs_before_calib_mixt = model.predict_lrs(X_mixtures, target_classes, with_calibration=False)
         if do_calibration:
-            lrs_after_calib_test_as_mixtures = model.predict_lrs(X_test_as_mixtures, target_classes,
-                                                                 calibration_on_loglrs=calibration_on_loglrs)
+            lrs_after_calib_mixt = model.predict_lrs(X_mixtures, target_classes,
+                                                     calibration_on_loglrs=calibration_on_loglrs)
         else:
-            lrs_after_calib_test_as_mixtures = lrs_before_calib_test_as_mixtures
-    except TypeError:
-        # When there are no samples from the synthetic data with the same labels as in the original mixtures data.
-        lrs_before_calib_test_as_mixtures = np.zeros([1, lrs_before_calib.shape[1]])
-        lrs_after_calib_test_as_mixtures = np.zeros([1, lrs_before_calib.shape[1]])
-
-    lrs_before_calib_mixt = model.predict_lrs(X_mixtures, target_classes, with_calibration=False)
-    if do_calibration:
-        lrs_after_calib_mixt = model.predict_lrs(X_mixtures, target_classes,
-                                                 calibration_on_loglrs=calibration_on_loglrs)
-    else:
-        lrs_after_calib_mixt = lrs_before_calib_mixt
+            lrs_after_calib_mixt = lrs_before_calib_mixt
 
     return model, lrs_before_calib, lrs_after_calib, lrs_before_calib_test_as_mixtures, lrs_after_calib_test_as_mixtures, \
            lrs_before_calib_mixt, lrs_after_calib_mixt
@@ -136,10 +144,10 @@ def clf_with_correct_settings(clf_no_settings, softmax: bool, n_classes: int, wi
 
     elif clf_no_settings == 'DL':
         if softmax:
-            classifier = MarginalDLClassifier(n_classes=2 ** 8, activation_layer='softmax',
+            classifier = MarginalDLClassifier(activation_layer='softmax',
                                               optimizer="adam", loss="categorical_crossentropy", epochs=30)
         else:
-            classifier = MarginalDLClassifier(n_classes=n_classes, activation_layer='sigmoid',
+            classifier = MarginalDLClassifier(activation_layer='sigmoid',
                                               optimizer="adam", loss="binary_crossentropy", epochs=30)
     elif clf_no_settings == 'RF':
         if softmax:
@@ -156,7 +164,8 @@ def clf_with_correct_settings(clf_no_settings, softmax: bool, n_classes: int, wi
 def perform_analysis(X_train_augmented, y_train_nhot_augmented, X_calib_augmented, y_calib_nhot_augmented,
                      X_test_augmented, y_test_nhot_augmented, X_test_as_mixtures_augmented, X_mixtures, target_classes,
                      present_markers, models, mle, label_encoder, method_name_prior, softmax, calibration_on_loglrs,
-                     output_folder=None):
+                     output_folder=None, sample_weight_train=None, sample_weight_calib=None, y_train_target=None,
+                     y_calib_target=None):
     """
     Selects the model with correct settings with 'model' and 'softmax' and calculates the likelihood-ratio's before and
     after calibration on three test sets (augmented test, original mixtures and augmented test as mixtures).
@@ -166,6 +175,10 @@ def perform_analysis(X_train_augmented, y_train_nhot_augmented, X_calib_augmente
     :param method_name_prior: str: model and settings to save plots with
     :param calibration_on_loglrs: bool: whether calibration is fitted on loglrs otherwise on probability
     :param output_folder: specify if you want plots (will be in subfolder plots). Otherwise leave None
+    :param sample_weight_train: None or weight per augmented train sample, used to express the prior
+    :param sample_weight_calib: None or weight per augmented calibration sample, used to express the prior
+    :param y_train_target: None or the train labels projected on the target classes, to reuse
+    :param y_calib_target: None or the calibration labels projected on the target classes, to reuse
     """
 
     classifier = models[0]
@@ -181,36 +194,49 @@ def perform_analysis(X_train_augmented, y_train_nhot_augmented, X_calib_augmente
         lrs_before_calib_mixt, lrs_after_calib_mixt = \
             generate_lrs(X_train_augmented, y_train_nhot_augmented, X_calib_augmented, y_calib_nhot_augmented,
                          X_test_augmented, X_test_as_mixtures_augmented, X_mixtures, target_classes, model, mle,
-                         softmax, calibration_on_loglrs, do_calibration=with_calibration)
+                         softmax, calibration_on_loglrs, do_calibration=with_calibration,
+                         sample_weight_train=sample_weight_train, sample_weight_calib=sample_weight_calib,
+                         y_train_target=y_train_target, y_calib_target=y_calib_target)
 
         if output_folder and DEBUG:
-            # calibration data
-            plot_calibration_process(model.predict_lrs(X_calib_augmented, target_classes, with_calibration=False),
-                                     y_calib_nhot_augmented, model._calibrators_per_target_class, None, target_classes,
-                                     label_encoder, calibration_on_loglrs,
-                                     savefig=os.path.join(output_folder, 'plots',
-                                                          'calib_process_calib_{}'.format(method_name_prior)))
-
-            # test data
-            plot_calibration_process(model.predict_lrs(X_test_augmented, target_classes, with_calibration=False),
-                                     y_test_nhot_augmented, model._calibrators_per_target_class,
-                                     (lrs_before_calib, lrs_after_calib), target_classes, label_encoder,
-                                     calibration_on_loglrs,
-                                     savefig=os.path.join(output_folder, 'plots',
-                                                          'calib_process_test_{}'.format(method_name_prior)))
+            with instrumentation.span('plot'):
+                from rna.plotting import plot_calibration_process
+
+                # calibration data
+                plot_calibration_process(model.predict_lrs(X_calib_augmented, target_classes, with_calibration=False),
+                                         y_calib_nhot_augmented, model._calibrators_per_target_class, None,
+                                         target_classes, label_encoder, calibration_on_loglrs,
+                                         savefig=os.path.join(output_folder, 'plots',
+                                                              'calib_process_calib_{}'.format(method_name_prior)))
+
+                # test data
+                plot_calibration_process(model.predict_lrs(X_test_augmented, target_classes, with_calibration=False),
+                                         y_test_nhot_augmented, model._calibrators_per_target_class,
+                                         (lrs_before_calib, lrs_after_calib), target_classes, label_encoder,
+                                         calibration_on_loglrs,
+                                         savefig=os.path.join(output_folder, 'plots',
+                                                              'calib_process_test_{}'.format(method_name_prior)))
 
     else:  # no calibration
         X_train = np.concatenate((X_train_augmented, X_calib_augmented), axis=0)
         y_train = np.concatenate((y_train_nhot_augmented, y_calib_nhot_augmented), axis=0)
         X_calib = np.array([])
         y_calib = np.array([])
+        if sample_weight_train is not None:
+            sample_weight_train = np.concatenate((sample_weight_train, sample_weight_calib))
+        if y_train_target is not None and y_calib_target is not None:
+            y_train_target = np.concatenate((y_train_target, y_calib_target), axis=0)
+        else:
+            y_train_target = None
 
         model, lrs_before_calib, lrs_after_calib, lrs_before_calib_test_as_mixtures, lrs_after_calib_test_as_mixtures, \
         lrs_before_calib_mixt, lrs_after_calib_mixt = generate_lrs(X_train, y_train, X_calib, y_calib, X_test_augmented,
                                                                    X_test_as_mixtures_augmented, X_mixtures,
                                                                    target_classes, model, mle, softmax,
                                                                    calibration_on_loglrs,
-                                                                   do_calibration=with_calibration)
+                                                                   do_calibration=with_calibration,
+                                                                   sample_weight_train=sample_weight_train,
+                                                                   y_train_target=y_train_target)
 
         assert np.array_equal(lrs_before_calib, lrs_after_calib), \
             "LRs before and after calibration are not the same, even though 'with calibration' is {}".format(
@@ -222,9 +248,11 @@ def perform_analysis(X_train_augmented, y_train_nhot_augmented, X_calib_augmente
             "LRs before and after calibration are not the same, even though 'with calibration' is {}".format(
                 with_calibration)
 
-    if output_folder:
+    if output_folder and DEBUG:
         try:
-            if DEBUG:
+            with instrumentation.span('plot'):
+                from rna.plotting import plot_insights_cllr, plot_coefficient_importances
+
                 if classifier == 'MLR':
                     # Plot the values of the coefficients to see if MLR uses the correct features (markers).
                     plot_coefficient_importances(model, target_classes, present_markers, label_encoder,
@@ -236,8 +264,8 @@ def perform_analysis(X_train_augmented, y_train_nhot_augmented, X_calib_augmente
                                         y_test_nhot_augmented, target_classes, label_encoder,
                                savefig=os.path.join(output_folder, 'plots',
                                                     'insights_cllr_calculation_{}'.format(method_name_prior)))
-        except:
-            pass
+        except Exception:
+            print('plots of {} failed:\n{}'.format(method_name_prior, traceback.format_exc()))
 
     return model, lrs_before_calib, lrs_after_calib, lrs_before_calib_test_as_mixtures, \
            lrs_after_calib_test_as_mixtures, lrs_before_calib_mixt, lrs_after_calib_mixt
@@ -279,13 +307,18 @@ def calculate_lrs_for_different_priors(augmented_data, X_mixtures, target_classe
         X_calib_augmented = data.X_calib_augmented
         y_calib_nhot_augmented = data.y_calib_nhot_augmented
 
-        model_i, lrs_before_calib_i, lrs_after_calib_i, \
-        lrs_before_calib_test_as_mixtures_i, lrs_after_calib_test_as_mixtures_i, \
-        lrs_before_calib_mixt_i, lrs_after_calib_mixt_i = \
-            perform_analysis(X_train_augmented, y_train_nhot_augmented, X_calib_augmented, y_calib_nhot_augmented,
-                             X_test_augmented, y_test_nhot_augmented, X_test_as_mixtures_augmented, X_mixtures,
-                             target_classes, present_markers, models, mle, label_encoder, method_name_prior, softmax,
-                             calibration_on_loglrs, output_folder=save_path)
+        with instrumentation.context(prior=key):
+            model_i, lrs_before_calib_i, lrs_after_calib_i, \
+            lrs_before_calib_test_as_mixtures_i, lrs_after_calib_test_as_mixtures_i, \
+            lrs_before_calib_mixt_i, lrs_after_calib_mixt_i = \
+                perform_analysis(X_train_augmented, y_train_nhot_augmented, X_calib_augmented,
+                                 y_calib_nhot_augmented, X_test_augmented, y_test_nhot_augmented,
+                                 X_test_as_mixtures_augmented, X_mixtures, target_classes, present_markers, models,
+                                 mle, label_encoder, method_name_prior, softmax, calibration_on_loglrs,
+                                 output_folder=save_path, sample_weight_train=data.sample_weight_train,
+                                 sample_weight_calib=data.sample_weight_calib,
+                                 y_train_target=data.target_labels('train', target_classes),
+                                 y_calib_target=data.target_labels('calib', target_classes))
 
         model[key] = model_i
         lrs_before_calib[key] = lrs_before_calib_i
@@ -300,34 +333,29 @@ def calculate_lrs_for_different_priors(augmented_data, X_mixtures, target_classe
            lrs_before_calib_mixt, lrs_after_calib_mixt
 
 
-def calculate_accuracy_all_target_classes(X, y_true, target_classes, model, mle):
+def calculate_accuracy_all_target_classes(X, y_true, target_classes, model, mle, y_true_target=None):
     """
     Predicts labels and ensures that both the true and predicted labels are nhot encoded. Calculates the accuracy for
     all target classes and stores it in a list. The set of labels predicted for a sample must *exactly* match the
     corresponding set of labels in y_true.
 
+    :param y_true_target: None or y_true projected on the target classes, to reuse (see AugmentedData.target_labels)
+
     :return: accuracy_scores: list with accuracy for all target classes
     """
 
     y_pred = model._classifier.predict(X)
-    try:
-        if isinstance(model._classifier, keras.engine.training.Model):
-            # when the model predicts probabilities rather than the binary classes
-            # this is only the case for the DL model
-            if y_pred.shape[1] == 2 ** 8:
-                unique_vectors = np.flip(np.unique(nhot_matrix_all_combinations, axis=0), axis=1)
-                y_pred = np.array([np.sum(y_pred[:, np.argwhere(unique_vectors[:, i] == 1).flatten()], axis=1) for i in
-                                   range(unique_vectors.shape[1])]).T
-                y_pred = np.where(y_pred > 0.5, 1, 0)
-            else:
-                y_pred = np.where(y_pred > 0.5, 1, 0)
-    except:
-        pass
+    label_powerset_codes = getattr(model, 'label_powerset_codes', None)
+    if label_powerset_codes is not None and len(y_pred.shape) == 1:
+        # the classifier predicts the index of the combination of cell types, map it back onto its label
+        y_pred = label_powerset_codes[y_pred]
 
-    try:
-        y_true = mle.labels_to_nhot(y_true)
-    except:
-        pass
+    if y_true_target is None:
+        try:
+            y_true = mle.labels_to_nhot(y_true)
+        except:
+            pass
+        y_true_target = project_on_target_classes(y_true, target_classes)
 
     try:
         y_pred = mle.labels_to_nhot(y_pred)
@@ -337,38 +365,61 @@ def calculate_accuracy_all_target_classes(X, y_true, target_classes, model, mle)
     if len(y_pred.shape) == 1:
         y_pred = y_pred.reshape(len(y_pred), 1)
 
-    indices = [np.argwhere(target_classes[i, :] == 1).flatten().tolist() for i in range(target_classes.shape[0])]
-    y_true = np.array([np.max(np.array(y_true[:, indices[i]]), axis=1) for i in range(len(indices))]).T
     if y_pred.shape[1] != len(target_classes):
-        y_pred = np.array([np.max(np.array(y_pred[:, indices[i]]), axis=1) for i in range(len(indices))]).T
+        y_pred = project_on_target_classes(y_pred, target_classes)
+
+    from sklearn.metrics import accuracy_score
 
     accuracy_scores = []
     for t, target_class in enumerate(target_classes):
-        accuracy_scores.append(accuracy_score(y_true[:, t], y_pred[:, t]))
+        accuracy_scores.append(accuracy_score(y_true_target[:, t], y_pred[:, t]))
 
     return accuracy_scores
 
 
-def cllr(lrs, y_nhot, target_class):
+def cllr(lrs, y_nhot, target_class, labels=None):
     """
     Computes the Cllr (log-likelihood ratio cost) for one target class.
 
     :param lrs: numpy array: N_samples with the LRs from the method
     :param y_nhot: N_samples x N_single_cell_type n_hot encoding of the labels
     :param target_class: vector of length n_single_cell_types with at least one 1
+    :param labels: None or N_samples labels of 0 and 1 for the target class, to reuse instead of y_nhot
     :return: float: the log-likehood ratio cost
     """
+    if labels is None:
+        labels = project_on_target_classes(y_nhot, [target_class])[:, 0]
 
-    lrs1 = lrs[np.argwhere(np.max(np.multiply(y_nhot, target_class), axis=1) == 1)].flatten()
-    lrs2 = lrs[np.argwhere(np.max(np.multiply(y_nhot, target_class), axis=1) == 0)].flatten()
+    lrs1 = lrs[labels == 1]
+    lrs2 = lrs[labels == 0]
 
     if len(lrs1) > 0 and len(lrs2) > 0:
-        return calculate_cllr(lrs2, lrs1).cllr
+        return metrics.cllr(lrs1, lrs2)
     else:
         # no ground truth labels for the celltype, so cannot calculate the cllr.
         return 9999.0000
 
 
+def cllr_min(lrs, y_nhot, target_class, labels=None):
+    """
+    Computes the Cllr of the LRs after PAV calibration on themselves for one target class: the discrimination loss.
+    The Cllr minus Cllr_min is the calibration loss Cllr_cal.
+
+    :param lrs: numpy array: N_samples with the LRs from the method
+    :param y_nhot: N_samples x N_single_cell_type n_hot encoding of the labels
+    :param target_class: vector of length n_single_cell_types with at least one 1
+    :param labels: None or N_samples labels of 0 and 1 for the target class, to reuse instead of y_nhot
+    :return: float: the minimum log-likehood ratio cost
+    """
+    if labels is None:
+        labels = project_on_target_classes(y_nhot, [target_class])[:, 0]
+
+    if 0 < np.sum(labels == 1) < len(labels):
+        return metrics.LrMetrics(lrs, labels == 1).cllr_min()
+    else:
+        return 9999.0000
+
+
 def append_lrs_for_all_folds(lrs_for_model, type):
     """
     Concatenates the lrs calculated on test data for each fold.
@@ -4,7 +4,7 @@ Both functions to augment data and to manipulate augmented data.
 
 import numpy as np
 
-from rna.utils import AugmentedData
+from rna.utils import AugmentedData, prior2odds, nhot2codes, codes2nhot
 from rna.analytics import combine_samples
 
 
@@ -84,6 +84,35 @@ def only_use_same_combinations_as_in_mixtures(X_augmented, y_nhot, y_nhot_mixtur
     return X_as_mixt, y_nhot_as_mixt
 
 
+def compile_disallowed_mixtures(disallowed_mixtures):
+    """
+    Compiles the disallowed mixtures into bitmasks over the labels of combinations of cell types (see nhot2codes), so
+    that many combinations can be checked at once.
+
+    :param disallowed_mixtures: None or list of vectors of length n_celltypes, see augment_data
+    :return: two arrays of length n_disallowed_mixtures with the bitmasks of the cell types that must be present and
+        that must be absent for a combination to match the disallowed mixture
+    """
+    if disallowed_mixtures is None or len(disallowed_mixtures) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    disallowed_mixtures = np.asarray(disallowed_mixtures)
+    return nhot2codes(disallowed_mixtures == 1), nhot2codes(disallowed_mixtures == -1)
+
+
+def codes_are_compatible_with_H1_H2_or_both(codes, compiled_disallowed_mixtures):
+    """
+    returns for each label of a combination of cell types whether it is compatible with H1, H2 or both.
+
+    :param codes: array of labels of combinations of cell types (see nhot2codes)
+    :param compiled_disallowed_mixtures: output of compile_disallowed_mixtures
+    :return: boolean array of the same length as codes
+    """
+    must_have, must_not_have = compiled_disallowed_mixtures
+    codes = np.asarray(codes, dtype=np.int64).reshape(-1, 1)
+    match_mixture = ((codes & must_have) == must_have) & ((codes & must_not_have) == 0)
+    return ~np.any(match_mixture, axis=1)
+
+
 def mixture_is_compatible_with_H1_H2_or_both(classes_in_current_mixture, disallowed_mixtures):
     """
     returns True if the current mixture is compatible with H1, H2 or both. If returns false, the mixture should not
@@ -91,22 +120,137 @@ def mixture_is_compatible_with_H1_H2_or_both(classes_in_current_mixture, disallo
     """
     if disallowed_mixtures is None:
         return True
-    for disallowed_mixture in disallowed_mixtures:
-        match_mixture = True
-        for i, val in enumerate(disallowed_mixture):
-            if val == 1:
-                if i not in classes_in_current_mixture:
-                    match_mixture = False
-            if val == -1:
-                if i in classes_in_current_mixture:
-                    match_mixture = False
-        if match_mixture:
-            return False
-    return True
+    code = sum(1 << int(i) for i in set(classes_in_current_mixture))
+    return bool(codes_are_compatible_with_H1_H2_or_both([code], compile_disallowed_mixtures(disallowed_mixtures))[0])
+
+
+def mixtures_are_compatible_with_H1_H2_or_both(y_nhot, disallowed_mixtures):
+    """
+    Vectorized version of mixture_is_compatible_with_H1_H2_or_both for many mixtures at once.
+
+    :param y_nhot: n_mixtures x n_celltypes nhot encoded matrix
+    :param disallowed_mixtures: None or list of vectors of length n_celltypes, see augment_data
+    :return: boolean array of length n_mixtures, False for the mixtures that cannot exist under either H1 or H2
+    """
+    return codes_are_compatible_with_H1_H2_or_both(nhot2codes(np.asarray(y_nhot).reshape(len(y_nhot), -1)),
+                                                   compile_disallowed_mixtures(disallowed_mixtures))
+
+
+def sample_combinations(n_combinations, n_celltypes, distribution='size', prior=None, disallowed_mixtures=None,
+                        celltypes_to_sample=None, max_tries=100):
+    """
+    Randomly samples combinations of cell types, rather than enumerating all 2 ** n_celltypes of them.
+
+    :param n_combinations: int: number of combinations to sample
+    :param n_celltypes: int: number of single cell types
+    :param distribution: 'size': the number of cell types in a mixture is uniform between 0 and the number of cell
+        types, which cell types are drawn without replacement in proportion to the prior.
+        'bernoulli': each cell type is present independently, with probability odds / (1 + odds) where the odds follow
+        from the prior (see prior2odds). Uniform priors then give a uniform distribution over all combinations.
+    :param prior: list of length n_celltypes representing the distribution of the augmented samples
+    :param disallowed_mixtures: see augment_data, combinations that match one of them are rejected and drawn again
+    :param celltypes_to_sample: None or list of indices of the cell types to sample, the other cell types are absent.
+        Eg all cell types but penile skin, which can then be added to all combinations.
+    :param max_tries: int: number of rounds of rejection before giving up
+    :return: n_combinations x n_celltypes nhot encoded matrix
+    """
+    if celltypes_to_sample is None:
+        celltypes_to_sample = list(range(n_celltypes))
+    if prior is None:
+        prior = [1] * n_celltypes
+    assert len(prior) == n_celltypes, "Not all cell types are given a prior value"
+    odds = prior2odds(prior)[celltypes_to_sample]
+    n = len(celltypes_to_sample)
+
+    y_nhot = np.zeros((0, n_celltypes), dtype=int)
+    for _ in range(max_tries):
+        n_to_sample = n_combinations - len(y_nhot)
+        if n_to_sample == 0:
+            break
+        sampled = np.zeros((n_to_sample, n_celltypes), dtype=int)
+        if distribution == 'size':
+            sizes = np.random.randint(n + 1, size=n_to_sample)
+            # weighted sampling without replacement: take the cell types with the largest log(odds) + gumbel noise
+            keys = np.log(odds) + np.random.gumbel(size=(n_to_sample, n))
+            ranks = np.argsort(np.argsort(-keys, axis=1), axis=1)
+            sampled[:, celltypes_to_sample] = ranks < sizes.reshape(-1, 1)
+        elif distribution == 'bernoulli':
+            sampled[:, celltypes_to_sample] = np.random.rand(n_to_sample, n) < odds / (1 + odds)
+        else:
+            raise ValueError("Unknown combination distribution: {}, use 'size' or 'bernoulli'".format(distribution))
+        sampled = sampled[mixtures_are_compatible_with_H1_H2_or_both(sampled, disallowed_mixtures)]
+        y_nhot = np.append(y_nhot, sampled, axis=0)
+
+    if len(y_nhot) < n_combinations:
+        raise ValueError("Could not sample {} combinations that are consistent with the disallowed mixtures"
+                         .format(n_combinations))
+    return y_nhot
+
+
+def augment_sampled_data(X, y, n_celltypes, n_features, N_SAMPLES, label_encoder, prior=None, binarize=False,
+                         from_penile=False, disallowed_mixtures=None, distribution='size'):
+    """
+    Generate data for randomly sampled combinations of single cell types. Unlike augment_data, the cost does not grow
+    with the number of combinations, so this can be used for large numbers of cell types.
+
+    :param X: n_samples x n_measurements per sample x n_markers array of measurements
+    :param y: list of length N_single_cell_experimental_samples filled with int labels of which cell type was measured
+    :param n_celltypes: int: number of single cell types
+    :param n_features: int: n_markers
+    :param N_SAMPLES: total number of samples to generate
+    :param label_encoder: encoder that encodes labels with value between 0 and n_cell types-1
+    :param prior: list of length n_celltypes representing the distribution of the augmented samples, may contain more
+        than two unique values
+    :param binarize: bool: if True transform samples into binary samples with threshold 150 and if False keep the
+        original signal values but normalize (/1000).
+    :param from_penile: bool: if True generate sample that always also contain penile skin and if False will never
+        contain penile skin.
+    :param disallowed_mixtures: see augment_data
+    :param distribution: distribution to sample the combinations from, see sample_combinations
+    :return: N_SAMPLES x n_markers array,
+             N_SAMPLES x n_celltypes matrix of 0, 1 indicating for each augmented sample which single cell type it
+                was made up of.
+    """
+    assert disallowed_mixtures is None or all([len(dm)==n_celltypes for dm in disallowed_mixtures])
+
+    if X.size == 0:
+        # This is the case when calibration_size = 0.0, this is an implicit way to
+        # ensure that calibration is not performed.
+        return None, np.zeros((0, n_celltypes))
+
+    celltypes_to_sample = list(range(n_celltypes))
+    if from_penile:
+        index_of_penile = int(label_encoder.transform(['Skin.penile']))
+        celltypes_to_sample.remove(index_of_penile)
+        # penile skin is always present, so it should not take part in the prior
+        prior = [1] * n_celltypes if prior is None else list(prior)
+        prior[index_of_penile] = 1
+        if disallowed_mixtures is not None:
+            # whether penile skin is present is not sampled, so judge the disallowed mixtures with it present
+            disallowed_mixtures = np.array([dm for dm in np.asarray(disallowed_mixtures) if dm[index_of_penile] != -1]
+                                           ).reshape(-1, n_celltypes)
+            disallowed_mixtures[:, index_of_penile] = 0
+
+    y_nhot_augmented = sample_combinations(N_SAMPLES, n_celltypes, distribution, prior, disallowed_mixtures,
+                                           celltypes_to_sample)
+    if from_penile:
+        y_nhot_augmented[:, index_of_penile] = 1
+
+    X_augmented = np.zeros((N_SAMPLES, n_features))
+    combinations, inverse = np.unique(y_nhot_augmented, axis=0, return_inverse=True)
+    for i, combination in enumerate(combinations):
+        indices = np.flatnonzero(inverse == i)
+        X_augmented[indices] = construct_random_samples(X, y, len(indices), np.flatnonzero(combination).tolist(),
+                                                        n_features, binarize=binarize)
+
+    if not binarize:
+        X_augmented = X_augmented / 1000
+
+    return X_augmented, y_nhot_augmented
 
 
 def augment_data( X, y, n_celltypes, n_features, N_SAMPLES_PER_COMBINATION, label_encoder, prior=None, binarize=False,
-                 from_penile=False, disallowed_mixtures=None):
+                 from_penile=False, disallowed_mixtures=None, combinations=None):
     """
     Generate data for the power set of single cell types.
 
@@ -123,9 +267,12 @@ def augment_data( X, y, n_celltypes, n_features, N_SAMPLES_PER_COMBINATION, labe
     :param from_penile: bool: if True generate sample that always also contain penile skin and if False will never
         contain penile skin.
     :param disallowed_mixtures: list of vectors of length n_celltype. each of the vectors specifies a combination of
-       celltypes that is inconsistent with either H1 or H2. 1 indicates presence, 0 absence, -1 irrelevance. Eg
-       [[1,0,-1,-1,-1]] indicates there should be no mixtures that have the first cell type and lack the second cell
+       celltypes that is inconsistent with either H1 or H2. 1 indicates presence, -1 absence, 0 irrelevance. Eg
+       [[1,-1,0,0,0]] indicates there should be no mixtures that have the first cell type and lack the second cell
        type
+    :param combinations: n_combinations x n_celltypes nhot encoded matrix of the combinations of cell types to generate
+        samples for, eg the combinations seen in the mixtures. If None all 2 ** n_celltypes combinations are generated.
+        When from_penile the column for penile skin is ignored, penile skin is always added.
     :return: n_experiments x n_markers array,
              n_experiments x n_celltypes matrix of 0, 1 indicating for each augmented sample which single cell type it
                 was made up of. Does not contain column for penile skin
@@ -161,7 +308,7 @@ def augment_data( X, y, n_celltypes, n_features, N_SAMPLES_PER_COMBINATION, labe
             ratio_relevant_prior = 1-ratio_other_priors
     else:
         raise ValueError("Cannot augment samples if there are more than two unique prior values. "
-                         "Change 'priors' in settings.")
+                         "Change 'priors' in settings or set 'reweight_priors' to express them as sample weights.")
 
     if X.size == 0:
         # This is the case when calibration_size = 0.0, this is an implicit way to
@@ -170,65 +317,57 @@ def augment_data( X, y, n_celltypes, n_features, N_SAMPLES_PER_COMBINATION, labe
         y_nhot_augmented=np.zeros((0, n_celltypes))
 
     else:
-        X_augmented = np.zeros((0, n_features))
-        N_SAMPLES = int(2 * N_SAMPLES_PER_COMBINATION * ratio_relevant_prior * (2 ** (n_celltypes_without_penile-1)) + \
-                    2 * N_SAMPLES_PER_COMBINATION * ratio_other_priors * 2 ** ((n_celltypes_without_penile-1)))
-        assert N_SAMPLES == N_SAMPLES_PER_COMBINATION * 2 ** n_celltypes_without_penile
-        y_nhot_augmented = np.zeros((N_SAMPLES, n_celltypes), dtype=int)
-
+        if from_penile:
+            classes_str = label_encoder.classes_.tolist()
+            classes_str.remove('Skin.penile')
+            classes = np.array([label_encoder.transform([class_str]) for class_str in classes_str]).ravel()
+            index_of_penile = int(label_encoder.transform(['Skin.penile']))
+        else:
+            classes = np.arange(n_celltypes)
+
+        if combinations is None:
+            indices_of_combinations = np.arange(2 ** n_celltypes_without_penile)
+        else:
+            indices_of_combinations = np.unique(nhot2codes(np.asarray(combinations)[:, classes]))
+
+        # bit i_celltype of the index of a combination says whether classes[i_celltype] is in the mixture
+        y_nhot_of_combinations = np.zeros((len(indices_of_combinations), n_celltypes), dtype=int)
+        y_nhot_of_combinations[:, classes] = codes2nhot(indices_of_combinations, n_celltypes_without_penile)
+        if from_penile:
+            # also (always) add penile skin samples.
+            y_nhot_of_combinations[:, index_of_penile] = 1
+
+        compatible = codes_are_compatible_with_H1_H2_or_both(nhot2codes(y_nhot_of_combinations),
+                                                             compile_disallowed_mixtures(disallowed_mixtures))
+
+        if len(np.unique(prior)) == 1:
+            Np = np.ones(len(indices_of_combinations))
+        else:
+            Np = np.where(y_nhot_of_combinations[:, index_of_relevant_prior] == 1, 2 * ratio_relevant_prior,
+                          2 * ratio_other_priors)
+
+        # the exact number of samples per combination, the incompatible combinations get none.
+        # NB this will not give you the correct number for all combinations of background levels and
+        # N_SAMPLES_PER_COMBNATION, due to rounding errors.
+        begins = np.zeros(len(indices_of_combinations), dtype=int)
+        ends = np.zeros(len(indices_of_combinations), dtype=int)
         begin = 0
-        for i in range(2 ** n_celltypes_without_penile):
-            binary = bin(i)[2:]
-            while len(binary) < n_celltypes:
-                binary = '0' + binary
-
-            # figure out which classes will be in the combination each iteration
-            classes_in_current_mixture = []
-            if not from_penile:
-                for i_celltype in range(len(label_encoder.classes_)):
-                    if binary[-i_celltype - 1] == '1':
-                        classes_in_current_mixture.append(i_celltype)
-            else:
-                classes_str = label_encoder.classes_.tolist()
-                classes_str.remove('Skin.penile')
-                classes = np.array([label_encoder.transform([class_str]) for class_str in classes_str]).ravel()
-                classes_map = {i:classes[i] for i in range(len(classes))}
-                for i_celltype in range(len(classes)):
-                    if binary[-i_celltype - 1] == '1':
-                        classes_in_current_mixture.append(classes_map[i_celltype])
-                # also (always) add penile skin samples.
-                classes_in_current_mixture.append(int(label_encoder.transform(['Skin.penile'])))
-
-            try:
-                if index_of_relevant_prior in classes_in_current_mixture:
-                    Np = 2 * ratio_relevant_prior
-                else:
-                    Np = 2 * ratio_other_priors
-            except:
-                Np = 1
-
-            # NB this will not give you the correct number for all combinations of background levels and
-            # N_SAMPLES_PER_COMBNATION, due to rounding errors.
-            end = round(begin + N_SAMPLES_PER_COMBINATION * Np)
-            if mixture_is_compatible_with_H1_H2_or_both(classes_in_current_mixture, disallowed_mixtures):
-
-                if not from_penile:
-                    for i_celltype in range(len(label_encoder.classes_)):
-                        if binary[-i_celltype - 1] == '1':
-                            y_nhot_augmented[begin:end, i_celltype] = 1
-                else:
-                    for i_celltype in range(len(label_encoder.classes_)):
-                        if binary[-i_celltype - 1] == '1':
-                            y_nhot_augmented[begin:end, classes_map[i_celltype]] = 1
-                    y_nhot_augmented[begin:end, int(label_encoder.transform(['Skin.penile']))] = 1
-
-                X_augmented = np.append(X_augmented,
-                                        construct_random_samples(X, y, end - begin, classes_in_current_mixture, n_features,
-                                                                 binarize=binarize), axis=0)
+        for i_combination, Np_combination in enumerate(Np.tolist()):
+            end = round(begin + N_SAMPLES_PER_COMBINATION * Np_combination)
+            if compatible[i_combination]:
+                begins[i_combination], ends[i_combination] = begin, end
                 begin = end
-            else:
-                # mixture is not compatible, shorten y_nhot_augmented
-                y_nhot_augmented = np.delete(y_nhot_augmented, np.arange(begin,end), 0)
+
+        X_augmented = np.zeros((begin, n_features))
+        y_nhot_augmented = np.zeros((begin, n_celltypes), dtype=int)
+        for i_combination in np.flatnonzero(ends > begins):
+            begin, end = begins[i_combination], ends[i_combination]
+            classes_in_current_mixture = classes[y_nhot_of_combinations[i_combination, classes] == 1].tolist()
+            if from_penile:
+                classes_in_current_mixture.append(index_of_penile)
+            y_nhot_augmented[begin:end] = y_nhot_of_combinations[i_combination]
+            X_augmented[begin:end] = construct_random_samples(X, y, end - begin, classes_in_current_mixture,
+                                                              n_features, binarize=binarize)
 
         if not binarize:
             X_augmented = X_augmented / 1000
@@ -239,8 +378,21 @@ def augment_data( X, y, n_celltypes, n_features, N_SAMPLES_PER_COMBINATION, labe
     return X_augmented, y_nhot_augmented[:, :n_celltypes]
 
 
+def observed_combinations(y_nhot_mixtures, n_celltypes):
+    """
+    Returns the combinations of cell types that are observed: those of the mixtures and the single cell types. Pass
+    these as the combinations of augment_data to only generate (and train on) these, rather than all 2 ** n_celltypes
+    combinations.
+
+    :param y_nhot_mixtures: n_mixture_samples x n_celltypes array of labels
+    :return: n_combinations x n_celltypes nhot encoded matrix
+    """
+    return np.unique(np.vstack([np.asarray(y_nhot_mixtures, dtype=int), np.eye(n_celltypes, dtype=int)]), axis=0)
+
+
 def augment_splitted_data(X_train, y_train, X_calib, y_calib, X_test, y_test, y_nhot_mixtures, n_celltypes, n_features,
-                          label_encoder, prior, binarize, from_penile, nsamples, disallowed_mixtures) -> AugmentedData:
+                          label_encoder, prior, binarize, from_penile, nsamples, disallowed_mixtures,
+                          combinations=None, combination_distribution=None) -> AugmentedData:
     """
     Creates augmented samples for train, calibration and test data and saves it within a class.
     NB priors are always uniform for test data
@@ -261,26 +413,32 @@ def augment_splitted_data(X_train, y_train, X_calib, y_calib, X_test, y_test, y_
     :param from_penile: bool: if True generate sample that always also contain penile skin and if False will never
         contain penile skin.
     :param disallowed_mixtures: list of vectors of length n_celltype. each of the vectors specifies a combination of
-       celltypes that is inconsistent with either H1 or H2. 1 indicates presence, 0 absence, -1 irrelevance. Eg
-       [[1,0,-1,-1,-1]] indicates there should be no mixtures that have the first cell type and lack the second cell
+       celltypes that is inconsistent with either H1 or H2. 1 indicates presence, -1 absence, 0 irrelevance. Eg
+       [[1,-1,0,0,0]] indicates there should be no mixtures that have the first cell type and lack the second cell
        type
+    :param combinations: n_combinations x n_celltypes nhot encoded matrix of the combinations of cell types to generate
+        train and calibration samples for, eg observed_combinations. If None all combinations are generated. The test
+        data always covers all combinations.
+    :param combination_distribution: None, 'size' or 'bernoulli'. If given, the combinations are sampled from this
+        distribution (see augment_sampled_data) and nsamples is the total number of samples rather than the number per
+        combination. 'combinations' is then ignored.
     :return: class with augmented samples for train, calibration, test and test as mixtures
     """
 
-    X_train_augmented, y_train_nhot_augmented = augment_data(X_train, y_train, n_celltypes, n_features,
-                                                             nsamples[0], label_encoder, prior,
-                                                             binarize=binarize, from_penile=from_penile,
-                                                             disallowed_mixtures=disallowed_mixtures)
-    X_calib_augmented, y_calib_nhot_augmented = augment_data(X_calib, y_calib, n_celltypes, n_features,
-                                                             nsamples[1], label_encoder, prior,
-                                                             binarize=binarize, from_penile=from_penile,
-                                                             disallowed_mixtures=disallowed_mixtures)
+    def augment(X, y, n, prior, combinations=combinations):
+        if combination_distribution is None:
+            return augment_data(X, y, n_celltypes, n_features, n, label_encoder, prior, binarize=binarize,
+                                from_penile=from_penile, disallowed_mixtures=disallowed_mixtures,
+                                combinations=combinations)
+        return augment_sampled_data(X, y, n_celltypes, n_features, n, label_encoder, prior, binarize=binarize,
+                                    from_penile=from_penile, disallowed_mixtures=disallowed_mixtures,
+                                    distribution=combination_distribution)
+
+    X_train_augmented, y_train_nhot_augmented = augment(X_train, y_train, nsamples[0], prior)
+    X_calib_augmented, y_calib_nhot_augmented = augment(X_calib, y_calib, nsamples[1], prior)
     # use uniform priors for test data
     if not X_test is None:
-        X_test_augmented, y_test_nhot_augmented = augment_data(X_test, y_test, n_celltypes, n_features,
-                                                               nsamples[2], label_encoder, [1] * n_celltypes,
-                                                               binarize=binarize, from_penile=from_penile,
-                                                               disallowed_mixtures=disallowed_mixtures)
+        X_test_augmented, y_test_nhot_augmented = augment(X_test, y_test, nsamples[2], [1] * n_celltypes, None)
         X_test_as_mixtures_augmented, y_test_as_mixtures_nhot_augmented = only_use_same_combinations_as_in_mixtures(
             X_test_augmented, y_test_nhot_augmented, y_nhot_mixtures)
         print('test:', X_test_augmented.shape)
@@ -299,37 +457,90 @@ def augment_splitted_data(X_train, y_train, X_calib, y_calib, X_test, y_test, y_
     return class_to_return
 
 
+def prior_to_sample_weights(y_nhot, prior):
+    """
+    Expresses the prior as a weight per augmented sample, as an alternative to changing the number of samples per
+    combination in augment_data. Each cell type present in a sample multiplies its weight with the odds of that cell
+    type (see prior2odds). The weights are normalized to a mean of 1, so for uniformly augmented data they match the
+    relative number of samples augment_data would have generated for the combination, for any number of unique prior
+    values.
+
+    :param y_nhot: n_samples x n_celltypes matrix of 0, 1 indicating which cell types each sample was made up of
+    :param prior: list of length n_celltypes representing the distribution of the augmented samples
+    :return: array of length n_samples with the weight of each sample
+    """
+    assert len(prior) == y_nhot.shape[1], "Not all cell types are given a prior value"
+
+    if y_nhot.shape[0] == 0:
+        return np.zeros(0)
+
+    odds = prior2odds(prior)
+    weights = np.prod(np.where(y_nhot == 1, odds, 1), axis=1)
+
+    return weights / np.mean(weights)
+
+
+def reweight_augmented_data(augmented_data, prior) -> AugmentedData:
+    """
+    Returns a copy of the (uniformly) augmented data with the prior expressed as sample weights for the train and
+    calibration data. The arrays themselves are shared, not copied, and so are the labels projected on target classes.
+
+    :param augmented_data: AugmentedData generated with uniform priors
+    :param prior: list of length n_celltypes representing the distribution of the augmented samples
+    :return: AugmentedData with sample_weight_train and sample_weight_calib set
+    """
+    reweighted_data = AugmentedData(augmented_data.X_train_augmented, augmented_data.y_train_nhot_augmented,
+                                    augmented_data.X_calib_augmented, augmented_data.y_calib_nhot_augmented,
+                                    augmented_data.X_test_augmented, augmented_data.y_test_nhot_augmented,
+                                    augmented_data.X_test_as_mixtures_augmented,
+                                    augmented_data.y_test_as_mixtures_nhot_augmented,
+                                    sample_weight_train=prior_to_sample_weights(augmented_data.y_train_nhot_augmented,
+                                                                                prior),
+                                    sample_weight_calib=prior_to_sample_weights(augmented_data.y_calib_nhot_augmented,
+                                                                                prior))
+    reweighted_data._target_labels = augmented_data._target_labels
+    return reweighted_data
+
+
 class MultiLabelEncoder():
     """
-    Class that converts list of labels into nhot-encoded vectors and the other way around.
+    Class that converts list of labels into nhot-encoded vectors and the other way around. The label of a combination
+    of cell types is the integer with bit i set if cell type i is present (see nhot2codes), so no table of all
+    combinations is needed.
 
     :param n_classes: the number of single cell types
     :param nhot_of_combinations: n_unique_combinations x n_classes matrix containing all unique combinations of cell
-        types.
+        types, only made when requested.
     """
 
     def __init__(self, n_classes):
         self.n_classes = n_classes
-        self.nhot_of_combinations = make_nhot_matrix_of_combinations(n_classes)
+        self._nhot_of_combinations = None
+
+    @property
+    def nhot_of_combinations(self):
+        if self._nhot_of_combinations is None:
+            self._nhot_of_combinations = make_nhot_matrix_of_combinations(self.n_classes)
+        return self._nhot_of_combinations
 
     def nhot_to_labels(self, y_nhot):
         """
         Transforms a nhot encoded matrix into a list of labels.
         """
-        y = np.array([np.argwhere(np.all(self.nhot_of_combinations == y_nhot[i, :], axis=1)).flatten() for i in range(y_nhot.shape[0])])
-        return y.ravel()
+        y_nhot = np.asarray(y_nhot)
+        if len(y_nhot.shape) != 2 or y_nhot.shape[1] != self.n_classes:
+            raise ValueError('y_nhot should be a N x {} nhot encoded matrix'.format(self.n_classes))
+        return nhot2codes(y_nhot)
 
     def labels_to_nhot(self, y):
         """
         Transforms a list of labels into a nhot encoded matrix.
         """
-        if len(y.shape) == 1 or y.shape[1] == 1:
-            if not np.all(np.unique(y) == [0, 1]): # this when the model predicts one target class in hot encoded, but
-                # it is seen as a list of labels being predicted.
-                n = y.shape[0]
-                # TODO: FutureWarning: arrays to stack must be passed as a "sequence" ...
-                y_nhot = np.vstack(self.nhot_of_combinations[y[i], :] for i in range(n))
-        return y_nhot
+        if not (len(y.shape) == 1 or y.shape[1] == 1) or np.array_equal(np.unique(y), [0, 1]):
+            # the latter when the model predicts one target class in hot encoded, but it is seen as a list of labels
+            # being predicted.
+            raise ValueError('y is not a list of labels')
+        return codes2nhot(np.ravel(y), self.n_classes)
 
     def transform_single(self, y):
         """
@@ -360,11 +571,4 @@ def make_nhot_matrix_of_combinations(N):
     :param N: int
     :return: 2 ** N x n_celltypes matrix nhot encoded
     """
-
-    def int_to_binary(i):
-        binary = bin(i)[2:]
-        while len(binary) < N:
-            binary = '0' + binary
-        return np.flip([int(j) for j in binary]).tolist()
-
-    return np.array([int_to_binary(i) for i in range(2**N)])
\ No newline at end of file
+    return codes2nhot(np.arange(2 ** N), N)
@@ -0,0 +1,232 @@
+"""
+Scores case files with a trained model without the GUI, so that many cases can be processed at once. The model is
+loaded once, the case files are read one by one and their samples are scored in large batches. All LRs end up in one
+table.
+
+Example:
+    python -m rna.batch_scoring final_model/no_penile/vagmenstr_no_penile 'cases/*.xlsx' -o lrs.csv --nreplicates 4
+"""
+
+import argparse
+import csv
+import glob
+import os
+
+import numpy as np
+from sklearn.preprocessing import LabelEncoder
+
+from rna.constants import single_cell_types, marker_names
+from rna.input_output import read_case_data
+from rna.model_io import read_model
+from rna.scoring_service import RemoteModel
+from rna.utils import string2vec
+
+# the options of the GUI, see get_prior in gui.py
+PRIOR_VALUES = {'uniform': .5, 'always': 1, 'never': 0}
+
+DEFAULT_TARGET_CLASSES = sorted(['Vaginal.mucosa and/or Menstrual.secretion'] + list(single_cell_types))
+
+
+def make_label_encoder(from_penile=False):
+    """
+    Returns the label encoder of the cell types the final models are trained with.
+
+    :param from_penile: bool: whether the model is trained with penile skin
+    """
+    label_encoder = LabelEncoder()
+    celltypes = list(single_cell_types)
+    if from_penile:
+        celltypes.append('Skin.penile')
+    label_encoder.fit(celltypes)
+    return label_encoder
+
+
+def parse_prior(spec, label_encoder):
+    """
+    Converts a specification like 'Saliva=always,Blood=never' into a prior vector for predict_lrs. Cell types that are
+    not mentioned are uniform.
+
+    :param spec: None or str with comma separated 'cell type=uniform|always|never'
+    :param label_encoder: LabelEncoder mapping strings to indices and vice versa
+    :return: None if spec is empty, otherwise list of length n_celltypes with .5, 1 or 0
+    """
+    if not spec:
+        return None
+    prior = [PRIOR_VALUES['uniform']] * len(label_encoder.classes_)
+    for item in spec.split(','):
+        try:
+            celltype, value = [part.strip() for part in item.split('=')]
+            prior[label_encoder.transform([celltype])[0]] = PRIOR_VALUES[value.lower()]
+        except (ValueError, KeyError):
+            raise ValueError("Cannot parse prior '{}', expected 'cell type=uniform|always|never' for one of {}"
+                             .format(item, list(label_encoder.classes_)))
+    return prior
+
+
+def prior_to_string(prior, label_encoder):
+    """
+    Inverse of parse_prior, used to write the priors next to the LRs.
+    """
+    if prior is None:
+        return 'uniform'
+    names = {value: name for name, value in PRIOR_VALUES.items()}
+    items = ['{}={}'.format(celltype, names[value]) for celltype, value in zip(label_encoder.classes_, prior)
+             if value != PRIOR_VALUES['uniform']]
+    return ','.join(items) if items else 'uniform'
+
+
+def expand_case_paths(paths):
+    """
+    Expands directories and glob patterns into the case files (xlsx or csv) to score.
+
+    :param paths: iterable of file names, directories or glob patterns
+    :return: list of file names
+    """
+    filenames = []
+    for path in paths:
+        if os.path.isdir(path):
+            matches = glob.glob(os.path.join(path, '*.xlsx')) + glob.glob(os.path.join(path, '*.csv'))
+        elif glob.has_magic(path):
+            matches = glob.glob(path)
+        else:
+            matches = [path]
+        # skip the lock files excel leaves behind
+        filenames.extend(sorted(match for match in matches if not os.path.basename(match).startswith('~$')))
+    return filenames
+
+
+def write_lrs_header(writer, target_classes_str):
+    """
+    Writes the header of the LR table, see score_cases.
+
+    :param writer: csv writer
+    :param target_classes_str: list of strings of the target classes
+    """
+    writer.writerow(['file', 'sample', 'valid'] + ['log10 LR {}'.format(target_class)
+                                                   for target_class in target_classes_str] +
+                    ['priors numerator', 'priors denominator'])
+
+
+def write_lrs_rows(writer, rows, log_lrs, n_target_classes, priors):
+    """
+    Writes a row per sample to the LR table. Invalid samples are written without LRs.
+
+    :param writer: csv writer
+    :param rows: list of (filename, sample name, valid)
+    :param log_lrs: n_valid x n_target_classes array of log10 LRs of the valid samples in rows
+    :param n_target_classes: number of target classes
+    :param priors: list of the strings of the priors of the numerator and denominator, see prior_to_string
+    """
+    i_sample = 0
+    for filename, sample_name, valid in rows:
+        if valid:
+            values = ['{:.3f}'.format(log_lr) for log_lr in log_lrs[i_sample]]
+            i_sample += 1
+        else:
+            values = [''] * n_target_classes
+        writer.writerow([filename, sample_name, int(valid)] + values + priors)
+
+
+def score_cases(filenames, model, target_classes_str, label_encoder, output_path, priors_numerator=None,
+                priors_denominator=None, nreplicates=None, binarize=True, remove_structural=True, batch_size=1000):
+    """
+    Calculates the LRs for all samples in the case files and writes them to one csv file, with a row per sample.
+    Samples for which too few housekeeping markers are detected are written without LRs.
+
+    :param filenames: iterable of paths to case files, see read_case_data
+    :param model: trained MarginalClassifier, or a RemoteModel to score with the scoring service
+    :param target_classes_str: list of strings of the target classes the model was trained with
+    :param label_encoder: LabelEncoder mapping strings to indices and vice versa
+    :param output_path: path of the csv file to write
+    :param priors_numerator: None or vector of length n_celltypes, see MarginalClassifier.predict_lrs
+    :param priors_denominator: None or vector of length n_celltypes, see MarginalClassifier.predict_lrs
+    :param nreplicates: number of repeated measurements, for files without 'replicate_value' column
+    :param binarize: bool: whether the model was trained on binarized data
+    :param remove_structural: bool: whether the model was trained without the housekeeping and gender markers
+    :param batch_size: number of samples to collect before calculating their LRs
+    :return: int: number of samples written
+    """
+    target_classes = string2vec(target_classes_str, label_encoder)
+    priors = [prior_to_string(priors_numerator, label_encoder), prior_to_string(priors_denominator, label_encoder)]
+
+    def write_batch(writer, rows, X_batch):
+        X = np.concatenate(X_batch, axis=0) if X_batch else np.zeros((0, 0))
+        log_lrs = None
+        if len(X) > 0:
+            log_lrs = np.log10(model.predict_lrs(X, target_classes, priors_numerator=priors_numerator,
+                                                 priors_denominator=priors_denominator))
+        write_lrs_rows(writer, rows, log_lrs, len(target_classes_str), priors)
+
+    n_samples = 0
+    with open(output_path, 'w', newline='') as f:
+        writer = csv.writer(f, delimiter=';', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+        write_lrs_header(writer, target_classes_str)
+
+        rows = []
+        X_batch = []
+        n_in_batch = 0
+        for filename in filenames:
+            X, sample_names, valid, markers = read_case_data(filename, nreplicates, binarize=binarize,
+                                                             remove_structural=remove_structural)
+            if markers != marker_names:
+                raise ValueError("The marker labels in {} are inconsistent with the trained model. The correct labels "
+                                 "are: {}. Found {}".format(filename, marker_names, markers))
+            print('{}: {} samples, {} valid'.format(filename, len(sample_names), int(np.sum(valid))))
+
+            rows.extend((filename, sample_name, is_valid) for sample_name, is_valid in zip(sample_names, valid))
+            X_batch.append(X[valid])
+            n_in_batch += int(np.sum(valid))
+            n_samples += len(sample_names)
+            if n_in_batch >= batch_size:
+                write_batch(writer, rows, X_batch)
+                rows, X_batch, n_in_batch = [], [], 0
+
+        write_batch(writer, rows, X_batch)
+
+    return n_samples
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Calculate LRs for all samples in a set of case files.')
+    parser.add_argument('model', help='path to a trained model (artefact directory or pickle), eg final_model/no_penile/vagmenstr_no_penile, '
+                                      'or the name of the model in the scoring service if --service is given')
+    parser.add_argument('cases', nargs='+', help='case files (xlsx or csv), directories or glob patterns')
+    parser.add_argument('-o', '--output', default='lrs.csv', help='csv file to write the LRs to')
+    parser.add_argument('--nreplicates', type=int, default=None,
+                        help="number of replicates per sample, for files without a 'replicate_value' column")
+    parser.add_argument('--penile', action='store_true', help='the model is trained with penile skin')
+    parser.add_argument('--numerator', default=None,
+                        help="prior of the numerator, eg 'Saliva=always,Blood=never'. Unmentioned cell types are "
+                             "uniform. Only used by label powerset (softmax) models.")
+    parser.add_argument('--denominator', default=None, help='prior of the denominator, see --numerator')
+    parser.add_argument('--target-classes', nargs='+', default=DEFAULT_TARGET_CLASSES,
+                        help='target classes the model was trained with')
+    parser.add_argument('--not-binarize', action='store_true', help='the model is trained on the signal values')
+    parser.add_argument('--keep-structural', action='store_true',
+                        help='the model is trained with the housekeeping and gender markers')
+    parser.add_argument('--batch-size', type=int, default=1000, help='number of samples to score at once')
+    parser.add_argument('--service', default=None,
+                        help='url of a running scoring service (python -m rna.scoring_service) to score with, '
+                             'eg http://127.0.0.1:8765')
+    args = parser.parse_args(argv)
+
+    filenames = expand_case_paths(args.cases)
+    if len(filenames) == 0:
+        parser.error('no case files found')
+
+    label_encoder = make_label_encoder(args.penile)
+    if args.service:
+        model = RemoteModel(args.service, args.model)
+    else:
+        model = read_model(args.model)
+
+    n_samples = score_cases(filenames, model, args.target_classes, label_encoder, args.output,
+                            priors_numerator=parse_prior(args.numerator, label_encoder),
+                            priors_denominator=parse_prior(args.denominator, label_encoder),
+                            nreplicates=args.nreplicates, binarize=not args.not_binarize,
+                            remove_structural=not args.keep_structural, batch_size=args.batch_size)
+    print('wrote LRs for {} samples from {} files to {}'.format(n_samples, len(filenames), args.output))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+"""
+Bootstrap confidence intervals for the LRs of the final model. Each replicate splits the single cell type samples in
+train and calibration data, resamples both halves (stratified by cell type), augments, fits the model and its calibration
+as get_final_trained_mlr_model does, and scores a fixed set of evaluation samples. The replicates run on a process
+pool. Their LRs are binned into a histogram per sample and target class as they come in, so the
+N x n_target_classes x n_bootstraps array of LRs is never held in memory.
+"""
+
+import multiprocessing
+
+import numpy as np
+from sklearn.model_selection import train_test_split
+from tqdm import tqdm
+
+from rna.analytics import clf_with_correct_settings
+from rna.augment import augment_splitted_data
+
+
+class LrPercentileAccumulator():
+    """
+    Histogram of the log10 LRs per sample and target class, from which percentiles are read. The percentiles are
+    accurate up to half a bin width (in log10 LR).
+
+    The histogram takes n_samples x n_target_classes x (2 * MAX_LR / bin_width + 1) counts of the smallest unsigned
+    integer type that holds max_bootstraps: with the defaults 401 bytes per sample and target class for up to 255
+    replicates, and 802 bytes for up to 65535. Keeping the LRs of B replicates as float64 takes 8 * B bytes, so the
+    histogram is smaller from B = 51 replicates on, and its size does not grow with B.
+
+    :param n_samples: number of samples scored
+    :param n_target_classes: number of target classes
+    :param MAX_LR: log10 LRs are within [-MAX_LR, MAX_LR], see MarginalClassifier
+    :param bin_width: width of the bins in log10 LR
+    :param max_bootstraps: maximum number of replicates that will be added
+    """
+
+    def __init__(self, n_samples, n_target_classes, MAX_LR=10, bin_width=0.05, max_bootstraps=255):
+        self.MAX_LR = MAX_LR
+        self.bin_width = bin_width
+        self.n_bins = int(np.ceil(2 * MAX_LR / bin_width)) + 1
+        dtype = next(dtype for dtype in (np.uint8, np.uint16, np.uint32) if max_bootstraps <= np.iinfo(dtype).max)
+        self.counts = np.zeros((n_samples, n_target_classes, self.n_bins), dtype=dtype)
+        self.n_bootstraps = 0
+
+    def add(self, lrs):
+        """
+        Adds the LRs of one bootstrap replicate.
+
+        :param lrs: n_samples x n_target_classes array of LRs
+        """
+        if self.n_bootstraps == np.iinfo(self.counts.dtype).max:
+            raise ValueError('more than max_bootstraps replicates added')
+        bins = np.clip(np.round((np.log10(lrs) + self.MAX_LR) / self.bin_width), 0, self.n_bins - 1).astype(int)
+        # every sample and target class gets one count, so there are no duplicate indices
+        flat_indices = np.arange(bins.size) * self.n_bins + bins.ravel()
+        self.counts.reshape(-1)[flat_indices] += 1
+        self.n_bootstraps += 1
+
+    def percentile(self, q):
+        """
+        Returns the q-th percentile of the LRs of each sample and target class.
+
+        :param q: percentage between 0 and 100
+        :return: n_samples x n_target_classes array of LRs
+        """
+        cumulative_counts = np.cumsum(self.counts, axis=2)
+        # first bin with at least q % of the replicates at or below it
+        bins = np.argmax(cumulative_counts >= max(q / 100 * self.n_bootstraps, 1e-9), axis=2)
+        return 10 ** (bins * self.bin_width - self.MAX_LR)
+
+
+def stratified_resample(X, y):
+    """
+    Draws a bootstrap sample of X, y with replacement, keeping the number of samples per label.
+
+    :param X: n_samples x ... array of the samples
+    :param y: n_samples array of labels
+    :return: X, y resampled
+    """
+    indices = np.concatenate([np.random.choice(np.flatnonzero(y == label), np.sum(y == label))
+                              for label in np.unique(y)])
+    return X[indices], y[indices]
+
+
+def bootstrap_replicate(seed, X_single, y_single, X_eval, target_classes, y_nhot_mixtures, n_celltypes, n_features,
+                        label_encoder, prior, binarize, from_penile, n_samples_per_combination, model_name, softmax):
+    """
+    Fits the model on a bootstrap sample of the single cell type data and returns its LRs on X_eval.
+
+    :param seed: seed of this replicate
+    :return: n_eval x n_target_classes array of LRs
+    """
+    np.random.seed(seed)
+    # split before resampling, so that no sample ends up in both the training and the calibration data
+    X_train, X_calib, y_train, y_calib = train_test_split(X_single, y_single, stratify=y_single, test_size=0.5)
+    X_train, y_train = stratified_resample(X_train, y_train)
+    X_calib, y_calib = stratified_resample(X_calib, y_calib)
+    augmented_data = augment_splitted_data(X_train, y_train, X_calib, y_calib, None, None, y_nhot_mixtures,
+                                           n_celltypes, n_features, label_encoder, prior, [binarize], from_penile,
+                                           [n_samples_per_combination] * 3, disallowed_mixtures=None)
+
+    model = clf_with_correct_settings(model_name, softmax=softmax, n_classes=-1, with_calibration=True)
+    model.fit_classifier(augmented_data.X_train_augmented, augmented_data.target_labels('train', target_classes))
+    model.fit_calibration(augmented_data.X_calib_augmented, augmented_data.y_calib_nhot_augmented, target_classes,
+                          y_target=augmented_data.target_labels('calib', target_classes))
+    return model.predict_lrs(X_eval, target_classes)
+
+
+# the data of the replicates, set once per worker process rather than sent with every replicate
+_replicate_arguments = None
+
+
+def _init_worker(arguments):
+    global _replicate_arguments
+    _replicate_arguments = arguments
+
+
+def _run_replicate(seed):
+    return bootstrap_replicate(seed, *_replicate_arguments)
+
+
+def bootstrap_lrs(X_single, y_single, X_eval, target_classes, y_nhot_mixtures, n_celltypes, n_features,
+                  label_encoder, prior, binarize=True, from_penile=False, n_samples_per_combination=10,
+                  model_name='MLR', softmax=False, n_bootstraps=100, alpha=0.05, seed=0, n_jobs=None,
+                  bin_width=0.05, MAX_LR=10):
+    """
+    Computes bootstrap confidence intervals of the LRs of X_eval.
+
+    :param X_single: n_single_cell_type_samples array of the measurements per sample, see get_data_per_cell_type
+    :param y_single: labels of the cell type of each single cell type sample, see MultiLabelEncoder.transform_single
+    :param X_eval: n_eval x n_features array of the samples to compute the LR intervals for
+    :param target_classes: n_target_classes x n_celltypes containing the n hot encoded classes of interest
+    :param y_nhot_mixtures: n_mixture_samples x n_celltypes array of labels, see augment_splitted_data
+    :param n_celltypes: int: number of single cell types
+    :param n_features: int: number of markers
+    :param label_encoder: LabelEncoder mapping strings to indices and vice versa
+    :param prior: list of length n_celltypes representing the distribution of the augmented samples
+    :param binarize: bool: whether to binarize the data
+    :param from_penile: bool: whether the mixtures always contain penile skin
+    :param n_samples_per_combination: number of augmented samples per combination of cell types
+    :param model_name: classifier, see clf_with_correct_settings
+    :param softmax: bool: whether the classifier is a label powerset
+    :param n_bootstraps: number of bootstrap replicates
+    :param alpha: the intervals are the alpha/2 and 1 - alpha/2 percentiles
+    :param seed: the seeds of the replicates are derived from this seed
+    :param n_jobs: number of processes, None for the number of cpus, 1 to run in this process
+    :param bin_width: accuracy of the percentiles in log10 LR, see LrPercentileAccumulator
+    :return: (lower, median, upper): three n_eval x n_target_classes arrays of LRs, and the LrPercentileAccumulator
+    """
+    seeds = [int(sequence.generate_state(1)[0]) for sequence in np.random.SeedSequence(seed).spawn(n_bootstraps)]
+    arguments = (X_single, np.asarray(y_single), X_eval, target_classes, y_nhot_mixtures, n_celltypes, n_features,
+                 label_encoder, prior, binarize, from_penile, n_samples_per_combination, model_name, softmax)
+    accumulator = LrPercentileAccumulator(len(X_eval), len(target_classes), MAX_LR, bin_width, n_bootstraps)
+
+    if n_jobs == 1:
+        for replicate_seed in tqdm(seeds, desc='bootstrap', leave=False):
+            accumulator.add(bootstrap_replicate(replicate_seed, *arguments))
+    else:
+        with multiprocessing.Pool(n_jobs, initializer=_init_worker, initargs=(arguments,)) as pool:
+            for lrs in tqdm(pool.imap_unordered(_run_replicate, seeds), total=n_bootstraps, desc='bootstrap',
+                            leave=False):
+                accumulator.add(lrs)
+
+    return accumulator.percentile(alpha / 2 * 100), accumulator.percentile(50), \
+        accumulator.percentile((1 - alpha / 2) * 100), accumulator
@@ -0,0 +1,260 @@
+"""
+The measurements of a data file (single cell type, mixture or case samples) in one parsed representation, shared by
+the LR pipeline (rna.input_output) and the deep learning generators (dl-implementation). A Dataset holds the
+replicates of all samples stacked in one array, the offsets of the replicates of each sample, the sample types and
+the marker names. Samples, validity flags and replicate means are derived from these arrays; the samples are views on
+the stacked replicates, not copies.
+
+read_dataset parses a file once per process. With a cache_dir the arrays are also saved as .npy files, which later
+runs and other processes load memory-mapped instead of parsing the file again.
+
+This module only depends on numpy and pandas, so dl-implementation can use it without the sklearn stack of rna.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from collections import Counter, OrderedDict
+
+import numpy as np
+import pandas as pd
+
+
+def read_df(filename, nreplicates=None, type_column=0, replicate_column='replicate_value'):
+    """
+    Reads in an xls (or csv) file as a dataframe, replacing NA if required. Returns the dataframe containing the data
+    with the signal values and a dataframe with the repeated measurements belonging to a sample.
+
+    :param filename: path to the file
+    :param nreplicates: number of repeated measurements
+    :param type_column: name or position of the column with the cell type (or sample name), used as index
+    :param replicate_column: name of the column with the replicate values
+    :return: df: pd.DataFrame and rv: pf.DataFrame
+    """
+    pd.options.mode.chained_assignment = None # to silence warning
+    if str(filename).lower().endswith('.csv'):
+        # let pandas figure out whether the separator is ',' or ';'
+        raw_df = pd.read_csv(filename, sep=None, engine='python', index_col=type_column)
+    else:
+        raw_df = pd.read_excel(filename, delimiter=';', index_col=type_column)
+    try:
+        rv = raw_df[[replicate_column]]
+        df = raw_df.loc[:, (raw_df.columns.values != replicate_column)]
+        df.fillna(0, inplace=True)
+    except KeyError:
+        print("Replicate values have not been found and will be added manually."
+              "The number of repeated measurements per sample is {}".format(nreplicates))
+        df = raw_df
+        df.fillna(0, inplace=True)
+        unique_celltypes = pd.Series(df.index).unique()
+        n_per_celltype = Counter(df.index)
+
+        rv_list = []
+        for celltype in unique_celltypes:
+            replicates_for_this_celltype = [i for i in range(1, nreplicates + 1)] * int(
+                n_per_celltype[celltype] / nreplicates)
+            if (n_per_celltype[celltype]/nreplicates).is_integer():
+                rv_list.extend(replicates_for_this_celltype)
+            else:
+                replicates_for_this_celltype = replicates_for_this_celltype + \
+                                               [i for i in range(1, nreplicates+1)][0:n_per_celltype[celltype] - len(replicates_for_this_celltype)]
+                rv_list.extend(replicates_for_this_celltype)
+        rv = pd.DataFrame(rv_list, index=df.index)
+
+    return df, rv
+
+
+def sample_offsets(replicate_values, types):
+    """
+    Returns the offsets of the samples: a row starts a new sample if its replicate value is not higher than that of
+    the previous row, or if its type differs.
+
+    :param replicate_values: n_rows array of replicate values
+    :param types: n_rows array of the type (or name) of each row
+    :return: n_samples + 1 array with the first row of each sample, and the number of rows
+    """
+    replicate_values = np.asarray(replicate_values, dtype=float)
+    types = np.asarray(types)
+    new_sample = (replicate_values[1:] <= replicate_values[:-1]) | (types[1:] != types[:-1])
+    return np.r_[0, np.flatnonzero(new_sample) + 1, len(types)] if len(types) else np.zeros(1, dtype=int)
+
+
+class Dataset():
+    """
+    The replicates of a set of samples.
+
+    :param values: n_replicates x n_markers array of the measurements of all replicates, those of a sample
+        consecutive
+    :param offsets: n_samples + 1 array, the replicates of sample i are values[offsets[i]:offsets[i + 1]]
+    :param types: n_samples array of str: the cell type (or name) of each sample, mixtures separated by '+'
+    :param markers: list of the n_markers marker names
+    """
+
+    def __init__(self, values, offsets, types, markers):
+        self.values = values
+        self.offsets = np.asarray(offsets, dtype=int)
+        self.types = np.asarray(types, dtype=str)
+        self.markers = list(markers)
+        assert self.values.shape == (self.offsets[-1], len(self.markers))
+        assert len(self.types) == len(self.offsets) - 1
+
+    @classmethod
+    def from_frame(cls, df, rv, markers=None):
+        """
+        Returns the Dataset of a dataframe as returned by read_df: the replicates with the type as index, and the
+        replicate values.
+
+        :param markers: None for all numeric columns, or the names of the columns to keep. Other columns of an
+            export, such as a sample id or date, are dropped.
+        """
+        if markers is None:
+            df = df.select_dtypes(include=['number', 'bool'])
+        else:
+            df = df[list(markers)]
+        types = np.array([str(name) for name in df.index])
+        offsets = sample_offsets(np.ravel(np.array(rv)), types)
+        return cls(np.array(df, dtype=float), offsets, types[offsets[:-1]], df.columns)
+
+    def __len__(self):
+        return len(self.types)
+
+    @property
+    def replicate_counts(self):
+        return np.diff(self.offsets)
+
+    def replicate_types(self):
+        """
+        Returns the type of each replicate.
+        """
+        return np.repeat(self.types, self.replicate_counts)
+
+    def samples(self, indices=None, markers=None):
+        """
+        Returns the replicates of each sample as a list of views on the values.
+
+        :param indices: None for all samples, or the indices (or a boolean mask) of the samples to return
+        :param markers: None for all markers, or the names of the markers to return (which copies the values once)
+        :return: list of n_replicates x n_markers arrays
+        """
+        values = self.values
+        if markers is not None and list(markers) != self.markers:
+            values = values[:, [self.markers.index(marker) for marker in markers]]
+        indices = np.arange(len(self)) if indices is None else np.arange(len(self))[indices]
+        return [values[self.offsets[i]:self.offsets[i + 1]] for i in indices]
+
+    def select(self, mask):
+        """
+        Returns the Dataset of the samples in the boolean mask.
+        """
+        mask = np.asarray(mask, dtype=bool)
+        if np.all(mask):
+            return self
+        values = self.values[np.repeat(mask, self.replicate_counts)]
+        return Dataset(values, np.r_[0, np.cumsum(self.replicate_counts[mask])], self.types[mask], self.markers)
+
+    def binarized(self, cut_off=150):
+        """
+        Returns the Dataset with the values 1 if above the cut-off and 0 otherwise.
+        """
+        return Dataset((self.values > cut_off).astype(float), self.offsets, self.types, self.markers)
+
+    def means(self):
+        """
+        Returns the n_samples x n_markers array of the mean over the replicates of each sample.
+        """
+        if len(self) == 0:
+            return np.zeros((0, len(self.markers)))
+        return np.add.reduceat(self.values, self.offsets[:-1], axis=0) / self.replicate_counts[:, np.newaxis]
+
+    def housekeeping_valid(self):
+        """
+        Returns per sample whether its replicates are good enough to use. After consultation: keep if at least 50% of
+        housekeeping markers (the last two columns) are detected. Blanks are always kept.
+        """
+        if len(self) == 0:
+            return np.zeros(0, dtype=bool)
+        housekeeping = np.add.reduceat(self.values[:, -1] + self.values[:, -2], self.offsets[:-1])
+        is_blank = np.array(['Blank' in sample_type for sample_type in self.types], dtype=bool)
+        return ~(housekeeping < self.replicate_counts / 2) | is_blank
+
+    def markers_detected(self, markers, cut_off):
+        """
+        Returns per sample whether each of the markers is above the cut-off in at least one of its replicates.
+        """
+        if len(self) == 0:
+            return np.zeros(0, dtype=bool)
+        above = (self.values[:, [self.markers.index(marker) for marker in markers]] > cut_off).astype(int)
+        return np.all(np.add.reduceat(above, self.offsets[:-1], axis=0) > 0, axis=1)
+
+    def save(self, path):
+        """
+        Saves the arrays as .npy files in the directory path.
+        """
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, 'values.npy'), self.values)
+        np.save(os.path.join(path, 'offsets.npy'), self.offsets)
+        np.save(os.path.join(path, 'types.npy'), self.types)
+        with open(os.path.join(path, 'markers.json'), 'w') as f:
+            json.dump(self.markers, f)
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        """
+        Loads a Dataset saved with save, by default with the values memory-mapped read-only.
+        """
+        with open(os.path.join(path, 'markers.json')) as f:
+            markers = json.load(f)
+        return cls(np.load(os.path.join(path, 'values.npy'), mmap_mode=mmap_mode),
+                   np.load(os.path.join(path, 'offsets.npy')), np.load(os.path.join(path, 'types.npy')), markers)
+
+
+# (path, size, modification time, parse arguments) -> Dataset, the most recently used last
+_datasets = OrderedDict()
+MAX_CACHED_DATASETS = 16
+
+
+def read_dataset(filename, nreplicates=None, type_column=0, replicate_column='replicate_value', cache_dir=None,
+                 markers=None):
+    """
+    Returns the Dataset of a data file, see read_df. The file is parsed once per process: later calls return the
+    same Dataset, of which the values are read-only, unless the file changed.
+
+    :param markers: None for all numeric columns, or the names of the columns to keep, see Dataset.from_frame
+    :param cache_dir: None, or a directory to store the parsed arrays in. The arrays of a file (with the same
+        contents and arguments) that was parsed before, eg by another process, are loaded memory-mapped from there.
+    """
+    stat = os.stat(filename)
+    arguments = [nreplicates, type_column, replicate_column, None if markers is None else list(markers)]
+    key = (os.path.abspath(filename), stat.st_size, stat.st_mtime_ns, str(arguments))
+    if key in _datasets:
+        _datasets.move_to_end(key)
+        return _datasets[key]
+
+    dataset = None
+    if cache_dir is not None:
+        h = hashlib.sha1(json.dumps(arguments).encode())
+        with open(filename, 'rb') as f:
+            h.update(f.read())
+        cache_path = os.path.join(cache_dir, '{}-{}'.format(os.path.basename(filename), h.hexdigest()[:16]))
+        if os.path.exists(cache_path):
+            dataset = Dataset.load(cache_path)
+    if dataset is None:
+        dataset = Dataset.from_frame(*read_df(filename, nreplicates, type_column, replicate_column), markers=markers)
+        dataset.values.flags.writeable = False
+        if cache_dir is not None:
+            # write to a temporary directory first, so other processes never load a partial cache
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp_path = tempfile.mkdtemp(dir=cache_dir)
+            dataset.save(tmp_path)
+            try:
+                os.rename(tmp_path, cache_path)
+            except OSError:
+                # another process was first
+                shutil.rmtree(tmp_path, ignore_errors=True)
+
+    _datasets[key] = dataset
+    if len(_datasets) > MAX_CACHED_DATASETS:
+        _datasets.popitem(last=False)
+    return dataset
@@ -1,18 +1,165 @@
-import os
-import pickle
+import csv
+import queue
+import threading
+import time
 from tkinter import *
 from tkinter import filedialog
 from tkinter import messagebox
 
 import numpy as np
 
-# Create a window that fills the screen.
-from rna.analytics import combine_samples
-from rna.input_output import get_data_per_cell_type
+from rna.batch_scoring import DEFAULT_TARGET_CLASSES, PRIOR_VALUES, make_label_encoder, prior_to_string, \
+    write_lrs_header, write_lrs_rows
 from rna.constants import single_cell_types, marker_names
+from rna.input_output import read_case_data
+from rna.scoring_service import DEFAULT_MODELS, RemoteModel, ScoringService
 from rna.utils import string2vec
 
 
+class ScoringJob:
+    """
+    A case file to score, with the settings of the GUI at the time it was submitted. Each job has its own cancelled
+    event, so cancelling cannot stop a job submitted afterwards, nor miss the job the worker is just starting.
+    """
+
+    def __init__(self, open_filename, save_filename, number_of_replicates, from_penile, priors_numerator,
+                 priors_denominator):
+        self.open_filename = open_filename
+        self.save_filename = save_filename
+        self.number_of_replicates = number_of_replicates
+        self.from_penile = from_penile
+        self.priors_numerator = priors_numerator
+        self.priors_denominator = priors_denominator
+        self.cancelled = threading.Event()
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class ScoringWorker(threading.Thread):
+    """
+    Scores the submitted case files one by one on a background thread, so the window stays responsive. Reports
+    (kind, job, message) on the progress queue, where kind is 'stage', 'done', 'cancelled' or 'error'. The models
+    stay loaded between jobs, and for label powerset models so do the probabilities of the last samples scored:
+    scoring the same case file again with other priors does not run the classifier again.
+
+    :param progress: queue to report the progress on
+    :param models: dict: model name -> path to the model, see scoring_service
+    :param service_url: None or url of a running scoring service to score with instead of loading the models
+    """
+
+    def __init__(self, progress, models=DEFAULT_MODELS, service_url=None):
+        super().__init__(daemon=True)
+        self.progress = progress
+        self.service_url = service_url
+        self.models = ScoringService(models) if service_url is None else None
+        self.jobs = queue.Queue()
+        # the jobs submitted and not finished yet, guarded by the lock
+        self._unfinished = []
+        self._lock = threading.Lock()
+        # (model, X, probabilities of the combinations of cell types) of the last label powerset model used
+        self._forward_pass = (None, None, None)
+
+    def submit(self, job):
+        with self._lock:
+            self._unfinished.append(job)
+        self.jobs.put(job)
+
+    def cancel(self):
+        """
+        Stops the current job at the next stage and the queued jobs before their first stage.
+        """
+        with self._lock:
+            for job in self._unfinished:
+                job.cancelled.set()
+            self._unfinished = []
+
+    def stop(self):
+        self.cancel()
+        self.jobs.put(None)
+
+    def run(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            try:
+                n_samples = self.score(job)
+                self.progress.put(('done', job, 'wrote LRs for {} samples to {}'.format(n_samples, job.save_filename)))
+            except JobCancelled:
+                self.progress.put(('cancelled', job, 'cancelled'))
+            except Exception as e:
+                self.progress.put(('error', job, str(e)))
+            with self._lock:
+                if job in self._unfinished:
+                    self._unfinished.remove(job)
+
+    def stage(self, job, name, function, *args):
+        if job.cancelled.is_set():
+            raise JobCancelled()
+        start = time.time()
+        result = function(*args)
+        self.progress.put(('stage', job, '{} ({:.1f}s)'.format(name, time.time() - start)))
+        return result
+
+    def get_model(self, from_penile):
+        model_name = 'vagmenstr_with_penile' if from_penile else 'vagmenstr_no_penile'
+        if self.service_url is not None:
+            return RemoteModel(self.service_url, model_name)
+        model, _ = self.models.get_model(model_name)
+        return model
+
+    def score(self, job):
+        X, sample_names, valid, markers = self.stage(job, 'read case file', read_case_data, job.open_filename,
+                                                     job.number_of_replicates)
+        if markers != marker_names:
+            raise ValueError("The marker labels are inconsistent with the trained model, please fix the labels. "
+                             "The correct labels are: {}. Found {}".format(marker_names, markers))
+        model = self.stage(job, 'load model', self.get_model, job.from_penile)
+
+        label_encoder = make_label_encoder(job.from_penile)
+        target_classes = string2vec(DEFAULT_TARGET_CLASSES, label_encoder)
+        log_lrs = None
+        if np.any(valid):
+            log_lrs = np.log10(self.stage(job, 'calculate LRs', self.calculate_lrs, model, X[valid], target_classes,
+                                          job.priors_numerator, job.priors_denominator))
+
+        def write():
+            priors = [prior_to_string(job.priors_numerator, label_encoder),
+                      prior_to_string(job.priors_denominator, label_encoder)]
+            with open(job.save_filename, 'w', newline='') as f:
+                writer = csv.writer(f, delimiter=';', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+                write_lrs_header(writer, DEFAULT_TARGET_CLASSES)
+                write_lrs_rows(writer, [(job.open_filename, sample_name, is_valid)
+                                        for sample_name, is_valid in zip(sample_names, valid)],
+                               log_lrs, len(DEFAULT_TARGET_CLASSES), priors)
+
+        self.stage(job, 'write results', write)
+        return len(sample_names)
+
+    def calculate_lrs(self, model, X, target_classes, priors_numerator, priors_denominator):
+        """
+        Returns the LRs of model.predict_lrs. For label powerset models these are calculated from the probabilities
+        of the combinations of cell types (see MarginalClassifier.lrs_for_hypotheses), which are kept for the next
+        job on the same samples.
+        """
+        if not hasattr(model, 'lrs_for_hypotheses'):
+            # a model of the scoring service
+            return model.predict_lrs(X, target_classes, priors_numerator, priors_denominator)
+        cached_model, cached_X, prob = self._forward_pass
+        if cached_model is not model or not np.array_equal(cached_X, X):
+            try:
+                prob = model.predict_label_powerset_proba(X, n_celltypes=target_classes.shape[1])
+            except ValueError:
+                # sigmoid models only know their target classes, and do not use the priors
+                return model.predict_lrs(X, target_classes, priors_numerator, priors_denominator)
+            self._forward_pass = (model, X, prob)
+        return model.lrs_for_hypotheses(prob, [(target_class, priors_numerator, priors_denominator)
+                                               for target_class in target_classes])
+
+
+# Create a window that fills the screen.
 class FullScreenApp(object):
 
     def __init__(self, master):
@@ -38,6 +185,10 @@ class AnalyseExcel:
 
         self.is_penile = BooleanVar()
 
+        # the worker scores the submitted files in the background and reports back through the progress queue
+        self.progress = queue.Queue()
+        self.worker = ScoringWorker(self.progress)
+
         # cell class name to {Uniform, 1, 0} prior
         self.top_variables = {}
         self.bottom_variables = {}
@@ -47,11 +198,10 @@ class AnalyseExcel:
         self.master.grid_rowconfigure(15, minsize=50)
 
     def run(self):
+        self.worker.start()
+        self.master.after(100, self.poll_progress)
         mainloop()
-
-        ################################################################################
-
-        self.analyse_data()
+        self.worker.stop()
 
     # Function that saves the location of the input file.
     def open_file_name(self):
@@ -68,30 +218,38 @@ class AnalyseExcel:
         self.save_text_widget.delete('1.0', END)
         self.save_text_widget.insert(END, self.save_filename)
 
-    # Function to restart the program.
-    def restart_program(self):
-        python = sys.executable
-        os.execl(python, python, *sys.argv)
-
-    # Function that checks if the input file and the save location have been selected. If not, a text box will appear.
-    def close(self):
-        if self.open_filename and self.save_filename:
-            self.master.destroy()
-        # if open_file and not save_file:
-        #     t = Text(master, height=2, width=50)
-        #     t.grid(row=3, column=3)
-        #     t.insert(END, 'Please select a location to save the results')
-        # if not open_file and save_file:
-        #     t = Text(master, height=2, width=50)
-        #     t.grid(row=2, column=3)
-        #     t.insert(END, 'Please select a file to open')
-        # if not open_file and not save_file:
-        #     t = Text(master, height=2, width=50)
-        #     t.grid(row=2, column=3)
-        #     t.insert(END, 'Please select a file to open')
-        #     t_1 = Text(master, height=2, width=50)
-        #     t_1.grid(row=3, column=3)
-        #     t_1.insert(END, 'Please select a location to save the results')
+    # Function that checks if the input file and the save location have been selected and queues the file for scoring.
+    def submit(self):
+        if not self.open_filename or not self.save_filename:
+            messagebox.showinfo("Warning", "Please select a file to open and a location to save the results")
+            return
+        label_encoder = make_label_encoder(self.is_penile.get())
+        job = ScoringJob(self.open_filename, self.save_filename, self.number_of_replicates,
+                         self.is_penile.get(), get_prior(label_encoder, self.top_variables),
+                         get_prior(label_encoder, self.bottom_variables))
+        self.worker.submit(job)
+        self.show_status('{}: queued'.format(job.open_filename))
+
+    # Function that stops the file being scored and the queued files.
+    def cancel(self):
+        self.worker.cancel()
+        self.show_status('cancelling')
+
+    def show_status(self, text):
+        self.status_text_widget.insert(END, text + '\n')
+        self.status_text_widget.see(END)
+
+    # Function that shows the progress of the worker, called regularly by the Tk event loop.
+    def poll_progress(self):
+        while True:
+            try:
+                kind, job, message = self.progress.get_nowait()
+            except queue.Empty:
+                break
+            if kind == 'error':
+                messagebox.showinfo("Warning", "{}: {}".format(job.open_filename, message))
+            self.show_status('{}: {}'.format(job.open_filename, message))
+        self.master.after(100, self.poll_progress)
 
     # Function that creates the LR results table
     def create_table(self, cell_types):
@@ -113,367 +271,20 @@ class AnalyseExcel:
         e_1.pack(padx=5)
 
         def ok():
-            self.number_of_replicates = e_1.get()
+            try:
+                number_of_replicates = int(e_1.get())
+            except ValueError:
+                number_of_replicates = 0
+            if number_of_replicates < 1:
+                messagebox.showinfo("Warning", "The number of replicates should be a positive whole number")
+                return
+            self.number_of_replicates = number_of_replicates
 
             top.destroy()
 
         b = Button(top, text="OK", command=ok)
         b.pack(pady=5)
 
-    def analyse_data(self):
-        # global master, self.tree, button_load
-
-        model_filename, read_marker_names, names, X_single, n_celltypes_with_penile, \
-        n_features, n_per_celltype = self.load_data()
-
-        X = combine_samples(X_single)
-
-        print('data loaded, shape {}. {}'.format(X.shape, X[0, :]))
-
-
-        n_single_cell_types = 8
-
-        test_data_grouped = []
-        predicted_proba_average = []
-        predicted_proba_4 = []
-        proba_final_top = []
-        proba_final_bottom = []
-        if read_marker_names != marker_names:
-            messagebox.showinfo("Warning",
-                                "'The marker labels are inconsistent with the trained model, please fix the labels. "
-                                "The correct labels are: {}. Found {}".format(marker_names, read_marker_names))
-            print("'The marker labels are inconsistent with the trained model, please fix the labels. "
-                                "The correct labels are: {}. Found {}".format(marker_names, read_marker_names))
-        # Load the trained model and all classes present in the trained model.
-        model = pickle.load(open(model_filename, 'rb'))
-
-        priors_numerator = get_prior(string2index, self.top_variables)
-        priors_denominator = get_prior(string2index, self.bottom_variables)
-
-        # for now, target classes are all separate classes and vag muc+menstr secr.
-        target_classes_str = list(single_cell_types) + ['Vaginal.mucosa and/or Menstrual.secretion']
-        lrs = model.predict_lrs(X, string2vec(target_classes_str, string2index), priors_numerator=priors_numerator,
-                                priors_denominator=priors_denominator)
-        print(lrs)
-        #
-        # # classes = pickle.load(open('classes.pkl', 'rb'))
-        # # mixture_classes_in_single_cell_type = pickle.load(open('mixture_classes_in_single_cell_type', 'rb'))
-        # prob_per_class = get_prob_per_class(X, mixture_classes_in_single_cell_type, model, max_lr=10)
-        #
-        # print(prob_per_class)
-        # print(prob_per_class.shape)
-        # # Predict the probabilities for the input data for every trained class.
-        # predict_proba = model.predict_lrs(X)
-        # # predict_proba = predict_proba.toarray()
-        #
-        # predicted_proba_4.append(predict_proba)
-        # # predicted_proba_average.append(sum(predict_proba) / self.number_of_replicates)
-        #
-        # proba_list = []
-        # LR_prediction_list = []
-        # top_list = []
-        # bottom_list = []
-        # final_list = []
-        #
-        # # all_cell_types = ['Blank_PCR', 'Semen.fertile', 'Saliva', 'Nasal.mucosa', 'Menstrual.secretion', 'Blood',
-        # #                   'Semen.sterile', 'Vaginal.mucosa', 'Skin', 'Skin.penile']
-        #
-        # cell_types_yes_top = [self.single_cell_types[i] for i in
-        #                       [i for i, x in enumerate(self.top_variables) if x == 'Always']]
-        # cell_types_no_top = [self.single_cell_types[i] for i in
-        #                      [i for i, x in enumerate(self.top_variables) if x == 'Never']]
-        #
-        # cell_types_yes_bottom = [self.single_cell_types[i] for i in
-        #                          [i for i, x in enumerate(self.bottom_variables) if x == 'Always']]
-        # cell_types_no_bottom = [self.single_cell_types[i] for i in
-        #                         [i for i, x in enumerate(self.bottom_variables) if x == 'NEVER']]
-        #
-        # # TOP PART OF LR
-        # for probabilility_4, probability_average in zip(predicted_proba_4, predicted_proba_average):
-        #     proba_all_top = []
-        #     # Probability for 4 replicates
-        #     for probability_single in probabilility_4:
-        #         proba_per_class = []
-        #         matches_yes_list = []
-        #         matches_no_list = []
-        #         if len(cell_types_yes_top) != 0:
-        #             for single_cell_type in cell_types_yes_top:
-        #                 matches_yes = [i for i, s in enumerate(classes) if single_cell_type in s]
-        #                 matches_yes_list.append(matches_yes)
-        #             flatten_yes = [item for sublist in matches_yes_list for item in sublist]
-        #             new_list_yes = sorted(set(flatten_yes))
-        #             dup_list_yes = []
-        #             for i in range(len(new_list_yes)):
-        #                 if (flatten_yes.count(new_list_yes[i]) > len(cell_types_yes_top) - 1):
-        #                     dup_list_yes.append(new_list_yes[i])
-        #
-        #         else:
-        #             for single_cell_type in self.single_cell_types:
-        #                 matches_yes = [i for i, s in enumerate(classes) if single_cell_type in s]
-        #                 matches_yes_list.append(matches_yes)
-        #             dup_list_yes = [item for sublist in matches_yes_list for item in sublist]
-        #
-        #         for single_cell_type_no in cell_types_no_top:
-        #             matches_no = [i for i, s in enumerate(classes) if single_cell_type_no in s]
-        #             matches_no_list.append(matches_no)
-        #         flatten_no = [item for sublist in matches_no_list for item in sublist]
-        #
-        #         difference_top_list = list(set(list(set(dup_list_yes))) - set(list(set(flatten_no))))
-        #
-        #         for class_index in difference_top_list:
-        #             proba_per_class.append(probability_single[class_index])
-        #         proba_all_top.append(sum(proba_per_class))
-        #
-        #     # Probability for average of 4 replicates
-        #     proba_per_class = []
-        #     matches_yes_list = []
-        #     matches_no_list = []
-        #     if len(cell_types_yes_top) != 0:
-        #         for single_cell_type in cell_types_yes_top:
-        #             matches_yes = [i for i, s in enumerate(classes) if single_cell_type in s]
-        #             matches_yes_list.append(matches_yes)
-        #         flatten_yes = [item for sublist in matches_yes_list for item in sublist]
-        #         new_list_yes = sorted(set(flatten_yes))
-        #         dup_list_yes = []
-        #         for i in range(len(new_list_yes)):
-        #             if (flatten_yes.count(new_list_yes[i]) > len(cell_types_yes_top) - 1):
-        #                 dup_list_yes.append(new_list_yes[i])
-        #     else:
-        #         for single_cell_type in self.single_cell_types:
-        #             matches_yes = [i for i, s in enumerate(classes) if single_cell_type in s]
-        #             matches_yes_list.append(matches_yes)
-        #         dup_list_yes = [item for sublist in matches_yes_list for item in sublist]
-        #
-        #     for single_cell_type_no in cell_types_no_top:
-        #         matches_no = [i for i, s in enumerate(classes) if single_cell_type_no in s]
-        #         matches_no_list.append(matches_no)
-        #     flatten_no = [item for sublist in matches_no_list for item in sublist]
-        #
-        #     difference_top_list = list(set(list(set(dup_list_yes))) - set(list(set(flatten_no))))
-        #
-        #     for class_index in difference_top_list:
-        #         proba_per_class.append(probability_average[class_index])
-        #     proba_all_top.append(sum(proba_per_class))
-        #     proba_final_top.append(proba_all_top)
-        #
-        # # BOTTOM PART OF LR
-        # for probabilility_4, probability_average in zip(predicted_proba_4, predicted_proba_average):
-        #     proba_all_bottom = []
-        #     # Probability for 4 replicates
-        #     for probability_single in probabilility_4:
-        #         proba_per_class = []
-        #         matches_yes_list = []
-        #         matches_no_list = []
-        #         if len(cell_types_yes_bottom) != 0:
-        #             for single_cell_type in cell_types_yes_bottom:
-        #                 matches_yes = [i for i, s in enumerate(classes) if single_cell_type in s]
-        #                 matches_yes_list.append(matches_yes)
-        #             flatten_yes = [item for sublist in matches_yes_list for item in sublist]
-        #             new_list_yes = sorted(set(flatten_yes))
-        #             dup_list_yes = []
-        #             for i in range(len(new_list_yes)):
-        #                 if (flatten_yes.count(new_list_yes[i]) > len(cell_types_yes_bottom) - 1):
-        #                     dup_list_yes.append(new_list_yes[i])
-        #         else:
-        #             for single_cell_type in self.single_cell_types:
-        #                 matches_yes = [i for i, s in enumerate(classes) if single_cell_type in s]
-        #                 matches_yes_list.append(matches_yes)
-        #             dup_list_yes = [item for sublist in matches_yes_list for item in sublist]
-        #
-        #         for single_cell_type_no in cell_types_no_bottom:
-        #             matches_no = [i for i, s in enumerate(classes) if single_cell_type_no in s]
-        #             matches_no_list.append(matches_no)
-        #         flatten_no = [item for sublist in matches_no_list for item in sublist]
-        #
-        #         difference_bottom_list = list(set(list(set(dup_list_yes))) - set(list(set(flatten_no))))
-        #
-        #         for class_index in difference_bottom_list:
-        #             proba_per_class.append(probability_single[class_index])
-        #         proba_all_bottom.append(sum(proba_per_class))
-        #
-        #     # Probability for average of 4 replicates
-        #     proba_per_class = []
-        #     matches_yes_list = []
-        #     matches_no_list = []
-        #     if len(cell_types_yes_bottom) != 0:
-        #         for single_cell_type in cell_types_yes_bottom:
-        #             matches_yes = [i for i, s in enumerate(classes) if single_cell_type in s]
-        #             matches_yes_list.append(matches_yes)
-        #         flatten_yes = [item for sublist in matches_yes_list for item in sublist]
-        #         new_list_yes = sorted(set(flatten_yes))
-        #         dup_list_yes = []
-        #         for i in range(len(new_list_yes)):
-        #             if (flatten_yes.count(new_list_yes[i]) > len(cell_types_yes_bottom) - 1):
-        #                 dup_list_yes.append(new_list_yes[i])
-        #     else:
-        #         for single_cell_type in self.single_cell_types:
-        #             matches_yes = [i for i, s in enumerate(classes) if single_cell_type in s]
-        #             matches_yes_list.append(matches_yes)
-        #         dup_list_yes = [item for sublist in matches_yes_list for item in sublist]
-        #
-        #     for single_cell_type_no in cell_types_no_bottom:
-        #         matches_no = [i for i, s in enumerate(classes) if single_cell_type_no in s]
-        #         matches_no_list.append(matches_no)
-        #     flatten_no = [item for sublist in matches_no_list for item in sublist]
-        #
-        #     difference_bottom_list = list(set(list(set(dup_list_yes))) - set(list(set(flatten_no))))
-        #
-        #     for class_index in difference_bottom_list:
-        #         proba_per_class.append(probability_average[class_index])
-        #     proba_all_bottom.append(sum(proba_per_class))
-        #     proba_final_bottom.append(proba_all_bottom)
-        #
-        # # Calculate the LR
-        # for proba_one_top, proba_one_bottom in zip(proba_final_top, proba_final_bottom):
-        #     LR_list = []
-        #     top_list_temp = []
-        #     bottom_list_temp = []
-        #     final_list_temp = []
-        #     for prob_one_top, prob_one_bottom in zip(proba_one_top, proba_one_bottom):
-        #         top_list_temp.append(np.sum(prob_one_top))
-        #         bottom_list_temp.append(np.sum(prob_one_bottom))
-        #         LR_list.append(np.log10(np.sum(prob_one_top) / np.sum(prob_one_bottom)))
-        #         final_list_temp.append([np.sum(prob_one_top), np.sum(prob_one_bottom),
-        #                                 np.log10(np.sum(prob_one_top) / np.sum(prob_one_bottom))])
-        #
-        #     final_list.append(final_list_temp)
-        #     top_list.append(top_list_temp)
-        #     bottom_list.append(bottom_list_temp)
-        #     LR_prediction_list.append(LR_list)
-
-        # # Create a window that shows the output table with the LR's
-        # master = Tk()
-        # app = FullScreenApp(master)
-        #
-        # frame = Frame(master)
-        # frame.pack()
-        #
-        # neutral_list_top = [x for x in self.single_cell_types if x not in cell_types_yes_top]
-        # neutral_list_top = [x for x in neutral_list_top if x not in cell_types_no_top]
-        #
-        # neutral_list_bottom = [x for x in self.single_cell_types if x not in cell_types_yes_bottom]
-        # neutral_list_bottom = [x for x in neutral_list_bottom if x not in cell_types_no_bottom]
-        #
-        # # LR table
-        # text = Text(frame, width=200, height=1)
-        # text.insert('1.0', cell_types_yes_top)
-        # text.insert('1.0', 'Top yes: ')
-        # text.pack(side=TOP)
-        # text1 = Text(frame, width=200, height=1)
-        # text1.insert('1.0', cell_types_no_top)
-        # text1.insert('1.0', 'Top no: ')
-        # text1.pack(side=TOP)
-        # text2 = Text(frame, width=200, height=1)
-        # text2.insert('1.0', neutral_list_top)
-        # text2.insert('1.0', 'Top neutral: ')
-        # text2.pack(side=TOP)
-        # text3 = Text(frame, width=200, height=1)
-        # text3.insert('1.0', cell_types_yes_bottom)
-        # text3.insert('1.0', 'Bottom yes: ')
-        # text3.pack(side=TOP)
-        # text4 = Text(frame, width=200, height=1)
-        # text4.insert('1.0', cell_types_no_bottom)
-        # text4.insert('1.0', 'Bottom no: ')
-        # text4.pack(side=TOP)
-        # text5 = Text(frame, width=200, height=1)
-        # text5.insert('1.0', neutral_list_bottom)
-        # text5.insert('1.0', 'Bottom neutral: ')
-        # text5.pack(side=TOP)
-        #
-        # labels = ['Probability top', 'Probability bottom', 'Log(10) LR']
-        # labels_csv = ['Probability top', 'Probability bottom', 'Log(10) LR', 'Top yes', 'Top no', 'Top neutral',
-        #               'Bottom no', 'Bottom yes', 'Bottom neutral']
-        #
-        # number_columns = range(1, (len(labels) + 2))
-        #
-        # self.tree = ttk.Treeview(frame, columns=number_columns, height=20, show="headings")
-        # self.tree.pack(side=TOP)
-        #
-        # self.create_table(labels)
-        #
-        # i = 1
-        # j = 0
-        # values = []
-        #
-        # temp_list_grouped = []
-        # for grouped_LR in final_list:
-        #
-        #     temp_value = []
-        #     for val in grouped_LR:
-        #         val = [round(v, 2) for v in val]
-        #         if i % (self.number_of_replicates + 1) == 0:
-        #             index = 'Average'
-        #         else:
-        #             index = names[j]
-        #             j = j + 1
-        #
-        #         values.append(index)
-        #         if i % (self.number_of_replicates + 1) == 0:
-        #             self.tree.insert('', 'end', values=(
-        #                 index, val[0], val[1], val[2]), tags=('average',))
-        #         else:
-        #             self.tree.insert('', 'end', values=(
-        #                 index, val[0], val[1], val[2]), tags=('normal',))
-        #         i = i + 1
-        #         temp_value.append(val)
-        #     temp_list_grouped.append(temp_value)
-        #
-        # self.tree.tag_configure('average', background='lightblue')
-        #
-        # frames = []
-        # for LR_grouped in temp_list_grouped:
-        #     df = pd.DataFrame.from_records(LR_grouped, columns=labels)
-        #     frames.append(df)
-        #
-        # # Save the LR selection in a dataframe
-        # d = {'Top_yes': [cell_types_yes_top], 'Top_no': [cell_types_no_top], 'Top_neutral': [neutral_list_top],
-        #      'Bottom_yes': [cell_types_yes_bottom], 'Bottom_no': [cell_types_no_bottom],
-        #      'Bottom_neutral': [neutral_list_bottom]}
-        # df_LR_types = pd.DataFrame(data=d, columns=['Top_yes', 'Top_no', 'Top_neutral', 'Bottom_yes', 'Bottom_no',
-        #                                             'Bottom_neutral'])
-        # df_LR_types = df_LR_types.set_index('Top_yes')
-        #
-        # # Save LR results in a dataframe
-        # result = pd.concat(frames)
-        # result['Sample_name'] = values
-        # result.set_index('Sample_name', inplace=True)
-        #
-        # # Save the results LR dataframe in a csv file.
-        # try:
-        #     with open(self.save_filename + '.csv', 'w') as f:
-        #         result.to_csv(f)
-        #     with open(self.save_filename + '.csv', 'a') as f:
-        #         df_LR_types.to_csv(f)
-        # except IOError:
-        #     sys.exit()
-
-        # button_load = Button(master, command=self.restart_program, text="Restart", height=2, width=15)
-        # button_load.pack(side=TOP)
-
-        mainloop()
-
-
-
-    def load_data(self):
-        # Load trained model
-        if self.is_penile.get():
-            filename = 'mlpmodel_penile'
-        else:
-            filename = 'calibrated_model'
-        # If there is no input file selected, the program quits.
-        # try:
-        # xl = pd.ExcelFile(self.open_filename)
-        X_single, _, n_celltypes_with_penile, n_features, n_per_celltype,  \
-        marker_names, names = \
-            get_data_per_cell_type(filename=self.open_filename, single_cell_types=single_cell_types,
-                                   ground_truth_known=False, binarize=True,
-                                   number_of_replicates=self.number_of_replicates)
-        # except ValueError:
-        #     sys.exit()
-        # except IndexError:
-        #     sys.exit()
-        return filename, marker_names, names, X_single, n_celltypes_with_penile, n_features, n_per_celltype
-
     def add_buttons(self):
         for i, cell in enumerate(single_cell_types):
             self.top_variables[cell] = StringVar()
@@ -487,12 +298,13 @@ class AnalyseExcel:
             rb = Radiobutton(self.master, text='Never', variable=self.top_variables[cell], value='Never')
             rb.grid(row=5, column=i + 4)
 
-            rb = Radiobutton(self.master, text='Uniform', variable=self.top_variables[cell], value='Uniform')
+            self.bottom_variables[cell] = StringVar()
+            rb = Radiobutton(self.master, text='Uniform', variable=self.bottom_variables[cell], value='Uniform')
             rb.grid(row=7, column=i + 4)
             rb.select()
-            rb = Radiobutton(self.master, text='Always', variable=self.top_variables[cell], value='Always')
+            rb = Radiobutton(self.master, text='Always', variable=self.bottom_variables[cell], value='Always')
             rb.grid(row=8, column=i + 4)
-            rb = Radiobutton(self.master, text='Never', variable=self.top_variables[cell], value='Never')
+            rb = Radiobutton(self.master, text='Never', variable=self.bottom_variables[cell], value='Never')
             rb.grid(row=9, column=i + 4)
 
         self.open_text_widget = Text(self.master, height=2, width=50)
@@ -515,21 +327,23 @@ class AnalyseExcel:
             self.master, text="Penile swab?", variable=self.is_penile,
         )
         button.grid(row=5, column=3)
-        button_load = Button(self.master, command=self.close, text="Run", height=2, width=20, bg='darkseagreen')
+        button_load = Button(self.master, command=self.submit, text="Run", height=2, width=20, bg='darkseagreen')
         button_load.grid(row=9, column=2)
+        button_load = Button(self.master, command=self.cancel, text="Cancel", height=2, width=20)
+        button_load.grid(row=10, column=2)
+
+        self.status_text_widget = Text(self.master, height=8, width=50)
+        self.status_text_widget.grid(row=9, column=3, rowspan=4)
 
 
-def get_prior(string2index, variables):
-    priors = [-1] * len(single_cell_types)
+def get_prior(label_encoder, variables):
+    # cell types without radiobuttons (penile skin) are uniform
+    priors = [PRIOR_VALUES['uniform']] * len(label_encoder.classes_)
     for cell_type, string_var in variables.items():
-        if string_var.get() == 'Uniform':
-            priors[string2index[cell_type]] = .5
-        elif string_var.get() == 'Always':
-            priors[string2index[cell_type]] = 1
-        elif string_var.get() == 'Never':
-            priors[string2index[cell_type]] = 0
-        else:
-            raise ValueError('unexpected radiobutton string value (Unknown, Always, Never), found {}'.format(string_var.get()))
+        try:
+            priors[label_encoder.transform([cell_type])[0]] = PRIOR_VALUES[string_var.get().lower()]
+        except KeyError:
+            raise ValueError('unexpected radiobutton string value (Uniform, Always, Never), found {}'.format(string_var.get()))
     return priors
 
 if __name__ == '__main__':
@@ -0,0 +1,243 @@
+"""
+Lightweight timing and memory instrumentation of the stages of an analysis (reading data, augmentation, fitting,
+calibration, prediction, metrics, pickling). Stages are wrapped in spans:
+
+    with instrumentation.context(fold=n, model='MLR'):
+        with instrumentation.span('fit') as span:
+            span.add_arrays(X_train=X_train)
+            model.fit_classifier(X_train, y_train)
+
+Each span records its wall time, CPU time, the peak RSS of the process so far, the sizes of the arrays added to it
+and the tags of the enclosing contexts (eg fold, model, prior). Spans are written as one json object per line to a
+log file and summarised per stage at the end of a run with print_summary.
+
+Instrumentation is disabled until enable is called. While disabled, span and context return a shared object that
+does nothing, so the instrumented code runs at (almost) the same speed.
+"""
+
+import json
+import os
+import sys
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+def peak_rss():
+    """
+    Returns the peak resident set size of this process in bytes, or None if this is not available on this platform.
+    """
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macos
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+def array_size(array):
+    """
+    Returns the shape and size in bytes of a numpy array, or the length of a list of (arrays of) samples.
+    """
+    if isinstance(array, np.ndarray):
+        return {'shape': list(array.shape), 'nbytes': int(array.nbytes)}
+    try:
+        return {'len': len(array)}
+    except TypeError:
+        return None
+
+
+class _NullSpan():
+    """
+    Returned by span and context when instrumentation is disabled.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def add_arrays(self, **arrays):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Span():
+
+    def __init__(self, recorder, stage, tags):
+        self.recorder = recorder
+        self.stage = stage
+        self.tags = tags
+        self.arrays = OrderedDict()
+
+    def add_arrays(self, **arrays):
+        """
+        Records the sizes of the arrays, by name.
+        """
+        for name, array in arrays.items():
+            self.arrays[name] = array_size(array)
+
+    def __enter__(self):
+        self.start_wall = time.perf_counter()
+        self.start_cpu = time.process_time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        record = OrderedDict([('stage', self.stage)])
+        record.update(self.recorder.tags())
+        record.update(self.tags)
+        record['wall'] = time.perf_counter() - self.start_wall
+        record['cpu'] = time.process_time() - self.start_cpu
+        record['peak_rss'] = peak_rss()
+        if self.arrays:
+            record['arrays'] = self.arrays
+        if exc_type is not None:
+            record['error'] = exc_type.__name__
+        self.recorder.write(record)
+        return False
+
+
+class _Context():
+
+    def __init__(self, recorder, tags):
+        self.recorder = recorder
+        self.tags = tags
+
+    def __enter__(self):
+        self.recorder.context_stack.append(self.tags)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.recorder.context_stack.pop()
+        return False
+
+
+class Recorder():
+    """
+    Collects the spans and counters, and writes the spans to a jsonl file.
+
+    :param path: None or path of the jsonl file to append the spans to
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.context_stack = []
+        self.records = []
+        self.counters = OrderedDict()
+        self._file = None
+        if path is not None:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            self._file = open(path, 'a')
+
+    def tags(self):
+        tags = OrderedDict()
+        for context_tags in self.context_stack:
+            tags.update(context_tags)
+        return tags
+
+    def write(self, record):
+        self.records.append(record)
+        if self._file is not None:
+            self._file.write(json.dumps(record, default=str) + '\n')
+            self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            if self.counters:
+                self._file.write(json.dumps({'counters': self.counters}) + '\n')
+            self._file.close()
+            self._file = None
+
+    def summary(self):
+        """
+        Returns per stage the number of spans, the total wall and CPU time in seconds and the maximum peak RSS.
+        Nested spans are counted in each of their stages.
+        """
+        summary = OrderedDict()
+        for record in self.records:
+            stage = summary.setdefault(record['stage'], {'n': 0, 'wall': 0., 'cpu': 0., 'peak_rss': None})
+            stage['n'] += 1
+            stage['wall'] += record['wall']
+            stage['cpu'] += record['cpu']
+            if record['peak_rss'] is not None:
+                stage['peak_rss'] = max(stage['peak_rss'] or 0, record['peak_rss'])
+        return summary
+
+
+_recorder = None
+
+
+def enable(path=None):
+    """
+    Starts recording spans, appending them to the jsonl file at path (if given). Returns the Recorder.
+    """
+    global _recorder
+    disable()
+    _recorder = Recorder(path)
+    return _recorder
+
+
+def disable():
+    """
+    Stops recording and closes the log file.
+    """
+    global _recorder
+    if _recorder is not None:
+        _recorder.close()
+    _recorder = None
+
+
+def is_enabled():
+    return _recorder is not None
+
+
+def span(stage, **tags):
+    """
+    Returns a context manager that records the time and memory of the code in it as the given stage.
+
+    :param stage: str: name of the stage, eg 'fit'
+    :param tags: extra tags of this span
+    """
+    if _recorder is None:
+        return _NULL_SPAN
+    return Span(_recorder, stage, tags)
+
+
+def context(**tags):
+    """
+    Returns a context manager that adds the tags (eg fold=n) to all spans within it.
+    """
+    if _recorder is None:
+        return _NULL_SPAN
+    return _Context(_recorder, tags)
+
+
+def count(name, value=1):
+    """
+    Adds value to the counter with the given name.
+    """
+    if _recorder is not None:
+        _recorder.counters[name] = _recorder.counters.get(name, 0) + value
+
+
+def print_summary():
+    """
+    Prints a table with the total time and the peak memory per stage, and the counters.
+    """
+    if _recorder is None or not _recorder.records:
+        return
+    print('{:<24} {:>6} {:>10} {:>10} {:>14}'.format('stage', 'n', 'wall (s)', 'cpu (s)', 'peak rss (MB)'))
+    for stage, values in _recorder.summary().items():
+        rss = '' if values['peak_rss'] is None else '{:.0f}'.format(values['peak_rss'] / 2 ** 20)
+        print('{:<24} {:>6} {:>10.2f} {:>10.2f} {:>14}'.format(stage, values['n'], values['wall'], values['cpu'],
+                                                                rss))
+    for name, value in _recorder.counters.items():
+        print('{:<24} {:>6}'.format(name, value))
@@ -1,37 +1,88 @@
+import importlib
+import importlib.util
+import os
+import sys
 from functools import partial
 
 import numpy as np
-from lir import LogitCalibrator, ELUBbounder
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.linear_model import LogisticRegression
-from sklearn.multiclass import OneVsRestClassifier
-from sklearn.neural_network import MLPClassifier
-from sklearn.svm import SVC
-from xgboost import XGBClassifier
+from scipy.sparse import csr_matrix
 
-from rna.constants import single_cell_types
+from rna.utils import codes2nhot, project_on_target_classes
+
+# The classifier backends (sklearn, xgboost, keras) are imported where they are used, so that loading a trained model
+# to score with does not import all of them.
+
+# the deep learning network of MarginalDLClassifier is defined in dl-implementation/ml/model.py
+DL_IMPLEMENTATION_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'dl-implementation')
+# the name the package ml of dl-implementation is imported under, see import_dl_module
+DL_PACKAGE = 'rna_dl_implementation'
+
+
+class WeightedLogitCalibrator():
+    """
+    lir's LogitCalibrator that can take sample weights, e.g. to express the prior on the augmented calibration data.
+    Does not inherit from it, as importing lir also imports matplotlib.
+    """
+
+    def fit(self, X, y, sample_weight=None):
+        from sklearn.linear_model import LogisticRegression
+
+        X = X.reshape(-1, 1)
+        self._logit = LogisticRegression(class_weight='balanced')
+        self._logit.fit(X, y, sample_weight=sample_weight)
+        return self
+
+    def transform(self, X):
+        X = self._logit.predict_proba(X.reshape(-1, 1))[:, 1]  # probability of class 1
+        self.p0 = (1 - X)
+        self.p1 = X
+        return self.p1 / self.p0
 
 
 class MarginalClassifier():
-    def fit_calibration(self, X, y_nhot, target_classes, calibration_on_loglrs=True):
+    def encode_label_powerset(self, y):
+        """
+        When y is a list of labels of combinations of cell types (label powerset, see MultiLabelEncoder), the
+        classifier is fitted on the index of the combinations that occur in y only. Their labels are kept in
+        label_powerset_codes to marginalise over, so the number of classes does not grow with 2 ** n_celltypes.
+        A nhot encoded y is returned as is.
+
+        :param y: list of labels or N x n_celltypes nhot encoded matrix
+        :return: y to fit the classifier on
+        """
+        y = np.asarray(y)
+        if len(y.shape) == 1:
+            self.label_powerset_codes, y = np.unique(y, return_inverse=True)
+        else:
+            self.label_powerset_codes = None
+        return y
+
+    def fit_calibration(self, X, y_nhot, target_classes, calibration_on_loglrs=True, sample_weight=None,
+                        y_target=None):
         """
         Makes calibrated model for each target class
         :param calibration_on_loglrs:
+        :param sample_weight: None or array of length N with a weight per sample
+        :param y_target: None or y_nhot projected on the target classes (see project_on_target_classes), to reuse
         """
         lrs_per_target_class = self.predict_lrs(X, target_classes, with_calibration=False)
+        # only pass on the weights when given, so calibrators without support for them can still be used
+        fit_params = {} if sample_weight is None else {'sample_weight': sample_weight}
+        if y_target is None:
+            y_target = project_on_target_classes(y_nhot, target_classes)
 
         for i, target_class in enumerate(target_classes):
             calibrator = self._calibrator()
-            # np.max ensures that the nhot matrix is converted into a nhot list with the
-            # lrs from the relevant target classes coded as a 1.
-            labels = np.max(np.multiply(y_nhot, target_class), axis=1)
+            # the lrs from the relevant target classes coded as a 1.
+            labels = y_target[:, i]
             if calibration_on_loglrs:
                 loglrs = np.log10(lrs_per_target_class[:, i]).reshape(-1, 1)
                 # loglrs = np.nan_to_num(np.log10(lrs_per_target_class[:, i]).reshape(-1, 1), nan=-self.MAX_LR-1, posinf=self.MAX_LR, neginf=-self.MAX_LR)
-                self._calibrators_per_target_class[str(target_class)] = calibrator.fit(loglrs, labels)
+                self._calibrators_per_target_class[str(target_class)] = calibrator.fit(loglrs, labels, **fit_params)
             else:
                 probs = np.nan_to_num(lrs_per_target_class[:, i] / (1 + lrs_per_target_class[:, i]))
-                self._calibrators_per_target_class[str(target_class)] = calibrator.fit(probs.reshape(-1, 1), labels)
+                self._calibrators_per_target_class[str(target_class)] = calibrator.fit(probs.reshape(-1, 1), labels,
+                                                                                       **fit_params)
 
 
     def predict_lrs(self, X, target_classes, priors_numerator=None, priors_denominator=None, with_calibration=True,
@@ -57,46 +108,119 @@ class MarginalClassifier():
         try:
             ypred_proba = self._classifier.predict_proba(X)
             lrs_per_target_class = convert_prob_to_marginal_per_class(ypred_proba, target_classes, self.MAX_LR,
-                                                                      priors_numerator, priors_denominator)
+                                                                      priors_numerator, priors_denominator,
+                                                                      getattr(self, 'label_powerset_codes', None))
         except AttributeError:
             ypred_proba = self._classifier.predict(X)
 
             lrs_per_target_class = convert_prob_to_marginal_per_class(ypred_proba, target_classes, self.MAX_LR,
-                                                                      priors_numerator, priors_denominator)
+                                                                      priors_numerator, priors_denominator,
+                                                                      getattr(self, 'label_powerset_codes', None))
 
         if with_calibration:
-            try:
-                for i, target_class in enumerate(target_classes):
-                    calibrator = self._calibrators_per_target_class[str(target_class)]
-                    if calibration_on_loglrs:
-                        loglrs_for_target_class = np.nan_to_num(np.log10(lrs_per_target_class[:, i]), nan=-self.MAX_LR-1, posinf=self.MAX_LR, neginf=-self.MAX_LR)
-                        lrs_per_target_class[:, i] = calibrator.transform(loglrs_for_target_class.reshape(-1, 1))
-                    else:
-                        probs_for_target_class = np.nan_to_num(lrs_per_target_class[:, i] / (1 + lrs_per_target_class[:, i]), nan=-self.MAX_LR-1, posinf=self.MAX_LR, neginf=-self.MAX_LR)
-                        lrs_per_target_class[:, i] = calibrator.transform(probs_for_target_class.reshape(-1, 1))
-            except AttributeError:
-                lrs_per_target_class = lrs_per_target_class
+            lrs_per_target_class = self.calibrate_lrs(lrs_per_target_class, target_classes, calibration_on_loglrs)
 
         return np.nan_to_num(lrs_per_target_class, nan=10**(-self.MAX_LR-1), posinf=10**self.MAX_LR, neginf=10**(-self.MAX_LR))
 
+    def calibrate_lrs(self, lrs_per_target_class, target_classes, calibration_on_loglrs=True):
+        """
+        Applies the calibrator of the target class to each column of lrs_per_target_class (in place).
+
+        :param lrs_per_target_class: N x n_columns array of uncalibrated LRs
+        :param target_classes: the target class of each column
+        """
+        try:
+            for i, target_class in enumerate(target_classes):
+                calibrator = self._calibrators_per_target_class[str(target_class)]
+                if calibration_on_loglrs:
+                    loglrs_for_target_class = np.nan_to_num(np.log10(lrs_per_target_class[:, i]), nan=-self.MAX_LR-1, posinf=self.MAX_LR, neginf=-self.MAX_LR)
+                    lrs_per_target_class[:, i] = calibrator.transform(loglrs_for_target_class.reshape(-1, 1))
+                else:
+                    probs_for_target_class = np.nan_to_num(lrs_per_target_class[:, i] / (1 + lrs_per_target_class[:, i]), nan=-self.MAX_LR-1, posinf=self.MAX_LR, neginf=-self.MAX_LR)
+                    lrs_per_target_class[:, i] = calibrator.transform(probs_for_target_class.reshape(-1, 1))
+        except AttributeError:
+            lrs_per_target_class = lrs_per_target_class
+        return lrs_per_target_class
+
+    def predict_label_powerset_proba(self, X, n_celltypes=None):
+        """
+        Returns the probabilities of the combinations of cell types, to evaluate many hypotheses on with
+        lrs_for_hypotheses. Only label powerset (softmax) models give these; sigmoid models only know the target
+        classes they are trained on, for which a ValueError is raised.
+
+        :param X: the N x n_features data
+        :param n_celltypes: None, or the number of single cell types, to recognise models fitted on all 2 **
+            n_celltypes combinations before label_powerset_codes was kept
+        :return: N x n_combinations array of probabilities
+        """
+        if getattr(self, 'label_powerset_codes', None) is None and n_celltypes is None:
+            raise ValueError('hypotheses can only be evaluated for label powerset models')
+        prob = self._classifier.predict_proba(X)
+        if getattr(self, 'label_powerset_codes', None) is None and prob.shape[1] != 2 ** n_celltypes:
+            raise ValueError('hypotheses can only be evaluated for label powerset models')
+        return prob
+
+    def lrs_for_hypotheses(self, prob, hypotheses, with_calibration=True, calibration_on_loglrs=True):
+        """
+        Gives the LRs of a batch of hypothesis pairs, from the probabilities of predict_label_powerset_proba. Changing
+        the hypotheses does not run the classifier again.
+
+        :param prob: N x n_combinations array from predict_label_powerset_proba
+        :param hypotheses: list of (target_class, priors_numerator, priors_denominator), see predict_lrs
+        :return: N x n_hypotheses array of LRs, the same as predict_lrs gives for each hypothesis
+        """
+        label_powerset_codes = getattr(self, 'label_powerset_codes', None)
+        if label_powerset_codes is None:
+            label_powerset_codes = np.arange(prob.shape[1])
+        target_classes = [np.asarray(target_class) for target_class, _, _ in hypotheses]
+        numerator_matrix, denominator_matrix = get_hypothesis_matrices(hypotheses, label_powerset_codes)
+        numerator = numerator_matrix.T.dot(prob.T).T
+        denominator = denominator_matrix.T.dot(prob.T).T
+        with np.errstate(divide='ignore', invalid='ignore'):
+            lrs = numerator / denominator
+        lrs = np.clip(lrs, 10 ** -self.MAX_LR, 10 ** self.MAX_LR)
+
+        if with_calibration:
+            lrs = self.calibrate_lrs(lrs, target_classes, calibration_on_loglrs)
+
+        return np.nan_to_num(lrs, nan=10**(-self.MAX_LR-1), posinf=10**self.MAX_LR, neginf=10**(-self.MAX_LR))
+
+    def predict_lrs_for_hypotheses(self, X, hypotheses, with_calibration=True, calibration_on_loglrs=True):
+        """
+        predict_lrs for a batch of hypothesis pairs, running the classifier once.
+
+        :param X: the N x n_features data
+        :param hypotheses: list of (target_class, priors_numerator, priors_denominator), see predict_lrs
+        :return: N x n_hypotheses array of LRs
+        """
+        n_celltypes = len(hypotheses[0][0]) if hypotheses else None
+        return self.lrs_for_hypotheses(self.predict_label_powerset_proba(X, n_celltypes), hypotheses, with_calibration,
+                                       calibration_on_loglrs)
+
 
 class MarginalMLPClassifier(MarginalClassifier):
-    def __init__(self, calibrator=LogitCalibrator, activation='relu',
+    def __init__(self, calibrator=WeightedLogitCalibrator, activation='relu',
                  random_state=0, max_iter=500, MAX_LR=10):
+        from sklearn.neural_network import MLPClassifier
+
         self._classifier = MLPClassifier(activation=activation, random_state=random_state, max_iter=max_iter)
         self._calibrator = calibrator
         self._calibrators_per_target_class = {}
         self.MAX_LR = MAX_LR
 
-    def fit_classifier(self, X, y):
-        if self._classifier.activation == 'logistic':
+    def fit_classifier(self, X, y, sample_weight=None):
+        y = self.encode_label_powerset(y)
+        if self._classifier.activation == 'logistic' and len(y.shape) == 2:
             if y.shape[1] == 1:
                 y = np.ravel(y)
-        self._classifier.fit(X, y)
+        fit_with_sample_weight(self._classifier, X, y, sample_weight)
 
 
 class MarginalRFClassifier(MarginalClassifier):
-    def __init__(self, calibrator=LogitCalibrator, multi_label='ovr', MAX_LR=10):
+    def __init__(self, calibrator=WeightedLogitCalibrator, multi_label='ovr', MAX_LR=10):
+        from sklearn.ensemble import RandomForestClassifier
+        from sklearn.multiclass import OneVsRestClassifier
+
         if multi_label=='ovr':
             self._classifier = OneVsRestClassifier(RandomForestClassifier(class_weight='balanced', max_depth=3))
         else:
@@ -105,16 +229,20 @@ class MarginalRFClassifier(MarginalClassifier):
         self._calibrators_per_target_class = {}
         self.MAX_LR = MAX_LR
 
-    def fit_classifier(self, X, y):
+    def fit_classifier(self, X, y, sample_weight=None):
         # if self._classifier.activation == 'logistic':
         #     if y.shape[1] == 1:
         #         y = np.ravel(y)
-        self._classifier.fit(X, y)
+        y = self.encode_label_powerset(y)
+        fit_with_sample_weight(self._classifier, X, y, sample_weight)
 
 
 class MarginalSVMClassifier(MarginalClassifier):
 
-    def __init__(self, calibrator=LogitCalibrator, multi_label='ovr', MAX_LR=10):
+    def __init__(self, calibrator=WeightedLogitCalibrator, multi_label='ovr', MAX_LR=10):
+        from sklearn.multiclass import OneVsRestClassifier
+        from sklearn.svm import SVC
+
         if multi_label=='ovr':
             self._classifier = OneVsRestClassifier(SVC(probability=True,
                 class_weight='balanced'))
@@ -124,14 +252,18 @@ class MarginalSVMClassifier(MarginalClassifier):
         self._calibrators_per_target_class = {}
         self.MAX_LR = MAX_LR
 
-    def fit_classifier(self, X, y):
-        self._classifier.fit(X, y)
+    def fit_classifier(self, X, y, sample_weight=None):
+        y = self.encode_label_powerset(y)
+        fit_with_sample_weight(self._classifier, X, y, sample_weight)
 
 
 class MarginalMLRClassifier(MarginalClassifier):
 
-    def __init__(self, random_state=0, calibrator=LogitCalibrator,
+    def __init__(self, random_state=0, calibrator=WeightedLogitCalibrator,
                  multi_class='ovr', solver='liblinear', MAX_LR=10):
+        from sklearn.linear_model import LogisticRegression
+        from sklearn.multiclass import OneVsRestClassifier
+
         if multi_class == 'ovr':
             self._classifier = OneVsRestClassifier(LogisticRegression(multi_class=multi_class, solver=solver, class_weight='balanced'))
         else:
@@ -140,8 +272,9 @@ class MarginalMLRClassifier(MarginalClassifier):
         self._calibrators_per_target_class = {}
         self.MAX_LR = MAX_LR
 
-    def fit_classifier(self, X, y):
-        self._classifier.fit(X, y)
+    def fit_classifier(self, X, y, sample_weight=None):
+        y = self.encode_label_powerset(y)
+        fit_with_sample_weight(self._classifier, X, y, sample_weight)
 
     def get_coefficients(self, t, target_class):
         """
@@ -151,13 +284,10 @@ class MarginalMLRClassifier(MarginalClassifier):
         :param target_class:
         :return:
         """
-        if len(self._classifier.coef_) == 2 ** 8:
+        if getattr(self, 'label_powerset_codes', None) is not None:
             # the marginal takes the sum over many probabilities. taking the log does not yield anything nice it seems
             # (although the mean will probably correlate)
-            raise NotImplementedError
-            # indices_target_class = get_mixture_columns_for_class(target_class, None)
-            # intercept = np.mean(model._classifier.intercept_[indices_target_class])
-            # coefficients = np.mean(model._classifier.coef_[indices_target_class, :], axis=0)
+            raise NotImplementedError('coefficients are not defined for the label powerset model')
         else:
             intercept = self._classifier.intercept_[t, :].squeeze() / np.log(10)
             coefficients = self._classifier.coef_[t, :].squeeze() / np.log(10)
@@ -172,8 +302,11 @@ class MarginalMLRClassifier(MarginalClassifier):
 
 class MarginalXGBClassifier(MarginalClassifier):
 
-    def __init__(self, method='softmax', calibrator=LogitCalibrator,
+    def __init__(self, method='softmax', calibrator=WeightedLogitCalibrator,
                  MAX_LR=10):
+        from sklearn.multiclass import OneVsRestClassifier
+        from xgboost import XGBClassifier
+
         if method == 'softmax':
             self._classifier = XGBClassifier(class_weight='balanced')
         elif method == 'sigmoid':
@@ -183,8 +316,9 @@ class MarginalXGBClassifier(MarginalClassifier):
         self._calibrators_per_target_class = {}
         self.MAX_LR = MAX_LR
 
-    def fit_classifier(self, X, y):
-        self._classifier.fit(X, y)
+    def fit_classifier(self, X, y, sample_weight=None):
+        y = self.encode_label_powerset(y)
+        fit_with_sample_weight(self._classifier, X, y, sample_weight)
 
         if self.method == 'softmax':
             self.n_trees = len(self._classifier.get_booster().get_dump())
@@ -205,7 +339,239 @@ class MarginalXGBClassifier(MarginalClassifier):
             # plt.show()
 
 
-def convert_prob_to_marginal_per_class(prob, target_classes, MAX_LR, priors_numerator=None, priors_denominator=None):
+class MarginalDLClassifier(MarginalClassifier):
+    """
+    The deep learning network of dl-implementation (see ml.model.build_model). With the softmax activation layer the
+    network is fitted on labels (label powerset), with sigmoid on nhot encoded labels, as the other classifiers.
+    keras and tensorflow are only imported when the network is fitted.
+    """
+
+    def __init__(self, activation_layer='sigmoid', optimizer='adam', loss='binary_crossentropy', epochs=30,
+                 units=100, batch_size=128, predict_batch_size=8192, n_threads=None, random_state=0,
+                 calibrator=WeightedLogitCalibrator, MAX_LR=10):
+        self._classifier = KerasClassifier(activation_layer=activation_layer, optimizer=optimizer, loss=loss,
+                                           epochs=epochs, units=units, batch_size=batch_size,
+                                           predict_batch_size=predict_batch_size, n_threads=n_threads,
+                                           random_state=random_state)
+        self._calibrator = calibrator
+        self._calibrators_per_target_class = {}
+        self.MAX_LR = MAX_LR
+
+    def fit_classifier(self, X, y, sample_weight=None):
+        y = self.encode_label_powerset(y)
+        self._classifier.fit(X, y, sample_weight=sample_weight)
+
+
+class KerasClassifier():
+    """
+    A network built with ml.model.build_model, with the fit/predict_proba/predict interface of sklearn that
+    MarginalClassifier uses. The number of outputs is the number of classes in y.
+
+    :param activation_layer: 'softmax' or 'sigmoid', the activation of the output layer
+    :param batch_size: number of samples per gradient update
+    :param predict_batch_size: number of samples predicted at once. Predicting is only a few matrix products, so large
+        batches keep the cpu busy rather than the overhead of keras per batch.
+    :param n_threads: None, or the number of threads tensorflow may use, e.g. to share a CPU-only host with other
+        processes (see configure_keras_threads)
+    """
+
+    def __init__(self, activation_layer='sigmoid', optimizer='adam', loss='binary_crossentropy', epochs=30, units=100,
+                 batch_size=128, predict_batch_size=8192, n_threads=None, random_state=0):
+        self.activation_layer = activation_layer
+        self.optimizer = optimizer
+        self.loss = loss
+        self.epochs = epochs
+        self.units = units
+        self.batch_size = batch_size
+        self.predict_batch_size = predict_batch_size
+        self.n_threads = n_threads
+        self.random_state = random_state
+        self.model = None
+
+    def fit(self, X, y, sample_weight=None):
+        """
+        Fits a new network on X and y, streaming the shuffled batches from the augmented data (see
+        augmented_batches) rather than converting all data to the input of the network at once.
+
+        :param y: N array of the index of the class (softmax) or N x n_classes nhot encoded matrix (sigmoid)
+        """
+        dl_model = import_dl_model(self.n_threads)
+
+        y = np.asarray(y)
+        n_classes = int(np.max(y)) + 1 if len(y.shape) == 1 else y.shape[1]
+        self.model = dl_model.build_model(units=self.units, n_classes=n_classes, n_features=X.shape[1],
+                                          activation=self.activation_layer)
+        dl_model.compile_model(self.model, optimizer=self.optimizer, loss=self.loss)
+        self.model.fit_generator(augmented_batches(X, y, self.batch_size, n_classes, sample_weight, self.random_state),
+                                 steps_per_epoch=int(np.ceil(len(X) / self.batch_size)), epochs=self.epochs, verbose=0)
+        return self
+
+    def predict_proba(self, X):
+        return self.model.predict(np.asarray(X, dtype=np.float32), batch_size=self.predict_batch_size)
+
+    def predict(self, X):
+        """
+        Returns the index of the most probable class (softmax), or the nhot encoded classes with a probability above
+        .5 (sigmoid).
+        """
+        prob = self.predict_proba(X)
+        if self.activation_layer == 'softmax':
+            return np.argmax(prob, axis=1)
+        return (prob > .5).astype(int)
+
+    def __getstate__(self):
+        # a keras model cannot be pickled, so its weights are
+        state = self.__dict__.copy()
+        if self.model is not None:
+            state['model'] = (self.model.to_json(), self.model.get_weights())
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.model is not None:
+            import_dl_model(self.n_threads)
+            from keras.models import model_from_json
+
+            architecture, weights = self.model
+            self.model = model_from_json(architecture)
+            self.model.set_weights(weights)
+
+
+def augmented_batches(X, y, batch_size, n_classes, sample_weight=None, random_state=None):
+    """
+    Yields batches of the augmented data endlessly, in a new random order every epoch, for keras' fit_generator. Only
+    the samples of a batch are converted to float32 (and their labels one hot encoded), so no converted copy of all
+    data is kept in memory.
+
+    :param y: N array of the index of the class, or N x n_classes nhot encoded matrix
+    :param sample_weight: None or array of length N with a weight per sample
+    :return: generator of (X_batch, y_batch) or (X_batch, y_batch, sample_weight_batch)
+    """
+    rng = np.random.RandomState(random_state)
+    y = np.asarray(y)
+    if sample_weight is not None:
+        sample_weight = np.asarray(sample_weight)
+    while True:
+        order = rng.permutation(len(X))
+        for start in range(0, len(X), batch_size):
+            indices = order[start:start + batch_size]
+            X_batch = np.asarray(X[indices], dtype=np.float32)
+            if len(y.shape) == 1:
+                y_batch = np.zeros((len(indices), n_classes), dtype=np.float32)
+                y_batch[np.arange(len(indices)), y[indices]] = 1
+            else:
+                y_batch = np.asarray(y[indices], dtype=np.float32)
+            if sample_weight is None:
+                yield X_batch, y_batch
+            else:
+                yield X_batch, y_batch, sample_weight[indices]
+
+
+# the number of threads tensorflow was configured with in this process, see configure_keras_threads
+_keras_threads = None
+
+
+def import_dl_module(name):
+    """
+    Imports a module of the package ml of dl-implementation from its file, under the name rna_dl_implementation.<name>.
+    It is not imported from sys.path, as any other package called ml found there would be imported instead.
+
+    :param name: name of the module in the package, e.g. 'model'
+    :return: the module
+    """
+    if DL_PACKAGE not in sys.modules:
+        directory = os.path.join(DL_IMPLEMENTATION_DIR, 'ml')
+        spec = importlib.util.spec_from_file_location(DL_PACKAGE, os.path.join(directory, '__init__.py'),
+                                                      submodule_search_locations=[directory])
+        package = importlib.util.module_from_spec(spec)
+        sys.modules[DL_PACKAGE] = package
+        spec.loader.exec_module(package)
+    return importlib.import_module('{}.{}'.format(DL_PACKAGE, name))
+
+
+def import_dl_model(n_threads=None):
+    """
+    Imports ml.model of dl-implementation, and with it keras and tensorflow.
+
+    :param n_threads: None, or the number of threads tensorflow may use (see configure_keras_threads)
+    :return: the module ml.model
+    """
+    model = import_dl_module('model')
+    if n_threads is not None:
+        configure_keras_threads(n_threads)
+    return model
+
+
+def configure_keras_threads(n_threads):
+    """
+    Sets the number of threads tensorflow uses within an operation, such as a matrix product, on the cpu. By default
+    tensorflow uses as many threads as there are cores, which on a CPU-only host compete with the other processes
+    (e.g. the folds of an analysis running in parallel). Operations run one after the other, as the layers of the
+    network depend on each other.
+
+    Tensorflow can only be configured once per process: with tensorflow 1 the session is replaced, which would lose
+    the networks fitted before. Later calls with the same number of threads therefore do nothing, and calls with
+    another number raise a ValueError.
+    """
+    global _keras_threads
+    if _keras_threads is not None:
+        if n_threads != _keras_threads:
+            raise ValueError('tensorflow already uses {} threads, cannot change this to {}'.format(_keras_threads,
+                                                                                               n_threads))
+        return
+    _keras_threads = n_threads
+
+    import tensorflow as tf
+
+    if hasattr(tf, 'ConfigProto'):
+        # tensorflow 1, as used by dl-implementation
+        from keras import backend
+
+        config = tf.ConfigProto(intra_op_parallelism_threads=n_threads, inter_op_parallelism_threads=1)
+        backend.set_session(tf.Session(config=config))
+    else:
+        tf.config.threading.set_intra_op_parallelism_threads(n_threads)
+        tf.config.threading.set_inter_op_parallelism_threads(1)
+
+
+def fit_with_sample_weight(classifier, X, y, sample_weight=None):
+    """
+    Fits the classifier, passing on the sample weights if these are given. OneVsRestClassifier does not pass on
+    sample weights to its binary estimators, so in that case these are fitted here. Raises a ValueError if the
+    classifier cannot be fitted with sample weights, such as MLPClassifier.
+
+    :param classifier: unfitted sklearn (compatible) classifier
+    :param X: N x n_features data
+    :param y: labels or nhot encoded labels
+    :param sample_weight: None or array of length N with a weight per sample
+    :return: the fitted classifier
+    """
+    if sample_weight is None:
+        return classifier.fit(X, y)
+
+    from sklearn.base import clone
+    from sklearn.multiclass import OneVsRestClassifier
+    from sklearn.preprocessing import LabelBinarizer
+    from sklearn.utils.validation import has_fit_parameter
+
+    estimator = classifier.estimator if isinstance(classifier, OneVsRestClassifier) else classifier
+    if not has_fit_parameter(estimator, 'sample_weight'):
+        raise ValueError('{} cannot be fitted with sample weights'.format(type(estimator).__name__))
+
+    if isinstance(classifier, OneVsRestClassifier):
+        classifier.label_binarizer_ = LabelBinarizer(sparse_output=True)
+        Y = classifier.label_binarizer_.fit_transform(y).tocsc()
+        classifier.classes_ = classifier.label_binarizer_.classes_
+        classifier.estimators_ = [clone(classifier.estimator).fit(X, Y[:, i].toarray().ravel(),
+                                                                   sample_weight=sample_weight)
+                                  for i in range(Y.shape[1])]
+        return classifier
+
+    return classifier.fit(X, y, sample_weight=sample_weight)
+
+
+def convert_prob_to_marginal_per_class(prob, target_classes, MAX_LR, priors_numerator=None, priors_denominator=None,
+                                       label_powerset_codes=None):
     """
     Converts n_samples x n_mixtures matrix of probabilities to a n_samples x n_target_classes
     matrix by summing over the probabilities containing the celltype(s) of interest.
@@ -219,29 +585,31 @@ def convert_prob_to_marginal_per_class(prob, target_classes, MAX_LR, priors_nume
     :param priors_denominator: vector of length n_single_cell_types, specifying 0 indicates we know this single cell type
     does not occur, specify 1 indicates we know this cell type certainly occurs, anything else assume implicit uniform
     distribution
+    :param label_powerset_codes: None or array of length n_mixtures with the label (see MultiLabelEncoder) of the
+    combination of cell types of each column in prob. If None and prob has 2 ** n_celltypes columns, the columns are
+    all combinations in the order of the labels.
     :return: n_samples x n_target_classes of probabilities
     """
     assert priors_numerator is None or type(priors_numerator) == list or type(priors_numerator) == np.ndarray
     assert priors_denominator is None or type(priors_denominator) == list or type(priors_denominator) == np.ndarray
-    lrs = np.zeros((len(prob), len(target_classes)))
-    for i, target_class in enumerate(target_classes):
+    for target_class in target_classes:
         assert sum(target_class) > 0, 'No cell type given as target class'
 
-        if prob.shape[1] == 2 ** target_classes.shape[1]:  # lps
-            # numerator
-            indices_of_target_class = get_mixture_columns_for_class(target_class, priors_numerator)
-            numerator = np.sum(prob[:, indices_of_target_class], axis=1)
-
-            # denominator
-            # TODO: Does this work when priors are defined?
-            # TODO: Rewrite with priors.
-            # indices_of_non_target_class = get_mixture_columns_for_class(1-target_class, priors_denominator)
-            all_indices = get_mixture_columns_for_class([1] * len(target_class), priors_denominator)
-            indices_of_non_target_class = [idx for idx in all_indices if idx not in indices_of_target_class]
-            denominator = np.sum(prob[:, indices_of_non_target_class], axis=1)
-            lrs[:, i] = numerator / denominator
-
-        else:  # sigmoid
+    if label_powerset_codes is None and prob.shape[1] == 2 ** target_classes.shape[1]:
+        label_powerset_codes = np.arange(2 ** target_classes.shape[1])
+
+    if label_powerset_codes is not None:  # lps
+        numerator_matrix, denominator_matrix = get_marginalisation_matrices(target_classes, label_powerset_codes,
+                                                                            priors_numerator, priors_denominator)
+        # sparse matrix times dense matrix, the transposes keep the sparse matrix on the left
+        numerator = numerator_matrix.T.dot(prob.T).T
+        denominator = denominator_matrix.T.dot(prob.T).T
+        with np.errstate(divide='ignore', invalid='ignore'):
+            lrs = numerator / denominator
+
+    else:  # sigmoid
+        lrs = np.zeros((len(prob), len(target_classes)))
+        for i, target_class in enumerate(target_classes):
             if len(target_classes) > 1:
                 prob_target_class = prob[:, i].flatten()
                 # prob_target_class = np.reshape(prob_target_class, (-1, 1))
@@ -262,7 +630,71 @@ def convert_prob_to_marginal_per_class(prob, target_classes, MAX_LR, priors_nume
     return lrs
 
 
-def get_mixture_columns_for_class(target_class, priors):
+def get_marginalisation_matrices(target_classes, label_powerset_codes, priors_numerator=None,
+                                 priors_denominator=None):
+    """
+    Makes the sparse matrices that sum the label powerset probabilities into the numerator and the denominator of the
+    LR of each target class, so that only the columns that are present are visited.
+
+    :param target_classes: n_target_classes x n_celltypes containing the n hot encoded classes of interest
+    :param label_powerset_codes: array of length n_mixtures with the labels of the combinations of cell types
+    :param priors_numerator: see convert_prob_to_marginal_per_class
+    :param priors_denominator: see convert_prob_to_marginal_per_class
+    :return: two n_mixtures x n_target_classes sparse matrices of 0 and 1
+    """
+    return get_hypothesis_matrices([(target_class, priors_numerator, priors_denominator)
+                                    for target_class in target_classes], label_powerset_codes)
+
+
+def get_hypothesis_matrices(hypotheses, label_powerset_codes):
+    """
+    Makes the sparse matrices that sum the label powerset probabilities into the numerator and the denominator of the
+    LR of each hypothesis pair.
+
+    :param hypotheses: list of (target_class, priors_numerator, priors_denominator), see
+    convert_prob_to_marginal_per_class
+    :param label_powerset_codes: array of length n_mixtures with the labels of the combinations of cell types
+    :return: two n_mixtures x n_hypotheses sparse matrices of 0 and 1
+    """
+    n_celltypes = len(hypotheses[0][0])
+    binary = codes2nhot(label_powerset_codes, n_celltypes)
+    numerator_columns = []
+    denominator_columns = []
+    for target_class, priors_numerator, priors_denominator in hypotheses:
+        numerator = admissable_combinations(binary, target_class, priors_numerator)
+        numerator_columns.append(np.flatnonzero(numerator))
+        denominator_columns.append(np.flatnonzero(admissable_combinations(binary, [1] * n_celltypes,
+                                                                          priors_denominator) & ~numerator))
+
+    def to_sparse(columns):
+        rows = np.concatenate([np.asarray(indices, dtype=int) for indices in columns])
+        cols = np.repeat(np.arange(len(columns)), [len(indices) for indices in columns])
+        return csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(len(label_powerset_codes), len(columns)))
+
+    return to_sparse(numerator_columns), to_sparse(denominator_columns)
+
+
+def admissable_combinations(binary, target_class, priors):
+    """
+    Returns whether each combination contains one or more cell types of the target class and agrees with the priors.
+
+    :param binary: n_combinations x n_single_cell_types nhot encoding of the combinations
+    :param target_class: vector of length n_single_cell_types with at least one 1
+    :param priors: None or vector of length n_single_cell_types, see get_mixture_columns_for_class
+    :return: boolean array of length n_combinations
+    """
+    # at least one of the target class should occur
+    admissable = binary @ np.asarray(target_class) > 0
+    if priors is not None:
+        priors = np.asarray(priors)
+        # if prior is zero, the class should not occur
+        admissable &= ~np.any((binary == 1) & (priors == 0), axis=1)
+        # if prior is one, the class should occur
+        admissable &= ~np.any((binary == 0) & (priors == 1), axis=1)
+    return admissable
+
+
+def get_mixture_columns_for_class(target_class, priors, label_powerset_codes=None):
     """
     for the target_class, a vector of length n_single_cell_types with 1 or more 1's, give
     back the columns in the mixtures that contain one or more of these single cell types
@@ -270,32 +702,12 @@ def get_mixture_columns_for_class(target_class, priors):
     :param target_class: vector of length n_single_cell_types with at least one 1
     :param priors: vector of length n_single_cell_types with 0 or 1 to indicate single cell type has 0 or 1 prior,
     uniform assumed otherwise
+    :param label_powerset_codes: None or array with the label of the combination of cell types in each column. If None
+    the columns are all 2 ** n_single_cell_types combinations.
     :return: list of ints, in [0, 2 ** n_cell_types]
     """
-
-    def int_to_binary(i):
-        binary = bin(i)[2:]
-        while len(binary) < len(single_cell_types):
-            binary = '0' + binary
-        return np.flip([int(j) for j in binary]).tolist()
-
-    def binary_admissable(binary, target_class, priors):
-        """
-        gives back whether the binary (string of 0 and 1 of length n_single_cell_types) has at least one of
-        target_class in it, and all priors satisfied
-        """
-        if priors:
-            for i in range(len(target_class)):
-                # if prior is zero, the class should not occur
-                if binary[i] == 1 and priors[i] == 0:
-                    return False
-                # if prior is one, the class should occur
-                # as binary is zero it does not occur and return False
-                if binary[i] == 0 and priors[i] == 1:
-                    return False
-        # at least one of the target class should occur
-        if np.inner(binary, target_class) == 0:
-            return False
-        return True
-
-    return [i for i in range(2 ** len(single_cell_types)) if binary_admissable(int_to_binary(i), target_class, priors)]
+    n_celltypes = len(target_class)
+    if label_powerset_codes is None:
+        label_powerset_codes = np.arange(2 ** n_celltypes)
+    binary = codes2nhot(label_powerset_codes, n_celltypes)
+    return np.flatnonzero(admissable_combinations(binary, target_class, priors)).tolist()
@@ -0,0 +1,287 @@
+"""
+Performance metrics of a set of LRs: ROC curve and AUC, Tippett curves, error rates at LR=1, empirical cross-entropy
+(ECE) and PAV calibrated LRs. All are derived from one sort of the log10 LRs, and the results per set of LRs are
+cached (see get_lr_metrics), so the LRs pooled over all folds are sorted only once however many plots use them.
+
+PAV (pool adjacent violators) is implemented here in numpy rather than taken from lir, whose IsotonicCalibrator
+uses sklearn's IsotonicRegression and sorts again on every call.
+"""
+
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+
+
+def empirical_cross_entropy(lrs_h1, lrs_h2, priors):
+    """
+    Returns the empirical cross-entropy of the LRs for each prior probability of h1.
+
+    :param lrs_h1: LRs of the samples for which h1 is true
+    :param lrs_h2: LRs of the samples for which h2 is true
+    :param priors: prior probabilities of h1
+    :return: array of the ECE per prior
+    """
+    lrs_h1 = np.ravel(lrs_h1)
+    lrs_h2 = np.ravel(lrs_h2)
+    ece = []
+    for prior in priors:
+        odds = prior / (1 - prior)
+        ece.append(prior / len(lrs_h1) * np.sum(np.log2(1 + 1 / (lrs_h1 * odds))) +
+                   (1 - prior) / len(lrs_h2) * np.sum(np.log2(1 + lrs_h2 * odds)))
+    return np.array(ece)
+
+
+def cllr(lrs_h1, lrs_h2):
+    """
+    Returns the log likelihood ratio cost of the LRs.
+    """
+    return .5 * (np.mean(np.log2(1 + 1 / np.ravel(lrs_h1))) + np.mean(np.log2(1 + np.ravel(lrs_h2))))
+
+
+def pav(values, weights, max_vectorized_passes=20):
+    """
+    Isotonic regression: returns the non-decreasing sequence closest to values in weighted least squares.
+
+    Adjacent violators are pooled in vectorized passes: every run of decreasing block means is pooled at once. Once a
+    pass pools few blocks, the remaining blocks are merged on a stack in a single linear pass.
+
+    :param values: N array, in the order of the scores
+    :param weights: N array of positive weights
+    :return: N array of the fitted values
+    """
+    values = np.asarray(values, dtype=float)
+    weights = np.asarray(weights, dtype=float)
+    # blocks of pooled values: their start index, total weight and weighted sum
+    starts = np.arange(len(values))
+    block_weights = weights.copy()
+    block_sums = values * weights
+
+    for _ in range(max_vectorized_passes):
+        means = block_sums / block_weights
+        violations = means[:-1] > means[1:]
+        if not np.any(violations):
+            break
+        # a block starts a new pooled block unless it violates with its predecessor
+        new_block = np.r_[True, ~violations]
+        if np.count_nonzero(~new_block) < len(new_block) // 100:
+            break
+        first = np.flatnonzero(new_block)
+        starts = starts[first]
+        block_weights = np.add.reduceat(block_weights, first)
+        block_sums = np.add.reduceat(block_sums, first)
+
+    starts, block_weights, block_sums = list(starts), list(block_weights), list(block_sums)
+    stack_starts, stack_weights, stack_sums = [], [], []
+    for start, weight, total in zip(starts, block_weights, block_sums):
+        while stack_sums and stack_sums[-1] * weight > total * stack_weights[-1]:
+            # the mean of the previous block is higher: pool
+            start = stack_starts.pop()
+            weight += stack_weights.pop()
+            total += stack_sums.pop()
+        stack_starts.append(start)
+        stack_weights.append(weight)
+        stack_sums.append(total)
+
+    means = np.array(stack_sums) / np.array(stack_weights)
+    lengths = np.diff(np.r_[stack_starts, len(values)])
+    return np.repeat(means, lengths)
+
+
+def pav_posteriors(sorted_scores, labels):
+    """
+    Returns the PAV fit of the labels on the scores, with the classes weighted to equal total weight (as lir's
+    IsotonicCalibrator), so the posteriors p give LRs p / (1 - p). Samples with equal scores get the same posterior.
+
+    :param sorted_scores: N array of scores in ascending order
+    :param labels: N array of bools, True for h1
+    :return: N array of posteriors, 1 for all samples if all are h1 and 0 if all are h2
+    """
+    labels = np.asarray(labels, dtype=bool)
+    n_h1 = np.count_nonzero(labels)
+    if n_h1 == 0 or n_h1 == len(labels):
+        # the weights of the classes are undefined, the fit is the labels
+        return labels.astype(float)
+    weights = np.where(labels, len(labels) - n_h1, n_h1).astype(float)
+    first = np.flatnonzero(np.r_[True, np.diff(sorted_scores) != 0])
+    if len(first) == len(labels):
+        return pav(labels, weights)
+    # pool samples with equal scores first
+    tie_weights = np.add.reduceat(weights, first)
+    tie_means = np.add.reduceat(weights * labels, first) / tie_weights
+    posteriors = pav(tie_means, tie_weights)
+    return np.repeat(posteriors, np.diff(np.r_[first, len(labels)]))
+
+
+def posteriors_to_lrs(posteriors):
+    with np.errstate(divide='ignore'):
+        return posteriors / (1 - posteriors)
+
+
+class PavCalibrator():
+    """
+    PAV calibration with the fit/transform interface of lir's IsotonicCalibrator: transform returns LRs, interpolated
+    linearly between the scores seen in fit and nan outside their range.
+    """
+
+    def fit(self, X, y):
+        X = np.ravel(X)
+        order = np.argsort(X, kind='mergesort')
+        scores = X[order]
+        posteriors = pav_posteriors(scores, np.ravel(y)[order])
+        # the fit is constant within a pooled block, so only the first and last score of each block are needed to
+        # interpolate: far fewer points than scores, which makes transform fast
+        changes = np.diff(posteriors) != 0
+        knots = np.r_[True, changes] | np.r_[changes, True]
+        self.scores_ = scores[knots]
+        self.posteriors_ = posteriors[knots]
+        return self
+
+    def transform(self, X):
+        posteriors = np.interp(np.ravel(X), self.scores_, self.posteriors_, left=np.nan, right=np.nan)
+        return posteriors_to_lrs(posteriors)
+
+    def fit_transform(self, X, y):
+        return self.fit(X, y).transform(X)
+
+
+class LrMetrics():
+    """
+    The metrics of the LRs of one method and target class, computed on first use from the LRs sorted once.
+
+    :param lrs: N array of LRs
+    :param labels: N array, 1 if h1 is true for the sample and 0 if h2 is true
+    """
+
+    def __init__(self, lrs, labels):
+        lrs = np.ravel(lrs)
+        labels = np.ravel(labels).astype(bool)
+        order = np.argsort(lrs, kind='mergesort')
+        # ascending, ties keep their order
+        self.sorted_lrs = lrs[order]
+        self.sorted_labels = labels[order]
+        self.n_h1 = int(np.sum(labels))
+        self.n_h2 = len(labels) - self.n_h1
+        self._cache = {}
+
+    def _cached(self, key, compute):
+        if key not in self._cache:
+            self._cache[key] = compute()
+        return self._cache[key]
+
+    @property
+    def lrs_h1(self):
+        return self._cached('lrs_h1', lambda: self.sorted_lrs[self.sorted_labels])
+
+    @property
+    def lrs_h2(self):
+        return self._cached('lrs_h2', lambda: self.sorted_lrs[~self.sorted_labels])
+
+    def roc(self):
+        """
+        Returns the false and true positive rates at every distinct LR as threshold, from the highest LR down, as
+        sklearn.metrics.roc_curve without dropping intermediate points.
+
+        :return: fpr, tpr
+        """
+        def compute():
+            descending_lrs = self.sorted_lrs[::-1]
+            descending_labels = self.sorted_labels[::-1]
+            # the last sample of every run of equal LRs
+            thresholds = np.r_[np.flatnonzero(np.diff(descending_lrs)), len(descending_lrs) - 1]
+            tps = np.cumsum(descending_labels)[thresholds]
+            fps = thresholds + 1 - tps
+            return np.r_[0, fps] / max(self.n_h2, 1), np.r_[0, tps] / max(self.n_h1, 1)
+
+        return self._cached('roc', compute)
+
+    def auc(self):
+        fpr, tpr = self.roc()
+        # the trapezoidal rule, written out as np.trapz is removed in numpy 2
+        return float(np.sum(np.diff(fpr) * (tpr[1:] + tpr[:-1]) / 2))
+
+    def tippett(self):
+        """
+        Returns the Tippett curves: for h1 and h2 the log10 LRs from high to low and the fraction of the samples with
+        at least that log10 LR.
+
+        :return: (log10 LRs h1, fractions h1), (log10 LRs h2, fractions h2)
+        """
+        def compute():
+            curves = []
+            for lrs in (self.lrs_h1, self.lrs_h2):
+                curves.append((np.log10(lrs[::-1]), np.arange(1, len(lrs) + 1) / max(len(lrs), 1)))
+            return tuple(curves)
+
+        return self._cached('tippett', compute)
+
+    def false_positive_rate(self, lr=1):
+        """
+        Returns the fraction of h2 samples with an LR above lr, nan if there are no h2 samples.
+        """
+        if self.n_h2 == 0:
+            return np.nan
+        return (self.n_h2 - np.searchsorted(self.lrs_h2, lr, side='right')) / self.n_h2
+
+    def false_negative_rate(self, lr=1):
+        """
+        Returns the fraction of h1 samples with an LR below lr, nan if there are no h1 samples.
+        """
+        if self.n_h1 == 0:
+            return np.nan
+        return np.searchsorted(self.lrs_h1, lr, side='left') / self.n_h1
+
+    def pav_lrs(self, min_lr=10 ** -10, max_lr=10 ** 10):
+        """
+        Returns the LRs after PAV calibration on themselves, clipped to [min_lr, max_lr], in the sorted order (see
+        sorted_labels).
+        """
+        return np.clip(self._unclipped_pav_lrs(), min_lr, max_lr)
+
+    def _unclipped_pav_lrs(self):
+        return self._cached('pav', lambda: posteriors_to_lrs(pav_posteriors(self.sorted_lrs, self.sorted_labels)))
+
+    def ece(self, priors, pav=False):
+        """
+        Returns the empirical cross-entropy per prior probability of h1, of the LRs or of the PAV calibrated LRs.
+        """
+        if pav:
+            pav_lrs = self.pav_lrs()
+            return empirical_cross_entropy(pav_lrs[self.sorted_labels], pav_lrs[~self.sorted_labels], priors)
+        return empirical_cross_entropy(self.lrs_h1, self.lrs_h2, priors)
+
+    def cllr(self, pav=False):
+        if pav:
+            pav_lrs = self.pav_lrs()
+            return cllr(pav_lrs[self.sorted_labels], pav_lrs[~self.sorted_labels])
+        return cllr(self.lrs_h1, self.lrs_h2)
+
+    def cllr_min(self):
+        """
+        Returns the Cllr of the PAV calibrated LRs: the Cllr the LRs would have if they were perfectly calibrated. The
+        Cllr minus Cllr_min is the calibration loss Cllr_cal.
+        """
+        pav_lrs = self._unclipped_pav_lrs()
+        with np.errstate(divide='ignore'):
+            return cllr(pav_lrs[self.sorted_labels], pav_lrs[~self.sorted_labels])
+
+
+# hash of the LRs and labels -> LrMetrics, the most recently used last
+_metrics_cache = OrderedDict()
+MAX_CACHED_METRICS = 64
+
+
+def get_lr_metrics(lrs, labels):
+    """
+    Returns the LrMetrics of the LRs and labels, from the cache if they were computed before in this process.
+    """
+    lrs = np.ascontiguousarray(np.ravel(lrs), dtype=float)
+    labels = np.ascontiguousarray(np.ravel(labels), dtype=bool)
+    key = hashlib.sha1(lrs.tobytes() + labels.tobytes()).hexdigest()
+    if key in _metrics_cache:
+        _metrics_cache.move_to_end(key)
+    else:
+        _metrics_cache[key] = LrMetrics(lrs, labels)
+        if len(_metrics_cache) > MAX_CACHED_METRICS:
+            _metrics_cache.popitem(last=False)
+    return _metrics_cache[key]
@@ -0,0 +1,345 @@
+"""
+Saves and loads trained LR systems without pickle. A model is a directory with a json manifest (cell types, marker
+names, target classes, MAX_LR, the structure of the classifier and the calibrator parameters) and a .npy file per
+weight array, or the native model files of xgboost. The weight arrays are memory mapped when loading, and the
+classifiers are rebuilt as the numpy models below, so sklearn is not needed to score.
+
+A model is saved to a new directory that then replaces the old one, so a file that is memory mapped is never
+rewritten: a reader keeps the complete old model, or loads the complete new one.
+
+Only the classifiers of MarginalMLRClassifier, MarginalMLPClassifier and MarginalXGBClassifier can be saved this
+way; random forests and SVMs are still pickled.
+"""
+
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import tempfile
+
+import numpy as np
+
+from rna import constants
+
+FORMAT_VERSION = 1
+MANIFEST = 'manifest.json'
+
+
+def expit(x):
+    return 1 / (1 + np.exp(-x))
+
+
+def softmax(x):
+    x = np.exp(x - np.max(x, axis=1, keepdims=True))
+    return x / np.sum(x, axis=1, keepdims=True)
+
+
+class LogisticModel():
+    """
+    predict_proba of a fitted sklearn LogisticRegression.
+
+    :param coef: n_classes (1 if binary) x n_features array
+    :param intercept: array of length n_classes (1 if binary)
+    :param ovr: bool: whether the probabilities are one vs rest (sigmoid) rather than multinomial (softmax)
+    """
+
+    def __init__(self, coef, intercept, ovr):
+        self.coef_ = coef
+        self.intercept_ = intercept
+        self.ovr = ovr
+
+    def predict_proba(self, X):
+        decision = np.asarray(X) @ self.coef_.T + self.intercept_
+        if self.coef_.shape[0] == 1:
+            if not self.ovr:
+                # sklearn takes the softmax over (-decision, decision)
+                decision = 2 * decision
+            p = expit(decision)
+            return np.hstack([1 - p, p])
+        if self.ovr:
+            p = expit(decision)
+            return p / np.sum(p, axis=1, keepdims=True)
+        return softmax(decision)
+
+
+class MLPModel():
+    """
+    predict_proba of a fitted sklearn MLPClassifier.
+    """
+
+    ACTIVATIONS = {'identity': lambda x: x, 'tanh': np.tanh, 'logistic': expit, 'relu': lambda x: np.maximum(x, 0),
+                   'softmax': softmax}
+
+    def __init__(self, coefs, intercepts, activation, out_activation):
+        self.coefs_ = coefs
+        self.intercepts_ = intercepts
+        self.activation = activation
+        self.out_activation_ = out_activation
+
+    def predict_proba(self, X):
+        y_pred = np.asarray(X, dtype=float)
+        for i, (coef, intercept) in enumerate(zip(self.coefs_, self.intercepts_)):
+            y_pred = y_pred @ coef + intercept
+            if i < len(self.coefs_) - 1:
+                y_pred = self.ACTIVATIONS[self.activation](y_pred)
+        y_pred = self.ACTIVATIONS[self.out_activation_](y_pred)
+        if y_pred.shape[1] == 1:
+            y_pred = y_pred.ravel()
+            return np.vstack([1 - y_pred, y_pred]).T
+        return y_pred
+
+
+class ConstantModel():
+    """
+    predict_proba of the estimator sklearn's OneVsRestClassifier fits for a label that is always 0 or always 1.
+    """
+
+    def __init__(self, y):
+        self.y_ = y
+
+    def predict_proba(self, X):
+        return np.repeat([[1 - self.y_, self.y_]], len(X), axis=0)
+
+
+class OneVsRestModel():
+    """
+    predict_proba of a fitted sklearn OneVsRestClassifier.
+    """
+
+    def __init__(self, estimators, multilabel):
+        self.estimators_ = estimators
+        self.multilabel = multilabel
+
+    @property
+    def coef_(self):
+        return np.array([estimator.coef_.ravel() for estimator in self.estimators_])
+
+    @property
+    def intercept_(self):
+        return np.array([estimator.intercept_.ravel() for estimator in self.estimators_])
+
+    def predict_proba(self, X):
+        Y = np.array([estimator.predict_proba(X)[:, 1] for estimator in self.estimators_]).T
+        if len(self.estimators_) == 1:
+            Y = np.concatenate(((1 - Y), Y), axis=1)
+        if not self.multilabel:
+            Y /= np.sum(Y, axis=1)[:, np.newaxis]
+        return Y
+
+
+def classifier_to_spec(classifier, arrays, name):
+    """
+    Describes the classifier in a json serialisable dict, adding its weights to arrays.
+
+    :param classifier: fitted sklearn or xgboost classifier, or one of the models above
+    :param arrays: dict to add the weight arrays to, file name -> array (or xgboost model, saved in its own format)
+    :param name: prefix for the file names of the weights of this classifier
+    :return: dict
+    """
+    type_name = type(classifier).__name__
+    if type_name in ('OneVsRestClassifier', 'OneVsRestModel'):
+        multilabel = classifier.multilabel_ if type_name == 'OneVsRestClassifier' else classifier.multilabel
+        return {'type': 'one_vs_rest', 'multilabel': bool(multilabel),
+                'estimators': [classifier_to_spec(estimator, arrays, '{}_{}'.format(name, i))
+                               for i, estimator in enumerate(classifier.estimators_)]}
+    if type_name in ('_ConstantPredictor', 'ConstantModel'):
+        return {'type': 'constant', 'y': float(np.ravel(classifier.y_)[0])}
+    if type_name == 'LogisticRegression':
+        # see LogisticRegression.predict_proba
+        ovr = classifier.multi_class in ('ovr', 'warn') or (
+                classifier.multi_class == 'auto' and (classifier.classes_.size <= 2 or classifier.solver == 'liblinear'))
+        classifier = LogisticModel(classifier.coef_, classifier.intercept_, ovr)
+    if type(classifier) == LogisticModel:
+        arrays[name + '_coef.npy'] = classifier.coef_
+        arrays[name + '_intercept.npy'] = classifier.intercept_
+        return {'type': 'logistic', 'ovr': bool(classifier.ovr), 'coef': name + '_coef.npy',
+                'intercept': name + '_intercept.npy'}
+    if type_name in ('MLPClassifier', 'MLPModel'):
+        coefs = ['{}_coef_{}.npy'.format(name, i) for i in range(len(classifier.coefs_))]
+        intercepts = ['{}_intercept_{}.npy'.format(name, i) for i in range(len(classifier.intercepts_))]
+        arrays.update(zip(coefs, classifier.coefs_))
+        arrays.update(zip(intercepts, classifier.intercepts_))
+        return {'type': 'mlp', 'activation': classifier.activation, 'out_activation': classifier.out_activation_,
+                'coefs': coefs, 'intercepts': intercepts}
+    if type_name == 'XGBClassifier':
+        # native format of xgboost, written by save_model
+        arrays[name + '.json'] = classifier
+        return {'type': 'xgboost', 'model': name + '.json'}
+    raise ValueError('cannot save a {} without pickle'.format(type_name))
+
+
+def spec_to_classifier(spec, path, mmap_mode='r'):
+    """
+    Inverse of classifier_to_spec.
+
+    :param spec: dict made by classifier_to_spec
+    :param path: directory with the weight files
+    :param mmap_mode: passed on to np.load, None to read the weights into memory
+    """
+    def load(filename):
+        return np.load(os.path.join(path, filename), mmap_mode=mmap_mode, allow_pickle=False)
+
+    if spec['type'] == 'one_vs_rest':
+        return OneVsRestModel([spec_to_classifier(estimator, path, mmap_mode) for estimator in spec['estimators']],
+                              spec['multilabel'])
+    if spec['type'] == 'constant':
+        return ConstantModel(spec['y'])
+    if spec['type'] == 'logistic':
+        return LogisticModel(load(spec['coef']), load(spec['intercept']), spec['ovr'])
+    if spec['type'] == 'mlp':
+        return MLPModel([load(filename) for filename in spec['coefs']],
+                        [load(filename) for filename in spec['intercepts']],
+                        spec['activation'], spec['out_activation'])
+    if spec['type'] == 'xgboost':
+        from xgboost import XGBClassifier
+
+        classifier = XGBClassifier()
+        classifier.load_model(os.path.join(path, spec['model']))
+        return classifier
+    raise ValueError('unknown classifier type in model artefact: {}'.format(spec['type']))
+
+
+def save_model(model, path, celltypes, target_classes, features=None):
+    """
+    Saves a trained MarginalClassifier as a model artefact directory.
+
+    :param model: trained MarginalClassifier
+    :param path: directory to write to, is created if it does not exist
+    :param celltypes: list of the cell types, in the order of the label encoder
+    :param target_classes: n_target_classes x n_celltypes array of the target classes the model is calibrated on
+    :param features: None or list of the markers the model is trained on (the present markers)
+    """
+    arrays = {}
+    manifest = {
+        'format_version': FORMAT_VERSION,
+        'model_class': type(model).__name__,
+        'celltypes': [str(celltype) for celltype in celltypes],
+        'marker_names': list(constants.marker_names),
+        'features': None if features is None else list(features),
+        'target_classes': np.asarray(target_classes).astype(int).tolist(),
+        'MAX_LR': model.MAX_LR,
+        'method': getattr(model, 'method', None),
+        'classifier': classifier_to_spec(model._classifier, arrays, 'classifier'),
+        'label_powerset_codes': None,
+        'calibrator': None,
+        'calibrators_per_target_class': {},
+    }
+    label_powerset_codes = getattr(model, 'label_powerset_codes', None)
+    if label_powerset_codes is not None:
+        arrays['label_powerset_codes.npy'] = label_powerset_codes
+        manifest['label_powerset_codes'] = 'label_powerset_codes.npy'
+    if model._calibrator is not None:
+        manifest['calibrator'] = model._calibrator.__name__
+        for key, calibrator in model._calibrators_per_target_class.items():
+            # a WeightedLogitCalibrator, the two parameters are stored in the manifest itself
+            manifest['calibrators_per_target_class'][key] = {
+                'coef': float(calibrator._logit.coef_.ravel()[0]),
+                'intercept': float(calibrator._logit.intercept_.ravel()[0]),
+                'ovr': True}
+
+    # write next to path, so the new directory can be renamed into place
+    parent = os.path.dirname(os.path.abspath(path))
+    os.makedirs(parent, exist_ok=True)
+    tmp_path = tempfile.mkdtemp(dir=parent, prefix='.{}-'.format(os.path.basename(path)))
+    try:
+        os.chmod(tmp_path, 0o755)
+        for filename, array in arrays.items():
+            if filename.endswith('.json'):
+                array.save_model(os.path.join(tmp_path, filename))
+            else:
+                np.save(os.path.join(tmp_path, filename), np.asarray(array), allow_pickle=False)
+        with open(os.path.join(tmp_path, MANIFEST), 'w') as f:
+            json.dump(manifest, f, indent=1)
+        replace_directory(tmp_path, path)
+    except BaseException:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+
+
+def replace_directory(new_path, path):
+    """
+    Moves the directory new_path to path, replacing what was at path. The old files are removed rather than
+    overwritten, so processes that memory mapped them keep reading the old model. Between the two renames path does
+    not exist: readers should retry (see ScoringService.get_model).
+    """
+    if not os.path.lexists(path):
+        os.rename(new_path, path)
+        return
+    old_path = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(path)),
+                                prefix='.{}-old-'.format(os.path.basename(path)))
+    old_path = os.path.join(old_path, os.path.basename(path))
+    os.rename(path, old_path)
+    os.rename(new_path, path)
+    shutil.rmtree(os.path.dirname(old_path), ignore_errors=True)
+
+
+def read_manifest(path):
+    """
+    Reads the manifest of a model artefact and checks it can be used with this version of the code.
+    """
+    with open(os.path.join(path, MANIFEST)) as f:
+        manifest = json.load(f)
+    if manifest.get('format_version') != FORMAT_VERSION:
+        raise ValueError('model artefact {} has format version {}, expected {}'.format(
+            path, manifest.get('format_version'), FORMAT_VERSION))
+    if manifest['marker_names'] != constants.marker_names:
+        raise ValueError('the markers of model {} are inconsistent with constants.marker_names. The model is trained '
+                         'with {}'.format(path, manifest['marker_names']))
+    return manifest
+
+
+def load_model(path, mmap_mode='r'):
+    """
+    Loads a model saved by save_model. The weights are memory mapped unless mmap_mode is None.
+
+    :return: MarginalClassifier with the predict_lrs of the saved model
+    """
+    from rna import lr_system
+
+    manifest = read_manifest(path)
+    model_class = getattr(lr_system, manifest['model_class'])
+    # do not call __init__, which makes an unfitted sklearn classifier
+    model = model_class.__new__(model_class)
+    model.MAX_LR = manifest['MAX_LR']
+    if manifest['method'] is not None:
+        model.method = manifest['method']
+    model._classifier = spec_to_classifier(manifest['classifier'], path, mmap_mode)
+    model.label_powerset_codes = None
+    if manifest['label_powerset_codes'] is not None:
+        model.label_powerset_codes = np.load(os.path.join(path, manifest['label_powerset_codes']),
+                                             allow_pickle=False)
+
+    model._calibrator = None
+    model._calibrators_per_target_class = {}
+    if manifest['calibrator'] is not None:
+        model._calibrator = getattr(lr_system, manifest['calibrator'])
+        for key, parameters in manifest['calibrators_per_target_class'].items():
+            calibrator = model._calibrator()
+            calibrator._logit = LogisticModel(np.array([[parameters['coef']]]), np.array([parameters['intercept']]),
+                                              parameters['ovr'])
+            model._calibrators_per_target_class[key] = calibrator
+    return model
+
+
+def model_hash(path):
+    """
+    Returns the sha256 of a pickled model, or of all files of a model artefact directory.
+    """
+    sha = hashlib.sha256()
+    filenames = [os.path.join(path, filename) for filename in sorted(os.listdir(path))] \
+        if os.path.isdir(path) else [path]
+    for filename in filenames:
+        with open(filename, 'rb') as f:
+            sha.update(f.read())
+    return sha.hexdigest()
+
+
+def read_model(path):
+    """
+    Loads a model artefact directory, or a pickled model as saved by older versions.
+    """
+    if os.path.isdir(path):
+        return load_model(path)
+    with open(path, 'rb') as f:
+        return pickle.load(f)
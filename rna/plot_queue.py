@@ -0,0 +1,262 @@
+"""
+Renders independent figures in parallel. The plotting functions of rna.plotting draw on the global pyplot state, so
+each figure is rendered in a worker process with the Agg backend. Figures are added to a PlotQueue as jobs (a
+plotting function with its arguments) and rendered at once by PlotQueue.run, which reports every figure that failed
+rather than stopping at the first.
+
+With a manifest, the queue records per figure a hash of its inputs (the plotting function, the source of its module
+and of the modules of the same package it uses, such as rna.metrics for rna.plotting, the versions of the other
+packages it uses, and its arguments) and the image files it produced. Figures whose inputs are unchanged and whose files still exist are
+not rendered again.
+"""
+
+import functools
+import glob
+import hashlib
+import inspect
+import json
+import multiprocessing
+import os
+import pickle
+import sys
+import traceback
+
+import numpy as np
+
+
+class PlotError(RuntimeError):
+    """
+    Raised by PlotQueue.run when one or more figures failed.
+    """
+
+    def __init__(self, failures):
+        self.failures = failures
+        super().__init__('{} figures failed: {}'.format(len(failures), ', '.join(job.name for job, _ in failures)))
+
+
+def update_hash(h, obj):
+    """
+    Adds obj to the hash h. Arrays are hashed by their contents, containers by their items, and other objects by
+    their pickle.
+    """
+    if isinstance(obj, np.ndarray):
+        h.update('ndarray{}{}'.format(obj.dtype.str, obj.shape).encode())
+        h.update(np.ascontiguousarray(obj).tobytes())
+    elif isinstance(obj, dict):
+        h.update('dict{}'.format(len(obj)).encode())
+        for key, value in obj.items():
+            update_hash(h, key)
+            update_hash(h, value)
+    elif isinstance(obj, (list, tuple)):
+        h.update('{}{}'.format(type(obj).__name__, len(obj)).encode())
+        for item in obj:
+            update_hash(h, item)
+    elif obj is None or isinstance(obj, (str, bool, int, float, np.generic)):
+        h.update('{}{!r}'.format(type(obj).__name__, obj).encode())
+    else:
+        h.update(pickle.dumps(obj))
+
+
+def module_dependencies(module_name):
+    """
+    Returns the modules module_name depends on: the modules of its own package that it uses, directly or through
+    each other, and the top-level names of the other packages it uses. Found from the modules, classes and functions
+    in the namespaces of the modules.
+
+    :return: sorted list of the module names of its own package (including itself), sorted list of other packages
+    """
+    package = module_name.split('.')[0]
+    own, other = set(), set()
+    to_visit = [module_name]
+    while to_visit:
+        name = to_visit.pop()
+        if name in own or name not in sys.modules:
+            continue
+        own.add(name)
+        for key, value in vars(sys.modules[name]).items():
+            if key.startswith('__'):
+                continue
+            used = value.__name__ if inspect.ismodule(value) else getattr(value, '__module__', None)
+            if not isinstance(used, str):
+                continue
+            if used.split('.')[0] == package:
+                to_visit.append(used)
+            else:
+                other.add(used.split('.')[0])
+    return sorted(own), sorted(other)
+
+
+@functools.lru_cache(maxsize=None)
+def module_source_hash(module_name):
+    """
+    Returns the hash of the source files of the module and the modules of its package it depends on, and of the
+    versions of the other packages it uses, so figures are rendered again when the plotting code or the code that
+    computes what is plotted (eg rna.metrics, lir) changes.
+    """
+    h = hashlib.sha256()
+    own, other = module_dependencies(module_name)
+    for name in own:
+        h.update(name.encode())
+        try:
+            with open(inspect.getsourcefile(sys.modules[name]), 'rb') as f:
+                h.update(f.read())
+        except (TypeError, OSError):
+            pass
+    for name in other:
+        h.update('{}=={}'.format(name, getattr(sys.modules.get(name), '__version__', None)).encode())
+    return h.hexdigest()
+
+
+class PlotJob():
+    """
+    A figure to render: calls function(*args, **kwargs). function must be defined at module level, so it can be sent
+    to a worker process.
+
+    :param name: name to report the figure with, defaults to its savefig argument
+    """
+
+    def __init__(self, function, *args, name=None, **kwargs):
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.name = name or kwargs.get('savefig') or function.__name__
+
+    def inputs_hash(self):
+        """
+        Returns a hash of the plotting function, the code it depends on (see module_source_hash) and its arguments.
+        """
+        h = hashlib.sha256()
+        update_hash(h, [self.function.__module__, self.function.__qualname__,
+                        module_source_hash(self.function.__module__)])
+        update_hash(h, list(self.args))
+        update_hash(h, sorted(self.kwargs.items()))
+        return h.hexdigest()
+
+    def output_files(self, other_names=()):
+        """
+        Returns the image files of this figure: the files whose name starts with the name of the job (the plotting
+        functions add eg the target class and extension to savefig), except those of another figure whose name starts
+        with this name, such as 'lrs_Skin_and_Blood' for the figure 'lrs_Skin'.
+
+        :param other_names: names of the other figures
+        """
+        longer_names = [name for name in other_names if len(name) > len(self.name) and name.startswith(self.name)]
+        return sorted(filename for filename in glob.glob(glob.escape(self.name) + '*')
+                      if not any(filename.startswith(name) for name in longer_names))
+
+    def render(self):
+        """
+        Renders the figure and closes it. Returns None, or the traceback if it failed.
+        """
+        from matplotlib import pyplot as plt
+
+        try:
+            self.function(*self.args, **self.kwargs)
+            return None
+        except Exception:
+            return traceback.format_exc()
+        finally:
+            plt.close('all')
+
+
+def use_agg_backend():
+    import matplotlib
+    matplotlib.use('Agg', force=True)
+
+
+def _render(job):
+    return job, job.render()
+
+
+class PlotQueue():
+    """
+    Collects figures and renders them on a process pool.
+
+    :param n_jobs: number of processes, None for the number of cpus, 1 to render in this process
+    :param manifest_path: None, or path of a json file that records the inputs hash and the files of each figure,
+        to render only the figures of which the inputs changed
+    """
+
+    def __init__(self, n_jobs=None, manifest_path=None):
+        self.n_jobs = n_jobs
+        self.manifest_path = manifest_path
+        self.jobs = []
+
+    def add(self, function, *args, **kwargs):
+        """
+        Adds the figure function(*args, **kwargs), see PlotJob. Raises a ValueError if there already is a figure with
+        its name, as the files and manifest entry of one would replace those of the other.
+        """
+        job = PlotJob(function, *args, **kwargs)
+        if any(other.name == job.name for other in self.jobs):
+            raise ValueError('there already is a figure named {}'.format(job.name))
+        self.jobs.append(job)
+
+    def __len__(self):
+        return len(self.jobs)
+
+    def run(self, raise_on_failure=True):
+        """
+        Renders all figures added and empties the queue. Every failure is printed with its traceback.
+
+        :param raise_on_failure: bool: whether to raise a PlotError after all figures are rendered if any failed
+        :return: list of (PlotJob, traceback) of the figures that failed
+        """
+        jobs, self.jobs = self.jobs, []
+        manifest = self.read_manifest()
+        names = [job.name for job in jobs]
+        hashes = {job.name: job.inputs_hash() for job in jobs} if self.manifest_path else {}
+        if self.manifest_path:
+            jobs = [job for job in jobs if not self.is_up_to_date(job, hashes[job.name], manifest)]
+            print('rendering {} figures, {} up to date'.format(len(jobs), len(hashes) - len(jobs)))
+
+        if self.n_jobs == 1 or len(jobs) <= 1:
+            use_agg_backend()
+            results = map(_render, jobs)
+            failures = self._collect(results)
+        else:
+            with multiprocessing.Pool(self.n_jobs, initializer=use_agg_backend) as pool:
+                failures = self._collect(pool.imap_unordered(_render, jobs))
+
+        if self.manifest_path:
+            failed = set(job.name for job, _ in failures)
+            for job in jobs:
+                if job.name in failed:
+                    manifest.pop(job.name, None)
+                else:
+                    manifest[job.name] = {'function': job.function.__name__, 'inputs_hash': hashes[job.name],
+                                          'files': job.output_files(names)}
+            self.write_manifest(manifest)
+
+        if failures and raise_on_failure:
+            raise PlotError(failures)
+        return failures
+
+    @staticmethod
+    def is_up_to_date(job, inputs_hash, manifest):
+        entry = manifest.get(job.name)
+        return entry is not None and entry['inputs_hash'] == inputs_hash and len(entry['files']) > 0 and \
+            all(os.path.exists(filename) for filename in entry['files'])
+
+    def read_manifest(self):
+        """
+        Returns the manifest: figure name -> dict with the function, inputs hash and files of the figure.
+        """
+        if self.manifest_path is None or not os.path.exists(self.manifest_path):
+            return {}
+        with open(self.manifest_path) as f:
+            return json.load(f)['figures']
+
+    def write_manifest(self, manifest):
+        os.makedirs(os.path.dirname(self.manifest_path) or '.', exist_ok=True)
+        with open(self.manifest_path, 'w') as f:
+            json.dump({'figures': manifest}, f, indent=1, sort_keys=True)
+
+    @staticmethod
+    def _collect(results):
+        failures = []
+        for job, error in results:
+            if error is not None:
+                print('figure {} failed:\n{}'.format(job.name, error))
+                failures.append((job, error))
+        return failures
@@ -15,16 +15,16 @@ from lir import Xn_to_Xy, plot, plot_score_distribution_and_calibrator_fit, Xy_t
 
 from matplotlib import rc, pyplot as plt, patches as mpatches
 from collections import OrderedDict
-from sklearn.metrics import roc_curve, auc
 from itertools import cycle
 from scipy.interpolate import interp1d
 import seaborn as sns
 
 from rna import constants
 from rna.constants import celltype_specific_markers, DEBUG, COLWIDTH
+from rna.metrics import get_lr_metrics, empirical_cross_entropy, cllr, PavCalibrator
 from rna.utils import vec2string, prior2string, bool2str_binarize, bool2str_softmax
 
-from lir.calibration import IsotonicCalibrator, LogitCalibrator
+from lir.calibration import LogitCalibrator
 
 rc('text', usetex=False)
 
@@ -296,19 +296,16 @@ def plot_property_lrs_all_folds(lrs, y_nhot, target_classes, label_encoder,
             fig.legend(handles, labels, 'lower right')
 
         elif n_rows > 1:
+            metrics = get_lr_metrics(lrs[:, t], np.max(np.multiply(y_nhot, target_class), axis=1))
             if kind == 'histogram':
                 # plotting Tippett here
                 # axs[j, k].hist(loglrs1, color='orange', histtype='step', cumulative=-1, density=density, bins=n_bins, label="h1")
                 # axs[j, k].hist(loglrs2, color='blue', histtype='step', cumulative=-1, density=density, bins=n_bins, label="h2")
                 axs[j, k].axvline(0, color='k', linestyle='--')
 
-                n = np.arange(1, len(loglrs2) + 1) / np.float(len(loglrs2))
-                Xs = np.sort(loglrs2.squeeze())[::-1]
-                axs[j, k].step(Xs, n, color='blue', label='H2', alpha=.5)
-
-                n = np.arange(1, len(loglrs1) + 1) / np.float(len(loglrs1))
-                Xs = np.sort(loglrs1.squeeze())[::-1]
-                axs[j, k].step(Xs, n, color='orange', label='H1', alpha=.5)
+                (Xs_h1, n_h1), (Xs_h2, n_h2) = metrics.tippett()
+                axs[j, k].step(Xs_h2, n_h2, color='blue', label='H2', alpha=.5)
+                axs[j, k].step(Xs_h1, n_h1, color='orange', label='H1', alpha=.5)
 
                 x_label="10log(LR)"
                 if density:
@@ -320,7 +317,7 @@ def plot_property_lrs_all_folds(lrs, y_nhot, target_classes, label_encoder,
                 fig.legend(handles, labels, 'center right')
 
             elif kind=='roc':
-                auc=plot_roc(*Xn_to_Xy(loglrs2, loglrs1), axs[j,k])
+                auc=plot_roc(metrics, axs[j,k])
                 x_label = 'False positive rate'
                 y_label = 'True positive rate'
             else:
@@ -329,7 +326,7 @@ def plot_property_lrs_all_folds(lrs, y_nhot, target_classes, label_encoder,
                 'semen fertile and/or semen sterile', 'semen\n(sterile and/or fertile)').replace(
                 'vaginal mucosa', 'VM')
             if kind=='roc' and auc:
-                title += f'\nAUC={auc:.2f}, FP={np.mean(loglrs2 > 0):.2f}, FN={np.mean(loglrs1 < 0):.2f}'
+                title += f'\nAUC={auc:.2f}, FP={metrics.false_positive_rate():.2f}, FN={metrics.false_negative_rate():.2f}'
             axs[j, k].set_title(title, fontdict={'fontsize': 12})
 
             if (t % 2) == 0:
@@ -665,7 +662,7 @@ def plot_pav(loglr, labels, title, ax, show_scatter=True):
     ax=ax
 
     try:
-        pav = IsotonicCalibrator()
+        pav = PavCalibrator()
         pav_loglrs = pav.fit_transform(loglr, labels)
         xrange = [-10, 10]
 
@@ -713,78 +710,21 @@ def plot_insights_cllr(lrs_after, y_nhot, target_classes, label_encoder, savefig
 def plot_insight_cllr(lrs, labels, savefig=None, show=None):
     def plot_ece(lrs, labels, ax):
 
-        def pav_transform_lrs(lrs, labels):
-            ir = IsotonicCalibrator()
-            ir.fit(lrs, labels)
-            lrs_after_calibration = ir.transform(lrs)
-
-            lrs_after_calibration = np.where(lrs_after_calibration > 10 ** 10, 10 ** 10, lrs_after_calibration)
-            lrs_after_calibration = np.where(lrs_after_calibration < 10 ** -10, 10 ** -10, lrs_after_calibration)
-
-            lrs_after_calibration_p = lrs_after_calibration[np.argwhere(labels == 1)]
-            lrs_after_calibration_d = lrs_after_calibration[np.argwhere(labels == 0)]
-
-            return lrs_after_calibration_p, lrs_after_calibration_d
-
-        def emperical_cross_entropy(lr_p, lr_d, prior):
-            """
-
-            :param lr_p: LRs with ground truth label prosecution
-            :param prior_p: int; fixed value for prior prosecution
-            :param lr_d: LRs with groudn trut label defence
-            :param prior_d: int; fixed value for prior defence
-            :return:
-            """
-
-            N_p = len(lr_p)
-            N_d = len(lr_d)
-
-            prior_p = prior
-            prior_d = 1 - prior
-            odds = prior_p / prior_d
-
-            return (prior_p / N_p) * np.sum(np.log2(1 + (1 / (lr_p * odds)))) + \
-                   (prior_d / N_d) * np.sum(np.log2(1 + (lr_d * odds))), odds
-
-        def calculate_cllr(lr_p, lr_d):
-            N_p = len(lr_p)
-            N_d = len(lr_d)
-
-            sum_p = np.sum(np.log2((1 + (1 / lr_p))))
-            sum_d = np.sum(np.log2(1 + lr_d))
-
-            return 0.5 * (((1 / N_p) * sum_p) + ((1 / N_d) * sum_d))
-
         ax = ax
 
-        priors = np.linspace(0.001, 1 - 0.001, 50).tolist()
-
-        lrs_p = lrs[np.argwhere(labels == 1)]
-        lrs_d = lrs[np.argwhere(labels == 0)]
+        priors = np.linspace(0.001, 1 - 0.001, 50)
+        odds = priors / (1 - priors)
+        metrics = get_lr_metrics(lrs, labels)
 
         # LR = 1
-        results_LR_1 = np.array(
-            [emperical_cross_entropy(np.ones_like(lrs_p), np.ones_like(lrs_d), prior) for prior in priors])
-        ece_LR_1 = results_LR_1[:, 0]
-        odds = results_LR_1[:, 1]
-
-        # True LR
-        results = np.array([emperical_cross_entropy(lrs_p, lrs_d, prior) for prior in priors])
-        ece = results[:, 0]
-
-        # LR after calibration
-        lrs_after_calibration_p, lrs_after_calibration_d = pav_transform_lrs(lrs, labels)
-        results_after_calib = np.array([emperical_cross_entropy(lrs_after_calibration_p, lrs_after_calibration_d, prior)
-                                        for prior in priors])
-        ece_after_calib = results_after_calib[:, 0]
+        ece_LR_1 = empirical_cross_entropy(np.ones(metrics.n_h1), np.ones(metrics.n_h2), priors)
 
         ax.plot(np.log10(odds), ece_LR_1, color='black', linestyle='--', label='LR=1 always (Cllr = {0:.1f})'.format(
-            calculate_cllr(np.ones_like(lrs_p), np.ones_like(lrs_d))))
-        ax.plot(np.log10(odds), ece, color='red',
-                label='LR values (Cllr = {0:.3f})'.format(calculate_cllr(lrs_p, lrs_d)))
-        ax.plot(np.log10(odds), ece_after_calib, color='darkgray', linestyle='-',
-                label='LR after PAV (Cllr = {0:.3f})'.format(
-                    calculate_cllr(lrs_after_calibration_p, lrs_after_calibration_d)))
+            cllr(np.ones(metrics.n_h1), np.ones(metrics.n_h2))))
+        ax.plot(np.log10(odds), metrics.ece(priors), color='red',
+                label='LR values (Cllr = {0:.3f})'.format(metrics.cllr()))
+        ax.plot(np.log10(odds), metrics.ece(priors, pav=True), color='darkgray', linestyle='-',
+                label='LR after PAV (Cllr = {0:.3f})'.format(metrics.cllr(pav=True)))
 
         ax.set_ylabel("Emperical Cross-Entropy")
         ax.set_xlabel("Prior 10logOdds")
@@ -920,10 +860,15 @@ def derivative_of_roc_is_lr(lrs_all_methods, y_nhot_all_methods, fpr, tpr, t, ta
     fig.show()
 
 
-def plot_roc(lrs, y_true, ax):
+def plot_roc(metrics, ax):
+    """
+    Plots the ROC curve of the LRs.
 
-    fpr, tpr, _ = roc_curve(y_true, lrs)
-    roc_auc = auc(fpr, tpr)
+    :param metrics: LrMetrics of the LRs, see get_lr_metrics
+    :return: the AUC
+    """
+    fpr, tpr = metrics.roc()
+    roc_auc = metrics.auc()
 
     lw=1.5
     ax.plot(fpr, tpr, color='k', lw=lw, linestyle='-',
@@ -1014,19 +959,27 @@ def plot_coefficient_importance(intercept, coefficients, present_markers, cellty
 
 def plot_lrs_with_bootstrap_ci(lrs_after_calib, all_lrs_after_calib_bs, target_classes, label_encoder, show=None,
                                savefig=None):
+    """
+    :param all_lrs_after_calib_bs: N x n_target_classes x n_bootstraps array of LRs, or the LrPercentileAccumulator
+        returned by bootstrap.bootstrap_lrs
+    """
 
-    def confidence_interval(all_lrs_after_calib_bs_tc, alpha):
+    def confidence_interval(all_lrs_after_calib_bs, alpha):
+        if hasattr(all_lrs_after_calib_bs, 'percentile'):
+            return all_lrs_after_calib_bs.percentile((alpha/2)*100), \
+                   all_lrs_after_calib_bs.percentile((1 - (alpha/2))*100)
 
-        lower_bounds = np.percentile(all_lrs_after_calib_bs_tc, (alpha/2)*100, axis=1)
-        upper_bounds = np.percentile(all_lrs_after_calib_bs_tc, (1 - (alpha/2))*100, axis=1)
+        lower_bounds = np.percentile(all_lrs_after_calib_bs, (alpha/2)*100, axis=2)
+        upper_bounds = np.percentile(all_lrs_after_calib_bs, (1 - (alpha/2))*100, axis=2)
 
         return lower_bounds, upper_bounds
 
+    lower_bounds_all, upper_bounds_all = confidence_interval(all_lrs_after_calib_bs, alpha=0.05)
     lower_bounds_tc = dict()
     upper_bounds_tc = dict()
     for t, target_class in enumerate(target_classes):
         target_class_str = vec2string(target_class, label_encoder)
-        lower_bounds, upper_bounds = confidence_interval(all_lrs_after_calib_bs[:, t, :], alpha=0.05)
+        lower_bounds, upper_bounds = lower_bounds_all[:, t], upper_bounds_all[:, t]
         lower_bounds_tc[target_class_str] = lower_bounds
         upper_bounds_tc[target_class_str] = upper_bounds
 
@@ -0,0 +1,94 @@
+"""
+Profiling hooks for the scenarios in run.py. A function is run under cProfile, writing a .prof file that can be read
+with pstats or snakeviz, or under a simple sampling profiler, writing its stacks in the collapsed format of
+flamegraph.pl (one line per stack, 'outer;inner;innermost count'), which speedscope also reads.
+"""
+
+import cProfile
+import os
+import pstats
+import sys
+import threading
+from collections import Counter
+
+
+def frame_name(frame):
+    code = frame.f_code
+    return '{}:{}:{}'.format(os.path.basename(code.co_filename), code.co_name, code.co_firstlineno)
+
+
+class SamplingProfiler():
+    """
+    Samples the stack of a thread at a fixed interval on a background thread. The overhead does not depend on the
+    number of function calls, unlike cProfile, so the relative times of numpy heavy and python heavy code are kept.
+
+    :param interval: seconds between samples
+    :param thread_id: ident of the thread to sample, defaults to the thread that calls start
+    """
+
+    def __init__(self, interval=0.005, thread_id=None):
+        self.interval = interval
+        self.thread_id = thread_id
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self.thread_id is None:
+            self.thread_id = threading.get_ident()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(frame_name(frame))
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def write_collapsed(self, path):
+        """
+        Writes the sampled stacks in the collapsed format, most frequent first.
+        """
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write('{} {}\n'.format(stack, count))
+
+
+def profile_call(func, profiler, path, *args, **kwargs):
+    """
+    Calls func(*args, **kwargs) under a profiler and writes the profile.
+
+    :param profiler: 'cprofile' to write path + '.prof', or 'sample' to write the collapsed stacks to
+        path + '.collapsed'
+    :param path: path of the profile, without extension
+    :return: the return value of func
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    if profiler == 'cprofile':
+        profile = cProfile.Profile()
+        try:
+            return profile.runcall(func, *args, **kwargs)
+        finally:
+            profile.dump_stats(path + '.prof')
+            pstats.Stats(profile).sort_stats('cumulative').print_stats(20)
+            print('wrote {}.prof'.format(path))
+    elif profiler == 'sample':
+        sampler = SamplingProfiler()
+        sampler.start()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            sampler.stop()
+            sampler.write_collapsed(path + '.collapsed')
+            print('wrote {}.collapsed ({} samples)'.format(path, sum(sampler.stacks.values())))
+    else:
+        raise ValueError('unknown profiler {}, choose cprofile or sample'.format(profiler))
@@ -0,0 +1,300 @@
+"""
+Local scoring service that keeps trained models in memory, so that clients (the batch scoring CLI, the GUI) do not
+have to load the model and import the whole sklearn/xgboost/lir stack for every case. Models are reloaded when
+their file changes. Requests that arrive at about the same time are scored together in one call to predict_lrs.
+
+Start with:
+    python -m rna.scoring_service --port 8765
+
+and score with RemoteModel('http://127.0.0.1:8765', 'vagmenstr_no_penile').predict_lrs(X, target_classes), or
+    python -m rna.batch_scoring vagmenstr_no_penile 'cases/*.xlsx' --service http://127.0.0.1:8765
+"""
+
+import argparse
+import json
+import os
+import queue
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from rna import instrumentation, model_io
+
+# times to try to load a model that is being saved, with the seconds in between
+RELOAD_ATTEMPTS = 20
+RELOAD_RETRY_DELAY = 0.05
+
+# the models made by get_final_trained_mlr_model in run.py
+DEFAULT_MODELS = {
+    'vagmenstr_no_penile': os.path.join('final_model', 'no_penile', 'vagmenstr_no_penile'),
+    'vagmenstr_with_penile': os.path.join('final_model', 'with_penile', 'vagmenstr_with_penile'),
+}
+
+
+def model_file_stat(path):
+    """
+    Returns the inodes, modification times and sizes of the model file, or of the files of a model artefact
+    directory.
+    """
+    filenames = [os.path.join(path, filename) for filename in sorted(os.listdir(path))] \
+        if os.path.isdir(path) else [path]
+    stats = [os.stat(filename) for filename in filenames]
+    return tuple((stat.st_ino, stat.st_mtime_ns, stat.st_size) for stat in stats)
+
+
+class ScoringRequest():
+
+    def __init__(self, model_name, X, target_classes, priors_numerator, priors_denominator):
+        self.model_name = model_name
+        self.X = X
+        self.target_classes = target_classes
+        self.priors_numerator = priors_numerator
+        self.priors_denominator = priors_denominator
+        self.done = threading.Event()
+        self.lrs = None
+        self.model_hash = None
+        self.error = None
+
+    def batch_key(self):
+        """
+        Requests with the same key can be scored in one call to predict_lrs.
+        """
+        return (self.model_name, self.target_classes.tobytes(), self.target_classes.shape,
+                None if self.priors_numerator is None else tuple(self.priors_numerator),
+                None if self.priors_denominator is None else tuple(self.priors_denominator))
+
+
+class ScoringService():
+    """
+    Keeps the models in memory, keyed by name and the hash of the model file, and scores requests in micro-batches on
+    a worker thread.
+
+    :param models: dict: model name -> path to the model artefact directory or pickled model, see model_io
+    :param batch_window: seconds to wait for more requests to score together
+    :param max_batch_size: maximum number of samples to score at once
+    """
+
+    def __init__(self, models, batch_window=0.005, max_batch_size=10000):
+        self.models = dict(models)
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+        # model name -> (file stat, hash, model)
+        self._cache = {}
+        self._cache_lock = threading.Lock()
+        self._requests = queue.Queue()
+        self._worker = threading.Thread(target=self._score_batches, daemon=True)
+        self._worker.start()
+
+    def get_model(self, model_name):
+        """
+        Returns the model and the hash of its file, (re)loading it if it is not in the cache or its file has changed.
+        """
+        if model_name not in self.models:
+            raise KeyError('unknown model: {}, choose from {}'.format(model_name, sorted(self.models)))
+        path = self.models[model_name]
+        with self._cache_lock:
+            cached = self._cache.get(model_name)
+            for attempt in range(RELOAD_ATTEMPTS):
+                try:
+                    cached = self._reload(model_name, path, cached)
+                    break
+                except (OSError, ValueError):
+                    # the model is being saved (see model_io.replace_directory): keep the loaded model, or wait for
+                    # the new one if there is none
+                    if cached is not None:
+                        break
+                    if attempt == RELOAD_ATTEMPTS - 1:
+                        raise
+                    time.sleep(RELOAD_RETRY_DELAY)
+            self._cache[model_name] = cached
+        return cached[2], cached[1]
+
+    @staticmethod
+    def _reload(model_name, path, cached):
+        """
+        Returns (file stat, hash, model) of the model at path, reusing cached if the model did not change. Raises
+        OSError if the model changed while it was loaded.
+        """
+        file_stat = model_file_stat(path)
+        if cached is not None and cached[0] == file_stat:
+            return cached
+        model_hash = model_io.model_hash(path)
+        if cached is not None and cached[1] == model_hash:
+            return file_stat, model_hash, cached[2]
+        with instrumentation.span('load_model', model=model_name, model_hash=model_hash[:12]):
+            model = model_io.read_model(path)
+        if model_file_stat(path) != file_stat:
+            raise OSError('model {} changed while loading'.format(path))
+        return file_stat, model_hash, model
+
+    def score(self, model_name, X, target_classes, priors_numerator=None, priors_denominator=None):
+        """
+        Calculates the LRs like MarginalClassifier.predict_lrs, together with other requests that arrive at the same
+        time.
+
+        :return: N x n_target_classes array of LRs, the hash of the model file used
+        """
+        request = ScoringRequest(model_name, np.asarray(X, dtype=float), np.asarray(target_classes),
+                                 priors_numerator, priors_denominator)
+        self._requests.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.lrs, request.model_hash
+
+    def _score_batches(self):
+        while True:
+            requests = [self._requests.get()]
+            n_samples = len(requests[0].X)
+            deadline = time.monotonic() + self.batch_window
+            while n_samples < self.max_batch_size:
+                try:
+                    request = self._requests.get(timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                requests.append(request)
+                n_samples += len(request.X)
+
+            batches = {}
+            for request in requests:
+                batches.setdefault(request.batch_key(), []).append(request)
+            for batch in batches.values():
+                self._score_batch(batch)
+
+    def _score_batch(self, batch):
+        first = batch[0]
+        try:
+            model, model_hash = self.get_model(first.model_name)
+            X = np.concatenate([request.X for request in batch], axis=0)
+            lrs = model.predict_lrs(X, first.target_classes, priors_numerator=first.priors_numerator,
+                                    priors_denominator=first.priors_denominator)
+            begin = 0
+            for request in batch:
+                end = begin + len(request.X)
+                request.lrs = lrs[begin:end]
+                request.model_hash = model_hash
+                begin = end
+        except Exception as e:
+            for request in batch:
+                request.error = e
+        for request in batch:
+            request.done.set()
+
+
+def make_request_handler(service):
+    """
+    Returns the HTTP request handler for the service. POST /score takes and returns json, GET /models lists the
+    models.
+    """
+
+    class ScoringRequestHandler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            if self.path != '/models':
+                self.send_json(404, {'error': 'unknown path {}'.format(self.path)})
+                return
+            self.send_json(200, {'models': service.models})
+
+        def do_POST(self):
+            if self.path != '/score':
+                self.send_json(404, {'error': 'unknown path {}'.format(self.path)})
+                return
+            try:
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                lrs, model_hash = service.score(body['model'], body['X'], body['target_classes'],
+                                                body.get('priors_numerator'), body.get('priors_denominator'))
+            except KeyError as e:
+                self.send_json(400, {'error': str(e)})
+                return
+            except Exception as e:
+                self.send_json(500, {'error': repr(e)})
+                return
+            self.send_json(200, {'lrs': lrs.tolist(), 'model_hash': model_hash})
+
+        def send_json(self, status, content):
+            data = json.dumps(content).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            # do not print a line per request
+            pass
+
+    return ScoringRequestHandler
+
+
+def make_server(service, port=8765):
+    """
+    Returns an HTTP server for the service, only reachable from this machine. Use port 0 to pick a free port.
+    """
+    return ThreadingHTTPServer(('127.0.0.1', port), make_request_handler(service))
+
+
+class RemoteModel():
+    """
+    Client for the scoring service, with the predict_lrs interface of MarginalClassifier so it can be used in place of
+    a loaded model (eg in batch_scoring.score_cases).
+
+    :param url: url of the service, eg http://127.0.0.1:8765
+    :param model_name: name of the model in the service
+    """
+
+    def __init__(self, url, model_name, timeout=60):
+        self.url = url.rstrip('/')
+        self.model_name = model_name
+        self.timeout = timeout
+        self.model_hash = None
+
+    def predict_lrs(self, X, target_classes, priors_numerator=None, priors_denominator=None):
+        content = {'model': self.model_name, 'X': np.asarray(X, dtype=float).tolist(),
+                   'target_classes': np.asarray(target_classes).tolist(),
+                   'priors_numerator': None if priors_numerator is None else list(priors_numerator),
+                   'priors_denominator': None if priors_denominator is None else list(priors_denominator)}
+        request = urllib.request.Request(self.url + '/score', data=json.dumps(content).encode(),
+                                         headers={'Content-Type': 'application/json'})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                result = json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            raise RuntimeError('scoring service: {}'.format(json.loads(e.read()).get('error')))
+        self.model_hash = result['model_hash']
+        return np.array(result['lrs'])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Keep trained models in memory and calculate LRs on request.')
+    parser.add_argument('--port', type=int, default=8765, help='port on localhost to listen on')
+    parser.add_argument('--model', action='append', default=[],
+                        help='name=path of a model (artefact directory or pickle), may be given more than once. '
+                             'Defaults to the final models in final_model/')
+    parser.add_argument('--batch-window', type=float, default=0.005,
+                        help='seconds to wait for more requests to score together')
+    args = parser.parse_args(argv)
+
+    models = dict(model.split('=', 1) for model in args.model) if args.model else DEFAULT_MODELS
+    service = ScoringService(models, batch_window=args.batch_window)
+    for model_name in models:
+        # load the models now, rather than on the first request
+        try:
+            service.get_model(model_name)
+        except (OSError, ValueError, KeyError) as e:
+            # eg a missing file, or a corrupt manifest of the model
+            print('cannot load model {}: {}'.format(model_name, e))
+
+    server = make_server(service, args.port)
+    print('scoring service listening on http://127.0.0.1:{}'.format(server.server_address[1]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
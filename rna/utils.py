@@ -47,6 +47,42 @@ def vec2string(target_class, label_encoder):
     return celltype
 
 
+def nhot2codes(y_nhot):
+    """
+    Converts an nhot encoded matrix into one integer per row, in which bit i is set if cell type i is present. This is
+    the label of the combination of cell types in the label powerset (see MultiLabelEncoder).
+
+    :param y_nhot: N x n_celltypes matrix of 0s and 1s
+    :return: array of length N with ints
+    """
+    y_nhot = np.asarray(y_nhot)
+    return y_nhot.astype(np.int64) @ (1 << np.arange(y_nhot.shape[1], dtype=np.int64))
+
+
+def codes2nhot(codes, n_celltypes):
+    """
+    Converts integer codes of combinations of cell types into an nhot encoded matrix, the inverse of nhot2codes.
+
+    :param codes: iterable of length N with ints
+    :param n_celltypes: int: number of single cell types
+    :return: N x n_celltypes matrix of 0s and 1s
+    """
+    codes = np.asarray(codes, dtype=np.int64).reshape(-1, 1)
+    return (codes >> np.arange(n_celltypes, dtype=np.int64)) & 1
+
+
+def project_on_target_classes(y_nhot, target_classes):
+    """
+    Projects nhot encoded labels on the target classes: a sample belongs to a target class if it contains at least one
+    of the cell types of the target class.
+
+    :param y_nhot: N x n_celltypes matrix of 0s and 1s
+    :param target_classes: n_target_classes x n_celltypes containing the n hot encoded classes of interest
+    :return: N x n_target_classes matrix of 0s and 1s
+    """
+    return (np.asarray(y_nhot) @ np.asarray(target_classes).T > 0).astype(int)
+
+
 def remove_markers(X):
     """
     Removes the gender and control markers.
@@ -97,13 +133,19 @@ def prior2string(prior, label_encoder):
     :return: str
     """
 
-    # convert string into list of integers
+    # convert string into list of numbers
     prior = prior.strip('][').split(', ')
-    prior = [int(prior[i]) for i in range(len(prior))]
+    prior = [float(prior[i]) for i in range(len(prior))]
 
     if len(np.unique(prior)) == 1:
         return 'Uniform'
 
+    elif len(np.unique(prior)) > 2:
+        odds = prior2odds(prior)
+        indices = np.argwhere(odds != 1).flatten()
+        names = label_encoder.inverse_transform(indices)
+        return ', '.join('{} {:g}x'.format(name.replace('.', ' '), odds[i]) for name, i in zip(names, indices))
+
     else:
         counts = {prior.count(value): value for value in list(set(prior))}
         value_relevant_prior = counts[1]
@@ -123,10 +165,27 @@ def prior2string(prior, label_encoder):
         return '{} {} likely'.format(name, difference).replace('.',' ')
 
 
+def prior2odds(prior):
+    """
+    Converts a prior vector into the odds of occurrence per cell type. The prior values are relative to the most common
+    value in the vector, so [10, 1, 1, 1, 1, 1, 1, 1] means that samples with the first cell type occur 10 times more
+    often than samples without it, and [1, 10, 10, 10, 10, 10, 10, 10] that they occur 10 times less often. For ties
+    the smallest of the most common values is used.
+
+    :param prior: list of length n_celltypes representing the distribution of the augmented samples
+    :return: array of length n_celltypes with the odds of occurrence for each cell type
+    """
+    prior = np.array(prior, dtype=float)
+    values, counts = np.unique(prior, return_counts=True)
+    reference_value = values[np.argmax(counts)]
+    return prior / reference_value
+
+
 class AugmentedData():
 
     def __init__(self, X_train_augmented, y_train_nhot_augmented, X_calib_augmented, y_calib_nhot_augmented,
-           X_test_augmented, y_test_nhot_augmented, X_test_as_mixtures_augmented, y_test_as_mixtures_nhot_augmented):
+           X_test_augmented, y_test_nhot_augmented, X_test_as_mixtures_augmented, y_test_as_mixtures_nhot_augmented,
+                 sample_weight_train=None, sample_weight_calib=None):
         self.X_train_augmented = X_train_augmented
         self.y_train_nhot_augmented = y_train_nhot_augmented
         self.X_calib_augmented = X_calib_augmented
@@ -135,6 +194,26 @@ class AugmentedData():
         self.y_test_nhot_augmented = y_test_nhot_augmented
         self.X_test_as_mixtures_augmented = X_test_as_mixtures_augmented
         self.y_test_as_mixtures_nhot_augmented = y_test_as_mixtures_nhot_augmented
+        # per-sample weights expressing the prior, None if the prior is expressed through the number of samples
+        self.sample_weight_train = sample_weight_train
+        self.sample_weight_calib = sample_weight_calib
+        self._target_labels = {}
+
+    def target_labels(self, dataset, target_classes):
+        """
+        Returns the labels of an augmented data set projected on the target classes (see project_on_target_classes).
+        These are computed once per data set and target classes and then reused.
+
+        :param dataset: str: 'train', 'calib', 'test' or 'test_as_mixtures'
+        :param target_classes: n_target_classes x n_celltypes containing the n hot encoded classes of interest
+        :return: N x n_target_classes matrix of 0s and 1s
+        """
+        target_classes = np.asarray(target_classes)
+        key = (dataset, target_classes.shape, target_classes.tobytes())
+        if key not in self._target_labels:
+            y_nhot = getattr(self, 'y_{}_nhot_augmented'.format(dataset))
+            self._target_labels[key] = project_on_target_classes(y_nhot, target_classes)
+        return self._target_labels[key]
 
 
 class LrsBeforeAfterCalib():
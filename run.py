@@ -1,11 +1,14 @@
+import argparse
 import random
 import shutil
 import warnings
 import os
 
+from collections import OrderedDict
+
 import numpy as np
 
-from rna import constants
+from rna import constants, instrumentation, profiling
 from rna.analysis import makeplots, get_final_trained_mlr_model, nfold_analysis
 from rna.plotting import plot_sankey_data, calibration_example
 
@@ -35,8 +38,19 @@ Options:
     priors                      List of length 2 with vectors of length number of single cell types representing the prior distribution
                                 of the augmented samples. [1, 1, 1, 1, 1, 1, 1, 1] are uniform priors. [10, 1, 1, 1, 1, 1, 1, 1] means
                                 that samples with cell type at index 0 occurs 10 times more often than samples without that cell type.
-                                Note that the first vector in the sample is considered the after_adjusting_dl distribution. So the augmented test
-                                samples with that distribution will be the test data.
+                                Note that the first vector in the sample is considered the after_adjusting_dl distribution: the metrics are
+                                computed on its augmented test samples. Test samples are always augmented with uniform priors, also with
+                                'reweight_priors'.
+    reweight_priors             If provided, augment the data once with uniform priors and express each of the priors as
+                                weights on the augmented train and calibration samples. This also allows priors with more
+                                than two unique values. Not supported for 'MLP', which cannot be fitted with sample weights.
+    combination_distribution    If None, augment samples for every combination of cell types. Otherwise 'size' (uniform over the
+                                number of cell types in a mixture) or 'bernoulli' (each cell type present independently, following
+                                the prior) to sample the combinations, so the cost does not grow with the number of cell types.
+                                'nsamples' is then the total number of augmented samples, eg (5000, 5000, 1000).
+    augment_combinations        'all' to augment train and calibration samples for every combination of cell types, or 'mixtures'
+                                for only the combinations seen in the mixture data and the single cell types. The test data always
+                                covers all combinations. Also used for the final models.
 """
 
 params = {
@@ -68,29 +82,66 @@ params = {
     # as already exists but is not used in the augment_data function. For this, the values have to be between 0 and 1.
     'priors_list': [
         [1, 1, 1, 1, 1, 1, 1, 1],
-    ]
+    ],
+
+    'reweight_priors': False,
+
+    'combination_distribution': None,
+
+    'augment_combinations': 'all',
 }
 
-if __name__ == '__main__':
+# reduced settings for quick (profiling) iterations, see --smoke
+SMOKE_PARAMS = {
+    'nsamples': (5, 5, 2),
+}
+SMOKE_NFOLDS = 1
+SMOKE_SAMPLES_PER_COMBINATION = 2
+
+
+def reset_seeds():
     random.seed(42)
     np.random.seed(42)
 
-    warnings.filterwarnings(
-        "ignore")  # to ignore RuntimeError: divide by zero.
 
-    scenarios = []
+def run_nfold_scenario(target_classes_str, save_path, updates, nfolds):
+    """
+    Runs the nfold analysis with params updated with updates and makes its plots.
+    """
+    reset_seeds()
+    scenario_params = dict(params, **updates)
+    plot_path = os.path.join(save_path, 'plots')
+
+    # the plots are kept, makeplots only renders the figures of which the fold results changed
+    shutil.rmtree(os.path.join(save_path, 'picklesaves'), ignore_errors=True)
+    os.makedirs(plot_path, exist_ok=True)
+    os.makedirs(os.path.join(save_path, 'picklesaves'))
+    with instrumentation.context(scenario=save_path):
+        nfold_analysis(nfolds=nfolds, tc=target_classes_str, savepath=save_path, **scenario_params)
 
+        # shutil.rmtree(plot_path, ignore_errors=True)
+        # os.makedirs(plot_path)
+
+        with instrumentation.span('makeplots'):
+            makeplots(nfolds=nfolds, tc=target_classes_str,
+                      path=os.path.join(save_path, 'picklesaves'),
+                      savepath=os.path.join(save_path, 'plots'), **scenario_params)
+
+
+def vm_all_clf(root, smoke):
     # fig 4, 6
     target_classes_vm = \
         ['Vaginal.mucosa and/or Menstrual.secretion']
-    save_path_vm = os.path.join('output', 'vm_all_clf')
-    updates = {}
-    scenarios.append((target_classes_vm, save_path_vm, updates, 10))
+    save_path_vm = os.path.join(root, 'output', 'vm_all_clf')
+    updates = dict(SMOKE_PARAMS) if smoke else {}
+    run_nfold_scenario(target_classes_vm, save_path_vm, updates, SMOKE_NFOLDS if smoke else 10)
+
 
+def vm_priors_all_clf(root, smoke):
     # fig 7
     target_classes_priors = \
         ['Vaginal.mucosa and/or Menstrual.secretion']
-    save_path_priors = os.path.join('output', 'vm_priors_all_clf')
+    save_path_priors = os.path.join(root, 'output', 'vm_priors_all_clf')
     param_update_priors = {'priors_list': [[10, 1, 1, 1, 1, 1, 1, 1],
                                            [1, 1, 10, 1, 1, 1, 1, 1],
                                            [1, 1, 1, 1, 1, 1, 10, 1],
@@ -98,62 +149,49 @@ if __name__ == '__main__':
                            'binarize_list': [True],
                            'softmax_list': [False],
                            }
-    scenarios.append((target_classes_priors, save_path_priors,
-                      param_update_priors, 1))
+    if smoke:
+        param_update_priors.update(SMOKE_PARAMS)
+    run_nfold_scenario(target_classes_priors, save_path_priors, param_update_priors, 1)
 
+
+def all_cell_types_mlr(root, smoke):
     # fig 5
     target_classes_all = \
         ['Vaginal.mucosa and/or Menstrual.secretion', 'Saliva',
          'Nasal.mucosa', 'Blood and/or Menstrual.secretion',
          'Semen.fertile and/or Semen.sterile', 'Skin']
-    save_path_all = os.path.join('output', 'all_cell_types_mlr')
+    save_path_all = os.path.join(root, 'output', 'all_cell_types_mlr')
     param_update_all = {'models_list': [['MLR', True], ],
                         'priors_list': [[1, 1, 1, 1, 1, 1, 1, 1], ],
                         'binarize_list': [True],
                         'softmax_list': [False],
                         }
-    scenarios.append((target_classes_all, save_path_all,
-                      param_update_all, 10))
-
-    for target_classes_str, save_path, updates, nfolds in scenarios:
-        params.update(updates)
-        random.seed(42)
-        np.random.seed(42)
-        plot_path = os.path.join(save_path, 'plots')
-
-        shutil.rmtree(save_path, ignore_errors=True)
-        os.makedirs(save_path)
-        os.makedirs(plot_path)
-        os.makedirs(os.path.join(save_path, 'picklesaves'))
-        nfold_analysis(nfolds=nfolds, tc=target_classes_str, savepath=save_path, **params)
-
-        # shutil.rmtree(plot_path, ignore_errors=True)
-        # os.makedirs(plot_path)
+    if smoke:
+        param_update_all.update(SMOKE_PARAMS)
+    run_nfold_scenario(target_classes_all, save_path_all, param_update_all, SMOKE_NFOLDS if smoke else 10)
 
-        makeplots(nfolds=nfolds, tc=target_classes_str,
-                  path=os.path.join(save_path, 'picklesaves'),
-                  savepath=os.path.join(save_path, 'plots'), **params)
 
-    random.seed(42)
-    np.random.seed(42)
+def final_models(root, smoke):
+    n_samples_per_combination = SMOKE_SAMPLES_PER_COMBINATION if smoke else 10
+    reset_seeds()
 
     # fig 8a, fig 9
-    save_path = os.path.join('final_model', 'no_penile')
+    save_path = os.path.join(root, 'final_model', 'no_penile')
     os.makedirs(save_path, exist_ok=True)
     get_final_trained_mlr_model(
         tc=sorted(['Vaginal.mucosa and/or Menstrual.secretion'] + list(
             constants.single_cell_types)),
         single_cell_types=constants.single_cell_types,
         retrain=True,
-        n_samples_per_combination=10,
+        n_samples_per_combination=n_samples_per_combination,
         binarize=True, from_penile=False, prior=[1] + [1] * 7,
-        model_name='vagmenstr_no_penile', save_path=save_path)
+        model_name='vagmenstr_no_penile', save_path=save_path,
+        augment_combinations=params['augment_combinations'])
 
-    random.seed(42)
-    np.random.seed(42)
+    reset_seeds()
 
     # fig 8b, table 1
-    save_path = os.path.join('final_model', 'with_penile')
+    save_path = os.path.join(root, 'final_model', 'with_penile')
     os.makedirs(save_path, exist_ok=True)
     sct = ['Blood', 'Saliva', 'Vaginal.mucosa', 'Menstrual.secretion',
            'Semen.fertile', 'Semen.sterile', 'Nasal.mucosa', 'Skin',
@@ -163,29 +201,35 @@ if __name__ == '__main__':
                   list(constants.single_cell_types)),
         single_cell_types=sct,
         retrain=True,
-        n_samples_per_combination=10,
+        n_samples_per_combination=n_samples_per_combination,
         binarize=True, from_penile=True, prior=[1] + [1] * 8,
-        model_name='vagmenstr_with_penile', save_path=save_path)
+        model_name='vagmenstr_with_penile', save_path=save_path,
+        augment_combinations=params['augment_combinations'])
+
 
+def sankey(root, smoke):
     # fig 10
     plot_sankey_data()
 
+
+def calibration_example_scenario(root, smoke):
     # fig 3
-    calibration_example('output')
+    calibration_example(os.path.join(root, 'output'))
+
 
+def alternative_h2(root, smoke):
     # not included in paper; analysis of differently structured H1, H2 pair. (shows similar results)
-    random.seed(42)
-    np.random.seed(42)
+    reset_seeds()
 
     # fig alternative H2
-    save_path = os.path.join('final_model', 'no_penile', 'H2=blood')
+    save_path = os.path.join(root, 'final_model', 'no_penile', 'H2=blood')
     os.makedirs(save_path, exist_ok=True)
     get_final_trained_mlr_model(
         tc=sorted(['Vaginal.mucosa and/or Menstrual.secretion'] + list(
             constants.single_cell_types)),
         single_cell_types=constants.single_cell_types,
         retrain=True,
-        n_samples_per_combination=10,
+        n_samples_per_combination=SMOKE_SAMPLES_PER_COMBINATION if smoke else 10,
         binarize=True, from_penile=False, prior=[1] + [1] * 7,
         model_name='vagmenstr_no_penile', save_path=save_path,
         alternative_hypothesis=['Blood'], samples_to_evaluate=np.array([
@@ -198,4 +242,58 @@ if __name__ == '__main__':
             # blood
             [1, 1, 1, ] + [0] * 12,
             # semen
-            [0] * 12 + [1, 1, 1,]]))
\ No newline at end of file
+            [0] * 12 + [1, 1, 1,]]))
+
+
+# in the order they are run by default
+SCENARIOS = OrderedDict([
+    ('vm_all_clf', vm_all_clf),
+    ('vm_priors_all_clf', vm_priors_all_clf),
+    ('all_cell_types_mlr', all_cell_types_mlr),
+    ('final_models', final_models),
+    ('sankey', sankey),
+    ('calibration_example', calibration_example_scenario),
+    ('alternative_h2', alternative_h2),
+])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run the analyses of the article.')
+    parser.add_argument('scenarios', nargs='*', metavar='scenario',
+                        help='scenarios to run, all if none are given. Choose from {}'.format(', '.join(SCENARIOS)))
+    parser.add_argument('--smoke', action='store_true',
+                        help='run with fewer folds and augmented samples, and write the results in smoke/')
+    parser.add_argument('--profile', choices=['cprofile', 'sample'], default=None,
+                        help='profile each scenario with cProfile (.prof files) or a sampling profiler '
+                             '(collapsed stacks for flame graphs)')
+    parser.add_argument('--profile-dir', default=None,
+                        help='folder to write the profiles to, one per scenario. Defaults to output/profiles')
+    args = parser.parse_args(argv)
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error('unknown scenarios: {}'.format(', '.join(unknown)))
+
+    reset_seeds()
+
+    warnings.filterwarnings(
+        "ignore")  # to ignore RuntimeError: divide by zero.
+
+    root = 'smoke' if args.smoke else ''
+    # time and memory per stage of the nfold analyses, see rna/instrumentation.py
+    instrumentation.enable(os.path.join(root, 'output', 'instrumentation.jsonl'))
+    profile_dir = args.profile_dir or os.path.join(root, 'output', 'profiles')
+
+    for name in args.scenarios or SCENARIOS:
+        print('running {}'.format(name))
+        if args.profile:
+            profiling.profile_call(SCENARIOS[name], args.profile, os.path.join(profile_dir, name), root,
+                                   args.smoke)
+        else:
+            SCENARIOS[name](root, args.smoke)
+
+    instrumentation.print_summary()
+    instrumentation.disable()
+
+
+if __name__ == '__main__':
+    main()
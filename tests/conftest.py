@@ -0,0 +1,60 @@
+import sys
+import types
+
+import numpy as np
+import pytest
+
+from rna.lr_system import DL_PACKAGE, import_dl_module
+
+
+@pytest.fixture
+def synthetic_data():
+    """
+    Seeds the global random state and returns a small data set of 300 samples of 4 cell types and 6 markers, in which
+    each cell type expresses a fixed random subset of the markers, with 10 % noise.
+
+    :return: X: 300 x 6 binary array of the measurements, y_nhot: 300 x 4 n hot encoded labels
+    """
+    np.random.seed(0)
+    n_celltypes = 4
+    y_nhot = np.random.randint(2, size=(300, n_celltypes))
+    X = np.clip(y_nhot @ np.random.randint(2, size=(n_celltypes, 6)) + (np.random.rand(300, 6) < .1), 0, 1)
+    return X, y_nhot
+
+
+@pytest.fixture
+def dl_implementation(monkeypatch):
+    """
+    Imports the modules of dl-implementation (see rna.lr_system.import_dl_module). If keras is not installed, minimal
+    stand-ins for the keras and tensorflow names these modules import are put in sys.modules, so that the parts that
+    only use numpy can be tested. The modules are imported anew for every test.
+
+    :return: function that imports a module of dl-implementation by its name, e.g. 'generator'
+    """
+    try:
+        import keras  # noqa: F401
+    except ImportError:
+        class Placeholder:
+            def __init__(self, *args, **kwargs):
+                pass
+
+        names = {
+            'keras': {'Input': Placeholder, 'Model': Placeholder},
+            'keras.utils': {'Sequence': Placeholder},
+            'keras.callbacks': {'TensorBoard': Placeholder, 'Callback': Placeholder, 'ModelCheckpoint': Placeholder},
+            'keras.layers': {'Dense': Placeholder, 'Dropout': Placeholder},
+            'tensorflow': {'Tensor': Placeholder},
+            'tensorflow.contrib.labeled_tensor.python.ops.core': {'Scalar': Placeholder},
+        }
+        for name, attributes in names.items():
+            module = types.ModuleType(name)
+            module.__dict__.update(attributes)
+            monkeypatch.setitem(sys.modules, name, module)
+
+    def forget_dl_modules():
+        for name in [name for name in sys.modules if name.split('.')[0] == DL_PACKAGE]:
+            del sys.modules[name]
+
+    forget_dl_modules()
+    yield import_dl_module
+    forget_dl_modules()
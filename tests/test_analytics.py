@@ -1,5 +1,18 @@
-from rna.lr_system import get_mixture_columns_for_class
+import pickle
+
+import numpy as np
+import pytest
+from sklearn.linear_model import LogisticRegression
+from sklearn.multiclass import OneVsRestClassifier
+from sklearn.neural_network import MLPClassifier
+
+from rna.analytics import clf_with_correct_settings
+from rna.augment import MultiLabelEncoder
+from rna import lr_system
+from rna.lr_system import get_mixture_columns_for_class, convert_prob_to_marginal_per_class, augmented_batches, \
+    configure_keras_threads, fit_with_sample_weight
 from rna.constants import single_cell_types
+from rna.utils import project_on_target_classes
 
 
 def test_get_mixture_columns_for_class():
@@ -38,3 +51,103 @@ def test_get_mixture_columns_for_class():
     assert get_mixture_columns_for_class(target_class, priors) == []
 
 
+def test_convert_prob_to_marginal_per_class_with_codes():
+    # 12 cell types, of which only a few combinations are seen
+    N = 12
+    np.random.seed(0)
+    codes = np.unique(np.random.randint(1, 2 ** N, 40))
+    prob = np.random.dirichlet(np.ones(len(codes)), 5)
+    target_classes = np.eye(N, dtype=int)[[0, 3, 11]]
+    target_classes[1, 4] = 1
+
+    # the same probabilities over all 2 ** N combinations
+    prob_all_combinations = np.zeros((5, 2 ** N))
+    prob_all_combinations[:, codes] = prob
+
+    lrs = convert_prob_to_marginal_per_class(prob, target_classes, 10, label_powerset_codes=codes)
+    lrs_all_combinations = convert_prob_to_marginal_per_class(prob_all_combinations, target_classes, 10)
+    assert lrs.shape == (5, 3)
+    assert np.allclose(lrs, lrs_all_combinations)
+
+
+def test_predict_lrs_for_hypotheses(synthetic_data):
+    X, y_nhot = synthetic_data
+    n_celltypes = y_nhot.shape[1]
+    target_classes = np.array([[1, 0, 0, 0], [0, 1, 1, 0]])
+    model = clf_with_correct_settings('MLR', True, n_classes=-1, with_calibration=True)
+    model.fit_classifier(X, MultiLabelEncoder(n_celltypes).nhot_to_labels(y_nhot))
+    model.fit_calibration(X, y_nhot, target_classes)
+
+    hypotheses = [(target_classes[0], None, None), (target_classes[1], [1, .5, .5, .5], None),
+                  (target_classes[0], [.5, .5, .5, 0], [.5, 1, .5, 0]), (target_classes[1], None, [0, .5, .5, .5])]
+    lrs = model.predict_lrs_for_hypotheses(X, hypotheses)
+    assert lrs.shape == (300, len(hypotheses))
+    for i, (target_class, priors_numerator, priors_denominator) in enumerate(hypotheses):
+        assert np.array_equal(lrs[:, i], model.predict_lrs(X, np.array([target_class]), priors_numerator,
+                                                           priors_denominator)[:, 0])
+
+
+@pytest.mark.parametrize('n_target_classes', [1, 2, 4])
+def test_predict_lrs_for_hypotheses_of_sigmoid_model(n_target_classes, synthetic_data):
+    X, y_nhot = synthetic_data
+    n_celltypes = y_nhot.shape[1]
+    target_classes = np.eye(n_celltypes, dtype=int)[:n_target_classes]
+    model = clf_with_correct_settings('MLP', False, n_classes=-1, with_calibration=True)
+    model.fit_classifier(X, project_on_target_classes(y_nhot, target_classes))
+    # the probabilities of the target classes are no probabilities of combinations of cell types
+    with pytest.raises(ValueError):
+        model.predict_lrs_for_hypotheses(X, [(target_classes[0], None, None)])
+
+
+def test_augmented_batches():
+    X = np.arange(10).reshape(5, 2)
+    y = np.array([2, 0, 1, 2, 0])
+    batches = augmented_batches(X, y, 2, 3, sample_weight=np.arange(5), random_state=0)
+    epoch = [next(batches) for _ in range(3)]
+    assert [len(X_batch) for X_batch, _, _ in epoch] == [2, 2, 1]
+    # every sample once per epoch, with its one hot encoded label and weight
+    rows = np.concatenate([X_batch for X_batch, _, _ in epoch])[:, 0].astype(int) // 2
+    assert sorted(rows) == list(range(5))
+    assert np.array_equal(np.concatenate([y_batch for _, y_batch, _ in epoch]), np.eye(3)[y[rows]])
+    assert np.array_equal(np.concatenate([weights for _, _, weights in epoch]), rows)
+    assert epoch[0][0].dtype == np.float32
+
+
+@pytest.mark.parametrize('softmax', [True, False])
+def test_dl_classifier(softmax, synthetic_data):
+    pytest.importorskip('keras')
+    X, y_nhot = synthetic_data
+    n_celltypes = y_nhot.shape[1]
+    target_classes = np.array([[1, 0, 0, 0], [0, 1, 1, 0]])
+    model = clf_with_correct_settings('DL', softmax, n_classes=len(target_classes), with_calibration=True)
+    model._classifier.epochs = 2
+    model._classifier.units = 8
+    if softmax:
+        model.fit_classifier(X, MultiLabelEncoder(n_celltypes).nhot_to_labels(y_nhot))
+    else:
+        model.fit_classifier(X, project_on_target_classes(y_nhot, target_classes))
+    model.fit_calibration(X, y_nhot, target_classes)
+
+    lrs = model.predict_lrs(X, target_classes)
+    assert lrs.shape == (300, len(target_classes))
+    assert np.all(lrs > 0)
+
+    # the network is pickled as its architecture and weights
+    restored = pickle.loads(pickle.dumps(model))
+    assert np.allclose(restored.predict_lrs(X, target_classes), lrs)
+
+
+def test_configure_keras_threads_once(monkeypatch):
+    monkeypatch.setattr(lr_system, '_keras_threads', 2)
+    configure_keras_threads(2)
+    with pytest.raises(ValueError):
+        configure_keras_threads(4)
+
+
+def test_fit_with_sample_weight(synthetic_data):
+    X, y_nhot = synthetic_data
+    weights = np.random.rand(len(X))
+    classifier = fit_with_sample_weight(OneVsRestClassifier(LogisticRegression()), X, y_nhot, weights)
+    assert classifier.predict_proba(X).shape == y_nhot.shape
+    with pytest.raises(ValueError):
+        fit_with_sample_weight(MLPClassifier(), X, y_nhot, weights)
@@ -1,6 +1,7 @@
 import numpy as np
 
-from rna.augment import augment_data, MultiLabelEncoder
+from rna.augment import augment_data, MultiLabelEncoder, prior_to_sample_weights, make_nhot_matrix_of_combinations, \
+    sample_combinations, mixtures_are_compatible_with_H1_H2_or_both, augment_splitted_data, observed_combinations
 from rna.constants import single_cell_types
 from rna.input_output import get_data_per_cell_type
 from rna.utils import string2vec
@@ -59,6 +60,82 @@ def test_augment_data():
                            round(relative_occurrence_without_celltype, 5)
 
 
+def test_augment_observed_combinations():
+    mle = MultiLabelEncoder(len(single_cell_types))
+    X_single, y_nhot_single, n_celltypes, n_features, _, label_encoder, _, _ = get_data_per_cell_type(
+        filename='../Datasets/Dataset_NFI_rv.xlsx', single_cell_types=single_cell_types, remove_structural=True)
+    y_single = mle.transform_single(mle.nhot_to_labels(y_nhot_single))
+    y_nhot_mixtures = np.zeros((4, n_celltypes), dtype=int)
+    y_nhot_mixtures[[0, 0, 1, 1, 2, 2, 2, 3, 3, 3], [0, 1, 0, 1, 2, 3, 4, 2, 3, 4]] = 1
+
+    combinations = observed_combinations(y_nhot_mixtures, n_celltypes)
+    # two mixtures and the single cell types
+    assert len(combinations) == 2 + n_celltypes
+    augmented_data = augment_splitted_data(X_single, y_single, X_single, y_single, X_single, y_single,
+                                           y_nhot_mixtures, n_celltypes, n_features, label_encoder, None, True, False,
+                                           [2, 2, 1], disallowed_mixtures=None, combinations=combinations)
+    # train and calibration samples only for the observed combinations, test samples for all
+    for y_nhot in (augmented_data.y_train_nhot_augmented, augmented_data.y_calib_nhot_augmented):
+        assert np.array_equal(np.unique(y_nhot, axis=0), np.unique(combinations, axis=0))
+    assert len(np.unique(augmented_data.y_test_nhot_augmented, axis=0)) == 2 ** n_celltypes
+
+
+def test_prior_to_sample_weights():
+    """
+    Tests that weighting uniformly augmented data gives the same relative occurrence of cell types as augmenting with
+    the prior, also for more than two unique prior values.
+    """
+    y_nhot = np.repeat(make_nhot_matrix_of_combinations(len(single_cell_types)), 3, axis=0)
+
+    weights = prior_to_sample_weights(y_nhot, [1] * 8)
+    assert np.allclose(weights, 1)
+
+    for prior, odds in [([10, 1, 1, 1, 1, 1, 1, 1], [10, 1, 1, 1, 1, 1, 1, 1]),
+                        ([1, 10, 10, 10, 10, 10, 10, 10], [.1, 1, 1, 1, 1, 1, 1, 1]),
+                        ([10, 1, 1, 1, 1, 1, 5, .5], [10, 1, 1, 1, 1, 1, 5, .5])]:
+        weights = prior_to_sample_weights(y_nhot, prior)
+        assert np.isclose(np.mean(weights), 1)
+        for i_celltype in range(len(single_cell_types)):
+            with_celltype = np.sum(weights[y_nhot[:, i_celltype] == 1])
+            without_celltype = np.sum(weights[y_nhot[:, i_celltype] == 0])
+            assert np.isclose(with_celltype / without_celltype, odds[i_celltype])
+
+
+def test_sample_combinations():
+    """
+    Tests that sampled combinations follow the prior and never match a disallowed mixture, for more cell types than
+    could be enumerated.
+    """
+    np.random.seed(0)
+    n_celltypes = 16
+    prior = [1] * n_celltypes
+    prior[0] = 10
+    # no mixtures with the second cell type but without the third
+    disallowed_mixtures = [[0, 1, -1] + [0] * (n_celltypes - 3)]
+
+    y_nhot = sample_combinations(20000, n_celltypes, 'bernoulli', prior, disallowed_mixtures)
+    assert y_nhot.shape == (20000, n_celltypes)
+    assert not np.any((y_nhot[:, 1] == 1) & (y_nhot[:, 2] == 0))
+    assert abs(np.mean(y_nhot[:, 0]) - 10 / 11) < 0.01
+    assert abs(np.mean(y_nhot[:, 5]) - 0.5) < 0.02
+
+    y_nhot = sample_combinations(20000, n_celltypes, 'size', celltypes_to_sample=list(range(1, n_celltypes)))
+    assert np.all(y_nhot[:, 0] == 0)
+    sizes = np.sum(y_nhot, axis=1)
+    assert sizes.min() == 0 and sizes.max() == n_celltypes - 1
+    assert np.std(np.bincount(sizes)) < 0.1 * 20000 / n_celltypes
+
+
+def test_mixtures_are_compatible_with_H1_H2_or_both():
+    y_nhot = make_nhot_matrix_of_combinations(5)
+    # no mixtures with the first cell type that lack the second, and none with both the fourth and fifth
+    disallowed_mixtures = [[1, -1, 0, 0, 0], [0, 0, 0, 1, 1]]
+
+    compatible = mixtures_are_compatible_with_H1_H2_or_both(y_nhot, disallowed_mixtures)
+    expected = ~(((y_nhot[:, 0] == 1) & (y_nhot[:, 1] == 0)) | ((y_nhot[:, 3] == 1) & (y_nhot[:, 4] == 1)))
+    assert np.array_equal(compatible, expected)
+    assert np.all(mixtures_are_compatible_with_H1_H2_or_both(y_nhot, None))
+
 if __name__ == '__main__':
 
 
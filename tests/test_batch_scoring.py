@@ -0,0 +1,37 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from rna.batch_scoring import make_label_encoder, parse_prior, prior_to_string
+from rna.constants import marker_names
+from rna.input_output import read_case_data
+
+
+def test_read_case_data(tmp_path):
+    # two samples of two replicates and one sample of three replicates, of which the housekeeping markers are absent
+    values = np.full((7, len(marker_names)), 1000)
+    values[4:, -2:] = 0
+    df = pd.DataFrame(values, columns=marker_names, index=['a', 'a', 'b', 'b', 'c', 'c', 'c'])
+    df['replicate_value'] = [1, 2, 1, 2, 1, 2, 3]
+    filename = str(tmp_path / 'case.csv')
+    df.to_csv(filename, sep=';')
+
+    X, sample_names, valid, markers = read_case_data(filename)
+    assert markers == marker_names
+    assert sample_names == ['a', 'b', 'c']
+    assert valid.tolist() == [True, True, False]
+    assert X.shape == (3, len(marker_names) - 4)
+    assert np.all(X == 1)
+
+
+def test_parse_prior():
+    label_encoder = make_label_encoder()
+    prior = parse_prior('Saliva=always, Blood=Never', label_encoder)
+    assert prior[int(label_encoder.transform(['Saliva']))] == 1
+    assert prior[int(label_encoder.transform(['Blood']))] == 0
+    assert sum(value == .5 for value in prior) == len(label_encoder.classes_) - 2
+    assert prior_to_string(prior, label_encoder) == 'Blood=never,Saliva=always'
+    assert parse_prior(None, label_encoder) is None
+
+    with pytest.raises(ValueError):
+        parse_prior('Saliva=sometimes', label_encoder)
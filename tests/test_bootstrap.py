@@ -0,0 +1,45 @@
+import numpy as np
+
+from rna.augment import MultiLabelEncoder
+from rna.bootstrap import LrPercentileAccumulator, bootstrap_lrs
+from rna.constants import single_cell_types
+from rna.input_output import get_data_per_cell_type
+from rna.utils import string2vec
+
+
+def test_lr_percentile_accumulator():
+    np.random.seed(0)
+    log_lrs = np.random.normal(0, 2, size=(50, 3, 200))
+    accumulator = LrPercentileAccumulator(50, 3, bin_width=0.01, max_bootstraps=200)
+    for b in range(log_lrs.shape[2]):
+        accumulator.add(10 ** log_lrs[:, :, b])
+    assert accumulator.counts.sum() == log_lrs.size
+
+    for q in [2.5, 50, 97.5]:
+        # the empirical percentile, taking the lowest value with at least q % at or below it
+        expected = np.sort(log_lrs, axis=2)[:, :, int(np.ceil(q / 100 * 200)) - 1]
+        assert np.all(np.abs(np.log10(accumulator.percentile(q)) - expected) <= 0.005 + 1e-9)
+
+    # with the default bins, the histogram is smaller than the LRs of 100 replicates
+    assert LrPercentileAccumulator(50, 3).counts.nbytes < 50 * 3 * 100 * 8
+    assert LrPercentileAccumulator(50, 3, max_bootstraps=1000).counts.dtype == np.uint16
+
+
+def test_bootstrap_lrs_pool_equals_serial():
+    mle = MultiLabelEncoder(len(single_cell_types))
+    X_single, y_nhot_single, n_celltypes, n_features, n_per_celltype, label_encoder, present_markers, \
+        present_celltypes = get_data_per_cell_type(filename='../Datasets/Dataset_NFI_rv.xlsx',
+                                                   single_cell_types=single_cell_types, remove_structural=True)
+    y_single = mle.transform_single(mle.nhot_to_labels(y_nhot_single))
+    target_classes = string2vec(['Skin', 'Vaginal.mucosa and/or Menstrual.secretion'], label_encoder)
+    X_eval = np.random.RandomState(0).randint(2, size=(5, n_features))
+
+    def run(n_jobs):
+        return bootstrap_lrs(X_single, y_single, X_eval, target_classes, None, n_celltypes, n_features,
+                             label_encoder, [1] * n_celltypes, n_samples_per_combination=2, n_bootstraps=3,
+                             seed=1, n_jobs=n_jobs)
+
+    serial, pooled = run(1), run(2)
+    for expected, actual in zip(serial[:3], pooled[:3]):
+        assert np.array_equal(expected, actual)
+    assert np.array_equal(serial[3].counts, pooled[3].counts)
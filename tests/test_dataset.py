@@ -0,0 +1,76 @@
+import numpy as np
+import pandas as pd
+
+from rna.dataset import Dataset, read_dataset, read_df
+
+
+def write_csv(path):
+    # a: two replicates, b: three replicates of which the housekeeping markers are absent, Blank: one replicate,
+    # a again: a new sample as the replicate value does not increase, with its housekeeping markers below the cut-off
+    markers = ['m1', 'm2', 'hk1', 'hk2']
+    values = np.array([[200, 0, 500, 500], [100, 0, 0, 500],
+                       [300, 300, 0, 0], [0, 0, 0, 0], [0, 0, 0, 0],
+                       [0, 0, 0, 0],
+                       [0, 160, 100, 0]])
+    df = pd.DataFrame(values, columns=markers, index=['a', 'a', 'b', 'b', 'b', 'Blank', 'a'])
+    df['replicate_value'] = [1, 2, 1, 2, 3, 1, 1]
+    df.to_csv(str(path), sep=';')
+    return values
+
+
+def test_dataset(tmp_path):
+    values = write_csv(tmp_path / 'data.csv')
+    dataset = Dataset.from_frame(*read_df(str(tmp_path / 'data.csv')))
+
+    assert dataset.types.tolist() == ['a', 'b', 'Blank', 'a']
+    assert dataset.offsets.tolist() == [0, 2, 5, 6, 7]
+    assert dataset.replicate_types().tolist() == ['a', 'a', 'b', 'b', 'b', 'Blank', 'a']
+    samples = dataset.samples()
+    assert np.array_equal(samples[1], values[2:5])
+    # the samples are views on the values
+    assert all(np.shares_memory(sample, dataset.values) for sample in samples)
+    assert np.array_equal(dataset.means()[0], values[:2].mean(axis=0))
+
+    assert dataset.housekeeping_valid().tolist() == [True, False, True, True]
+    assert dataset.binarized().housekeeping_valid().tolist() == [True, False, True, False]
+    assert dataset.markers_detected(['m1', 'm2'], 150).tolist() == [False, True, False, False]
+
+    selected = dataset.select([False, True, False, True])
+    assert selected.types.tolist() == ['b', 'a']
+    assert np.array_equal(selected.samples()[1], values[6:])
+    assert np.array_equal(selected.samples(markers=['hk2', 'm1'])[0], values[2:5, [3, 0]])
+
+
+def test_read_dataset(tmp_path):
+    write_csv(tmp_path / 'data.csv')
+    cache_dir = str(tmp_path / 'cache')
+
+    dataset = read_dataset(str(tmp_path / 'data.csv'), cache_dir=cache_dir)
+    # parsed once per process
+    assert read_dataset(str(tmp_path / 'data.csv'), cache_dir=cache_dir) is dataset
+    assert not dataset.values.flags.writeable
+
+    # another process loads the cached arrays, memory-mapped
+    cached = Dataset.load(str(next((tmp_path / 'cache').iterdir())))
+    assert isinstance(cached.values, np.memmap)
+    assert np.array_equal(cached.values, dataset.values)
+    assert np.array_equal(cached.offsets, dataset.offsets)
+    assert cached.types.tolist() == dataset.types.tolist()
+    assert cached.markers == dataset.markers == ['m1', 'm2', 'hk1', 'hk2']
+
+
+def test_read_dataset_with_text_columns(tmp_path):
+    values = write_csv(tmp_path / 'data.csv')
+    df = pd.read_csv(str(tmp_path / 'data.csv'), sep=';', index_col=0)
+    # an export with a sample id and a date per replicate
+    df.insert(1, 'sample_id', ['s{}'.format(i) for i in range(len(df))])
+    df['date'] = '2020-01-01'
+    df.to_csv(str(tmp_path / 'export.csv'), sep=';')
+
+    dataset = read_dataset(str(tmp_path / 'export.csv'))
+    assert dataset.markers == ['m1', 'm2', 'hk1', 'hk2']
+    assert np.array_equal(dataset.values, values)
+
+    dataset = read_dataset(str(tmp_path / 'export.csv'), markers=['hk2', 'm1'])
+    assert dataset.markers == ['hk2', 'm1']
+    assert np.array_equal(dataset.values, values[:, [3, 0]])
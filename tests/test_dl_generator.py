@@ -0,0 +1,121 @@
+import random
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.preprocessing import LabelEncoder
+
+
+def make_samples():
+    # three replicates per single sample and one per mixture, every replicate unique so that it can be traced back
+    x = [np.arange(i * 6, i * 6 + 6).reshape(3, 2) * 10. for i in range(6)] + [np.array([[1000., 2000.]])] * 2
+    y = ['a', 'a', 'b', 'c', 'c', 'Blank', 'a+b', 'b+c']
+    encoder = LabelEncoder().fit(['a', 'b', 'c'])
+    return x, y, encoder
+
+
+def test_sample_pool(dl_implementation):
+    generator = dl_implementation('generator')
+    x, y, encoder = make_samples()
+    samples_per_type = {'a': x[:2], 'Blank': x[5:6], 'a+b': x[6:7]}
+    pool = generator.SamplePool(samples_per_type, encoder, ['Blank'])
+    assert len(pool) == 3
+
+    type_idx = np.array([2, 0, 1, 2])
+    rows, classes = pool.label_indices(np.array([5, 6, 7, 8]), type_idx)
+    # a+b has two labels, a one and the blank none
+    assert rows.tolist() == [5, 5, 6, 8, 8]
+    assert classes.tolist() == [0, 1, 0, 0, 1]
+
+    rng = np.random.RandomState(0)
+    type_idx = rng.randint(len(pool), size=100)
+    drawn = pool.draw(type_idx, 'single', rng)
+    for sample_type, replicate in zip(type_idx, drawn):
+        candidates = np.concatenate(samples_per_type[pool.types[sample_type]])
+        assert any(np.array_equal(replicate, candidate) for candidate in candidates)
+    means = pool.draw(type_idx, 'avg', rng)
+    for sample_type, mean in zip(type_idx, means):
+        assert any(np.array_equal(mean, np.mean(replicates, 0))
+                   for replicates in samples_per_type[pool.types[sample_type]])
+
+
+def test_augmented_samples_distribution(dl_implementation):
+    generator = dl_implementation('generator')
+    x, y, encoder = make_samples()
+    data_generator = generator.DataGenerator(x, y, encoder, ['Blank'], n_features=2,
+                                             sampling={'single': 0, 'mixture': 0, 'augment': 1}, batch_size=3000,
+                                             seed=0)
+    x_batch, y_batch = data_generator[0]
+    # two different classes per sample, in the same proportions as _generate_augmented_sample draws them
+    assert np.all(y_batch.sum(axis=1) == 2)
+    pairs = Counter(tuple(labels) for labels in y_batch)
+    random.seed(0)
+    expected = Counter()
+    for _ in range(3000):
+        _, sample_types = data_generator._generate_augmented_sample()
+        expected[tuple(np.isin(encoder.classes_, sample_types).astype(int))] += 1
+    assert pairs.keys() == expected.keys()
+    for pair in pairs:
+        assert abs(pairs[pair] - expected[pair]) < 150
+
+    # each sample is the sum of a replicate of both classes
+    replicates = {sample_type: np.concatenate([x_ for x_, y_ in zip(x, y) if y_ == sample_type]) / 1000
+                  for sample_type in encoder.classes_}
+    for sample, labels in zip(x_batch[:100], y_batch[:100]):
+        first, second = encoder.classes_[labels == 1]
+        sums = replicates[first][:, None, :] + replicates[second][None, :, :]
+        assert np.any(np.all(np.isclose(sums, sample), axis=2))
+
+
+def test_empty_mixture_pool(dl_implementation):
+    generator = dl_implementation('generator')
+    x, y, encoder = make_samples()
+    with pytest.raises(ValueError, match='mixture'):
+        generator.DataGenerator(x[:6], y[:6], encoder, ['Blank'], n_features=2)
+    # without mixtures in the sampling, the generator does not need them
+    generator.DataGenerator(x[:6], y[:6], encoder, ['Blank'], n_features=2,
+                            sampling={'single': 1, 'mixture': 0, 'augment': 1})
+
+
+def test_batches_are_reproducible(dl_implementation):
+    generator = dl_implementation('generator')
+    x, y, encoder = make_samples()
+    sampling = {'single': 1, 'mixture': 1, 'augment': 1}
+    data_generator = generator.DataGenerator(x, y, encoder, ['Blank'], n_features=2, sampling=sampling,
+                                             batch_size=16, batches_per_epoch=4, seed=3)
+    other = generator.DataGenerator(x, y, encoder, ['Blank'], n_features=2, sampling=sampling, batch_size=16,
+                                    batches_per_epoch=4, seed=3)
+    # the same batches, whatever the order in which they are requested
+    batches = [data_generator[index] for index in range(4)]
+    for index in [3, 1, 0, 2, 1]:
+        for expected, actual in zip(batches[index], other[index]):
+            assert np.array_equal(expected, actual)
+
+    # other batches in the next epoch
+    data_generator.on_epoch_end()
+    assert not np.array_equal(data_generator[0][0], batches[0][0])
+
+
+def test_read_data(dl_implementation, tmp_path):
+    generator = dl_implementation('generator')
+    # a: two replicates, b: three replicates, Blank: one replicate, a again: a sample without m1
+    values = np.array([[200, 0, 500], [100, 0, 0],
+                       [0, 300, 0], [300, 0, 0], [0, 0, 0],
+                       [400, 0, 0],
+                       [0, 160, 100]])
+    df = pd.DataFrame(values, columns=['m1', 'm2', 'hk'], index=['a', 'a', 'b', 'b', 'b', 'Blank', 'a'])
+    df['replicate_value'] = [1, 2, 1, 2, 3, 1, 1]
+    df.to_csv(str(tmp_path / 'data.csv'), sep=';')
+    cols = {'type': 0, 'replicate': 'replicate_value', 'validation': ['m1'], 'prediction': ['m1', 'hk']}
+    labels = {'blanks': ['Blank'], 'filter': ['b']}
+
+    # a sample is valid if m1 is above the cut-off in one of its replicates
+    x, y = generator.read_data(str(tmp_path / 'data.csv'), cols, labels, cut_off=150, apply_filter=False)
+    assert y == ['a', 'b']
+    assert np.array_equal(x[0], values[:2][:, [0, 2]])
+    assert np.array_equal(x[1], values[2:5][:, [0, 2]])
+
+    x, y = generator.read_data(str(tmp_path / 'data.csv'), cols, labels, cut_off=150, include_blanks=True)
+    assert y == ['a', 'Blank']
+    assert np.array_equal(x[1], values[5:6][:, [0, 2]])
@@ -0,0 +1,40 @@
+import numpy as np
+from sklearn.preprocessing import LabelEncoder
+
+
+class ThresholdModel:
+    """
+    Predicts the classes whose marker is above 1, and records the batch sizes it is asked to predict with.
+    """
+    def __init__(self):
+        self.batch_sizes = []
+
+    def predict(self, x, batch_size):
+        self.batch_sizes.append(batch_size)
+        return (x > 1).astype(float)
+
+
+def test_metrics_per_type(dl_implementation):
+    generator = dl_implementation('generator')
+    model = dl_implementation('model')
+    # one marker per class
+    x = [np.array([[2000., 0, 0], [1000., 0, 0]]), np.array([0, 3000., 0]), np.array([[0, 0, 0.]]),
+         np.array([[2000., 0, 2000.]])]
+    y = ['a', 'b', 'Blank', 'a+c']
+    encoder = LabelEncoder().fit(['a', 'b', 'c'])
+    eval_generator = generator.EvalGenerator(x, y, encoder, ['Blank'], n_features=3)
+
+    callback = model.MetricsPerType(eval_generator, batch_size=64)
+    callback.model = ThresholdModel()
+    callback.on_train_end()
+
+    assert list(callback.x) == ['single', 'mixture']
+    # replicates are averaged and the values divided by 1000, as without a cut-off
+    assert np.array_equal(callback.x['single'], [[1.5, 0, 0], [0, 3, 0], [0, 0, 0]])
+    assert np.array_equal(callback.x['mixture'], [[2, 0, 2]])
+    # the blank has no labels
+    assert np.array_equal(callback.y_true['single'], [[1, 0, 0], [0, 1, 0], [0, 0, 0]])
+    assert np.array_equal(callback.y_true['mixture'], [[1, 0, 1]])
+    assert np.array_equal(callback.y_pred['single'], callback.y_true['single'])
+    # one prediction per sample group, in batches of the given size
+    assert callback.model.batch_sizes == [64, 64]
@@ -0,0 +1,92 @@
+import pickle
+import queue
+
+import numpy as np
+import pandas as pd
+
+from rna.analytics import clf_with_correct_settings
+from rna.augment import MultiLabelEncoder
+from rna.constants import marker_names
+from rna.gui import ScoringJob, ScoringWorker
+from test_scoring_service import ScaledSumModel
+
+
+def write_case(tmp_path):
+    model_path = str(tmp_path / 'model')
+    with open(model_path, 'wb') as f:
+        pickle.dump(ScaledSumModel(1), f)
+    df = pd.DataFrame(np.full((4, len(marker_names)), 1000), columns=marker_names, index=['a', 'a', 'b', 'b'])
+    df['replicate_value'] = [1, 2, 1, 2]
+    case_path = str(tmp_path / 'case.csv')
+    df.to_csv(case_path, sep=';')
+    return model_path, case_path
+
+
+def test_scoring_worker(tmp_path):
+    model_path, case_path = write_case(tmp_path)
+
+    progress = queue.Queue()
+    worker = ScoringWorker(progress, models={'vagmenstr_no_penile': model_path})
+    worker.start()
+    # several files are scored without restarting
+    jobs = [ScoringJob(case_path, str(tmp_path / 'lrs{}.csv'.format(i)), 2, False, None, None) for i in range(2)]
+    for job in jobs:
+        worker.submit(job)
+    for job in jobs:
+        messages = []
+        while True:
+            kind, reported_job, message = progress.get(timeout=10)
+            assert reported_job is job
+            if kind == 'done':
+                break
+            assert kind == 'stage'
+            messages.append(message.split(' (')[0])
+        assert messages == ['read case file', 'load model', 'calculate LRs', 'write results']
+        lrs = pd.read_csv(job.save_filename, sep=';')
+        assert lrs['sample'].tolist() == ['a', 'b']
+
+    worker.cancel()
+    worker.stop()
+    worker.join(timeout=10)
+    assert not worker.is_alive()
+
+
+def test_cancel_scoring_worker(tmp_path):
+    model_path, case_path = write_case(tmp_path)
+    progress = queue.Queue()
+    worker = ScoringWorker(progress, models={'vagmenstr_no_penile': model_path})
+    jobs = [ScoringJob(case_path, str(tmp_path / 'lrs{}.csv'.format(i)), 2, False, None, None) for i in range(3)]
+    worker.submit(jobs[0])
+    worker.submit(jobs[1])
+    worker.cancel()
+    # only the jobs submitted before cancelling are cancelled, however late the worker starts them
+    worker.submit(jobs[2])
+    worker.start()
+    reported = [progress.get(timeout=10)[:2] for _ in range(2)]
+    assert reported == [('cancelled', jobs[0]), ('cancelled', jobs[1])]
+    while True:
+        kind, job, _ = progress.get(timeout=10)
+        assert job is jobs[2]
+        if kind == 'done':
+            break
+    worker.stop()
+    worker.join(timeout=10)
+
+
+def test_calculate_lrs_reuses_forward_pass(synthetic_data):
+    X, y_nhot = synthetic_data
+    n_celltypes = y_nhot.shape[1]
+    target_classes = np.array([[1, 0, 0, 0], [0, 1, 1, 0]])
+    model = clf_with_correct_settings('MLR', True, n_classes=-1, with_calibration=True)
+    model.fit_classifier(X, MultiLabelEncoder(n_celltypes).nhot_to_labels(y_nhot))
+    model.fit_calibration(X, y_nhot, target_classes)
+
+    predict_proba = model._classifier.predict_proba
+    calls = []
+    model._classifier.predict_proba = lambda X: calls.append(len(X)) or predict_proba(X)
+    worker = ScoringWorker(queue.Queue(), models={})
+    for priors_numerator, priors_denominator in [(None, None), ([1, .5, .5, .5], None), (None, [.5, .5, 0, .5])]:
+        lrs = worker.calculate_lrs(model, X, target_classes, priors_numerator, priors_denominator)
+        assert np.allclose(lrs, model.predict_lrs(X, target_classes, priors_numerator, priors_denominator))
+    # the classifier ran once for the worker, and once for each predict_lrs
+    assert calls == [300] * 4
@@ -0,0 +1,19 @@
+import os
+import subprocess
+import sys
+
+# seconds; importing the classifier backends and plotting takes about a second
+IMPORT_BUDGET = .5
+
+
+def test_import_lr_system():
+    code = ("import sys, time\n"
+            "start = time.perf_counter()\n"
+            "import rna.lr_system\n"
+            "print(time.perf_counter() - start)\n"
+            "print(','.join(m for m in ('sklearn', 'xgboost', 'lir', 'matplotlib') if m in sys.modules))\n")
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.run([sys.executable, '-c', code], cwd=root, check=True, stdout=subprocess.PIPE,
+                            universal_newlines=True).stdout.splitlines()
+    assert output[1] == ''
+    assert float(output[0]) < IMPORT_BUDGET
@@ -0,0 +1,42 @@
+import json
+
+import numpy as np
+import pytest
+
+from rna import instrumentation
+
+
+def test_instrumentation(tmp_path):
+    # disabled: nothing is recorded
+    with instrumentation.span('fit') as span:
+        span.add_arrays(X=np.zeros(3))
+    assert not instrumentation.is_enabled()
+
+    path = str(tmp_path / 'log.jsonl')
+    recorder = instrumentation.enable(path)
+    try:
+        with instrumentation.context(fold=0, model='MLR'):
+            with instrumentation.context(prior='[1, 1]'):
+                with instrumentation.span('fit') as span:
+                    span.add_arrays(X=np.zeros((4, 2)), samples=[np.zeros((2, 2))] * 3)
+            with pytest.raises(ValueError):
+                with instrumentation.span('predict', extra=1):
+                    raise ValueError()
+        with instrumentation.span('pickle'):
+            pass
+        instrumentation.count('models fitted')
+        instrumentation.count('models fitted', 2)
+        summary = recorder.summary()
+    finally:
+        instrumentation.disable()
+
+    with open(path) as f:
+        records = [json.loads(line) for line in f]
+    assert [record.get('stage') for record in records] == ['fit', 'predict', 'pickle', None]
+    assert records[0]['fold'] == 0 and records[0]['model'] == 'MLR' and records[0]['prior'] == '[1, 1]'
+    assert records[0]['arrays'] == {'X': {'shape': [4, 2], 'nbytes': 64}, 'samples': {'len': 3}}
+    assert records[0]['wall'] >= 0 and records[0]['cpu'] >= 0
+    assert records[1]['extra'] == 1 and records[1]['error'] == 'ValueError' and 'prior' not in records[1]
+    assert 'fold' not in records[2]
+    assert records[3] == {'counters': {'models fitted': 3}}
+    assert list(summary) == ['fit', 'predict', 'pickle'] and summary['fit']['n'] == 1
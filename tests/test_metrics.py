@@ -0,0 +1,87 @@
+import numpy as np
+from lir import calculate_cllr
+from lir.calibration import IsotonicCalibrator
+from sklearn.isotonic import IsotonicRegression
+from sklearn.metrics import roc_curve, auc
+
+from rna.metrics import LrMetrics, PavCalibrator, get_lr_metrics, pav, pav_posteriors
+
+
+def test_lr_metrics():
+    np.random.seed(0)
+    labels = np.random.rand(500) < .4
+    # rounded, so there are ties
+    lrs = 10 ** np.round(np.random.randn(500) + labels, 1)
+    loglrs_h1 = np.log10(lrs[labels])
+    loglrs_h2 = np.log10(lrs[~labels])
+    metrics = LrMetrics(lrs, labels)
+
+    fpr, tpr, _ = roc_curve(labels, lrs, drop_intermediate=False)
+    assert np.allclose(metrics.roc(), (fpr, tpr))
+    assert np.isclose(metrics.auc(), auc(fpr, tpr))
+
+    (tippett_lrs_h1, fractions_h1), (tippett_lrs_h2, _) = metrics.tippett()
+    # close rather than equal: the vectorised log10 of numpy 2 may differ in the last bit between array positions
+    assert np.allclose(tippett_lrs_h1, np.sort(loglrs_h1)[::-1], rtol=0, atol=1e-12)
+    assert np.allclose(tippett_lrs_h2, np.sort(loglrs_h2)[::-1], rtol=0, atol=1e-12)
+    assert np.array_equal(fractions_h1, np.arange(1, labels.sum() + 1) / labels.sum())
+
+    assert metrics.false_positive_rate() == np.mean(loglrs_h2 > 0)
+    assert metrics.false_negative_rate() == np.mean(loglrs_h1 < 0)
+
+    calibrator = IsotonicCalibrator()
+    calibrator.fit(lrs, labels.astype(int))
+    pav_lrs = np.clip(calibrator.transform(lrs), 1e-10, 1e10)
+    assert np.allclose(np.sort(metrics.pav_lrs()[metrics.sorted_labels]), np.sort(pav_lrs[labels]))
+
+    prior = .2
+    odds = prior / (1 - prior)
+    ece = prior * np.mean(np.log2(1 + 1 / (lrs[labels] * odds))) + \
+        (1 - prior) * np.mean(np.log2(1 + lrs[~labels] * odds))
+    assert np.allclose(metrics.ece([prior]), [ece])
+    # at even odds the ECE is the Cllr
+    assert np.isclose(metrics.ece([.5])[0], metrics.cllr())
+    assert metrics.cllr(pav=True) <= metrics.cllr()
+
+    # the metrics are computed once per set of LRs
+    assert get_lr_metrics(lrs, labels) is get_lr_metrics(lrs.copy(), labels.astype(int))
+
+
+def test_pav():
+    np.random.seed(0)
+    values = np.random.randn(5000)
+    weights = np.random.rand(5000) + .1
+    expected = IsotonicRegression().fit_transform(np.arange(5000), values, sample_weight=weights)
+    assert np.allclose(pav(values, weights), expected)
+    # only merged on the stack
+    assert np.allclose(pav(values, weights, max_vectorized_passes=0), expected)
+
+    labels = np.random.rand(2000) < .3
+    for decimals in (1, 6):
+        # with and without ties
+        lrs = 10 ** np.round(np.random.randn(2000) + 1.5 * labels, decimals)
+        calibrator = IsotonicCalibrator().fit(lrs, labels.astype(int))
+        pav_calibrator = PavCalibrator().fit(lrs, labels)
+        # outside the range of the LRs fitted on, both give nan
+        x = 10 ** np.linspace(-6, 6, 200)
+        assert np.allclose(pav_calibrator.transform(x), calibrator.transform(x), equal_nan=True)
+        assert np.allclose(pav_calibrator.transform(lrs), calibrator.transform(lrs))
+
+        metrics = LrMetrics(lrs, labels)
+        assert np.isclose(metrics.cllr_min(), calculate_cllr(lrs[~labels], lrs[labels]).cllr_min)
+        assert metrics.cllr_min() <= metrics.cllr()
+
+
+def test_lr_metrics_of_one_class():
+    lrs = np.array([.1, 2, 30])
+    for labels, posterior in ((np.ones(3, dtype=bool), 1), (np.zeros(3, dtype=bool), 0)):
+        assert np.array_equal(pav_posteriors(lrs, labels), [posterior] * 3)
+
+    metrics = LrMetrics(lrs, np.ones(3, dtype=bool))
+    assert np.isnan(metrics.false_positive_rate())
+    assert metrics.false_negative_rate() == 1 / 3
+    assert np.all(metrics.pav_lrs() == 10 ** 10)
+    metrics = LrMetrics(lrs, np.zeros(3, dtype=bool))
+    assert metrics.false_positive_rate() == 2 / 3
+    assert np.isnan(metrics.false_negative_rate())
+    assert np.all(metrics.pav_lrs() == 10 ** -10)
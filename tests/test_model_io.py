@@ -0,0 +1,37 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from rna.analytics import clf_with_correct_settings
+from rna.augment import MultiLabelEncoder
+from rna.model_io import save_model, load_model
+
+
+@pytest.mark.parametrize('classifier,softmax', [('MLR', False), ('MLR', True), ('MLP', False)])
+def test_save_and_load_model(tmp_path, classifier, softmax, synthetic_data):
+    X, y_nhot = synthetic_data
+    n_celltypes = y_nhot.shape[1]
+    target_classes = np.array([[1, 0, 0, 0], [0, 1, 1, 0], [0, 0, 0, 1]])
+    y = MultiLabelEncoder(n_celltypes).nhot_to_labels(y_nhot) if softmax else y_nhot
+
+    model = clf_with_correct_settings(classifier, softmax, n_classes=-1, with_calibration=True)
+    model.fit_classifier(X, y)
+    model.fit_calibration(X, y_nhot, target_classes)
+    path = str(tmp_path / 'model')
+    save_model(model, path, ['a', 'b', 'c', 'd'], target_classes)
+
+    loaded = load_model(path)
+    priors = [1, .5, .5, 0] if softmax else None
+    assert np.allclose(loaded.predict_lrs(X, target_classes, priors_numerator=priors),
+                       model.predict_lrs(X, target_classes, priors_numerator=priors))
+
+    # a model trained with other markers is refused
+    with open(os.path.join(path, 'manifest.json')) as f:
+        manifest = json.load(f)
+    manifest['marker_names'] = manifest['marker_names'][:-1]
+    with open(os.path.join(path, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f)
+    with pytest.raises(ValueError):
+        load_model(path)
@@ -0,0 +1,96 @@
+import importlib
+import json
+import os
+import sys
+
+import numpy as np
+import pytest
+from matplotlib import pyplot as plt
+
+from rna.plot_queue import PlotQueue, PlotError, module_source_hash
+
+
+def plot_line(values, savefig=None):
+    plt.plot(values)
+    plt.savefig(savefig)
+
+
+def plot_failing(savefig=None):
+    raise ValueError('cannot plot')
+
+
+@pytest.mark.parametrize('n_jobs', [1, 2])
+def test_plot_queue(tmp_path, n_jobs):
+    plot_queue = PlotQueue(n_jobs)
+    plot_queue.add(plot_line, [1, 2, 3], savefig=str(tmp_path / 'a.png'))
+    plot_queue.add(plot_failing, savefig=str(tmp_path / 'b.png'))
+    plot_queue.add(plot_line, [3, 2, 1], savefig=str(tmp_path / 'c.png'), name='c')
+    assert len(plot_queue) == 3
+
+    with pytest.raises(PlotError) as e:
+        plot_queue.run()
+    assert [job.name for job, _ in e.value.failures] == [str(tmp_path / 'b.png')]
+    assert 'cannot plot' in e.value.failures[0][1]
+    assert sorted(os.listdir(str(tmp_path))) == ['a.png', 'c.png']
+    assert len(plot_queue) == 0
+
+
+def test_plot_queue_manifest(tmp_path, capsys):
+    manifest_path = str(tmp_path / 'figures.json')
+
+    def queue_figures(values_b):
+        plot_queue = PlotQueue(1, manifest_path=manifest_path)
+        plot_queue.add(plot_line, np.array([1, 2, 3]), savefig=str(tmp_path / 'a.png'))
+        plot_queue.add(plot_line, values_b, savefig=str(tmp_path / 'b.png'))
+        plot_queue.run()
+        return capsys.readouterr().out
+
+    assert 'rendering 2 figures, 0 up to date' in queue_figures(np.array([3, 2, 1]))
+    assert 'rendering 0 figures, 2 up to date' in queue_figures(np.array([3, 2, 1]))
+    # only the figure of which the data changed is rendered again
+    assert 'rendering 1 figures, 1 up to date' in queue_figures(np.array([3, 2, 0]))
+    os.remove(str(tmp_path / 'a.png'))
+    assert 'rendering 1 figures, 1 up to date' in queue_figures(np.array([3, 2, 0]))
+
+    with open(manifest_path) as f:
+        figures = json.load(f)['figures']
+    assert sorted(figures) == [str(tmp_path / 'a.png'), str(tmp_path / 'b.png')]
+    assert figures[str(tmp_path / 'b.png')]['files'] == [str(tmp_path / 'b.png')]
+
+
+def test_module_source_hash(tmp_path, monkeypatch):
+    # a plotting module that gets its numbers from another module of its package
+    package = tmp_path / 'figures_package'
+    package.mkdir()
+    (package / '__init__.py').write_text('')
+    (package / 'numbers.py').write_text('def values():\n    return [1, 2, 3]\n')
+    (package / 'plots.py').write_text('from figures_package.numbers import values\n\n\n'
+                                      'def plot(savefig=None):\n    return values()\n')
+    monkeypatch.syspath_prepend(str(tmp_path))
+    importlib.import_module('figures_package.plots')
+    try:
+        first_hash = module_source_hash('figures_package.plots')
+        module_source_hash.cache_clear()
+        (package / 'numbers.py').write_text('def values():\n    return [3, 2, 1]\n')
+        # the figures are rendered again when the module that computes the numbers changes
+        assert module_source_hash('figures_package.plots') != first_hash
+    finally:
+        module_source_hash.cache_clear()
+        for name in ('figures_package', 'figures_package.numbers', 'figures_package.plots'):
+            sys.modules.pop(name, None)
+
+
+def test_plot_queue_names(tmp_path):
+    manifest_path = str(tmp_path / 'figures.json')
+    plot_queue = PlotQueue(1, manifest_path=manifest_path)
+    # the name of one figure is the start of the name of the other
+    plot_queue.add(plot_line, [1, 2, 3], savefig=str(tmp_path / 'lrs_Skin'))
+    plot_queue.add(plot_line, [3, 2, 1], savefig=str(tmp_path / 'lrs_Skin_and_Blood'))
+    with pytest.raises(ValueError):
+        plot_queue.add(plot_line, [1, 1, 1], savefig=str(tmp_path / 'lrs_Skin'))
+    plot_queue.run()
+
+    with open(manifest_path) as f:
+        figures = json.load(f)['figures']
+    assert figures[str(tmp_path / 'lrs_Skin')]['files'] == [str(tmp_path / 'lrs_Skin.png')]
+    assert figures[str(tmp_path / 'lrs_Skin_and_Blood')]['files'] == [str(tmp_path / 'lrs_Skin_and_Blood.png')]
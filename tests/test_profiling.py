@@ -0,0 +1,25 @@
+import pstats
+import time
+
+from rna.profiling import profile_call
+
+
+def busy(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+    return seconds
+
+
+def test_profile_call(tmp_path):
+    assert profile_call(busy, 'cprofile', str(tmp_path / 'busy'), .01) == .01
+    stats = pstats.Stats(str(tmp_path / 'busy.prof'))
+    assert any(function_name == 'busy' for _, _, function_name in stats.stats)
+
+    assert profile_call(busy, 'sample', str(tmp_path / 'busy'), .2) == .2
+    with open(str(tmp_path / 'busy.collapsed')) as f:
+        lines = f.read().splitlines()
+    assert len(lines) > 0
+    stack, count = lines[0].rsplit(' ', 1)
+    assert int(count) > 0
+    assert 'test_profiling.py:busy' in stack.split(';')[-1]
@@ -0,0 +1,110 @@
+import pickle
+import threading
+
+import numpy as np
+
+from rna.analytics import clf_with_correct_settings
+from rna import scoring_service
+from rna.model_io import save_model
+from rna.scoring_service import ScoringService, RemoteModel, make_server
+
+
+class ScaledSumModel():
+    """
+    Stands in for a trained MarginalClassifier: the LR of a target class is the sum of the sample times a factor.
+    """
+
+    def __init__(self, factor):
+        self.factor = factor
+
+    def predict_lrs(self, X, target_classes, priors_numerator=None, priors_denominator=None):
+        return np.repeat(X.sum(axis=1, keepdims=True) * self.factor, len(target_classes), axis=1)
+
+
+def test_scoring_service(tmp_path):
+    path = str(tmp_path / 'model')
+    with open(path, 'wb') as f:
+        pickle.dump(ScaledSumModel(1), f)
+    service = ScoringService({'model': path})
+    server = make_server(service, port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        model = RemoteModel('http://127.0.0.1:{}'.format(server.server_address[1]), 'model')
+        target_classes = np.eye(3)[:2]
+
+        # concurrent requests are scored together, but each gets its own LRs
+        X = [np.random.randint(2, size=(i + 1, 4)) for i in range(8)]
+        lrs = [None] * len(X)
+
+        def score(i):
+            lrs[i] = model.predict_lrs(X[i], target_classes)
+
+        threads = [threading.Thread(target=score, args=(i,)) for i in range(len(X))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for X_i, lrs_i in zip(X, lrs):
+            assert np.array_equal(lrs_i, np.repeat(X_i.sum(axis=1, keepdims=True), 2, axis=1))
+        first_hash = model.model_hash
+
+        # the model is reloaded when its file changes
+        with open(path, 'wb') as f:
+            pickle.dump(ScaledSumModel(2), f)
+        assert np.array_equal(model.predict_lrs(np.ones((1, 4)), target_classes), [[8, 8]])
+        assert model.model_hash != first_hash
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_reload_while_saving(tmp_path, synthetic_data):
+    X, y_nhot = synthetic_data
+    n_celltypes = y_nhot.shape[1]
+    target_classes = np.eye(n_celltypes, dtype=int)[:2]
+    models = []
+    for seed in range(2):
+        model = clf_with_correct_settings('MLP', False, n_classes=-1, with_calibration=True)
+        model._classifier.random_state = seed
+        model.fit_classifier(X, y_nhot)
+        model.fit_calibration(X, y_nhot, target_classes)
+        models.append(model)
+    expected = [model.predict_lrs(X, target_classes) for model in models]
+
+    path = str(tmp_path / 'model')
+    save_model(models[0], path, ['a', 'b', 'c', 'd'], target_classes)
+    service = ScoringService({'model': path})
+
+    def save():
+        for i in range(1, 40):
+            save_model(models[i % 2], path, ['a', 'b', 'c', 'd'], target_classes)
+
+    thread = threading.Thread(target=save)
+    thread.start()
+    # every reload gives a complete model, also while it is being replaced
+    while thread.is_alive():
+        model, _ = service.get_model('model')
+        lrs = model.predict_lrs(X, target_classes)
+        assert any(np.allclose(lrs, expected_i) for expected_i in expected)
+    thread.join()
+    assert np.allclose(service.get_model('model')[0].predict_lrs(X, target_classes), expected[1])
+
+
+def test_main_reports_corrupt_model(tmp_path, monkeypatch, capsys):
+    path = tmp_path / 'model'
+    path.mkdir()
+    (path / 'manifest.json').write_text('{"classifier": ')
+
+    class InterruptedServer():
+        server_address = ('127.0.0.1', 0)
+
+        def serve_forever(self):
+            raise KeyboardInterrupt
+
+        def server_close(self):
+            pass
+
+    monkeypatch.setattr(scoring_service, 'make_server', lambda service, port: InterruptedServer())
+    monkeypatch.setattr(scoring_service, 'RELOAD_RETRY_DELAY', 0)
+    scoring_service.main(['--model', 'corrupt={}'.format(path), '--port', '0'])
+    assert 'cannot load model corrupt' in capsys.readouterr().out